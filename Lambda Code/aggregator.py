@@ -1,100 +1,471 @@
 import json
 import os
+import math
+import time
+import random
 import boto3
 from botocore.exceptions import ClientError
 import logging
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from instrumentation import metrics, instrumented, log_payload
+from histograms import bin_counts
+from post_shards import (
+    SHARD_COUNT_ATTRIBUTE, SHARD_OF_ATTRIBUTE, shard_key, shard_count, is_counter,
+    merge_counters, load_shards, summary_update, average_update
+)
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-class CommentAggregator:
+# TransactWriteItems nhận tối đa 100 items
+TRANSACT_MAX_ITEMS = 100
+TRANSACT_MAX_RETRIES = 3
+
+# Lý do huỷ transaction / lỗi cho thấy item của post đang bị ghi quá tải
+CONTENTION_CODES = {
+    'TransactionConflict', 'ThrottlingError', 'ProvisionedThroughputExceeded',
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'
+}
+
+# Message attribute đánh dấu kết quả đã được cộng trong processor (fused mode)
+AGGREGATED_ATTRIBUTE = 'aggregated'
+
+# Rollup theo phút, giờ, ngày: prefix của sort key và định dạng thời gian (UTC)
+ROLLUP_GRANULARITIES = [
+    ('m', '%Y-%m-%dT%H:%M'),
+    ('h', '%Y-%m-%dT%H'),
+    ('d', '%Y-%m-%d')
+]
+
+class DeltaPublisher:
     def __init__(self):
-        """Initialize aggregator with AWS services"""
-        self.dynamodb = boto3.resource('dynamodb')
-        self.table = self.dynamodb.Table(os.environ['DYNAMODB_TABLE'])
+        """Push per-post metric deltas to dashboard WebSocket connections"""
+        endpoint = os.environ.get('WEBSOCKET_ENDPOINT')
+        connections_table = os.environ.get('CONNECTIONS_TABLE')
+        self.enabled = bool(endpoint and connections_table)
+        self.deltas = {}
+        if self.enabled:
+            self.client = boto3.client('apigatewaymanagementapi', endpoint_url=endpoint)
+            self.connections = boto3.resource('dynamodb').Table(connections_table)
+
+    def record(self, post_id, comments):
+        """Accumulate the metrics of comments that were actually applied"""
+        if not self.enabled or not comments:
+            return
+        delta = self.deltas.setdefault(post_id, {
+            'post_id': post_id,
+            'total_comments': 0,
+            'sentiment_sum': 0.0,
+            'toxic_sum': 0.0
+        })
+        delta['total_comments'] += len(comments)
+        delta['sentiment_sum'] += sum(float(c.get('sentiment_score', 0)) for c in comments)
+        delta['toxic_sum'] += sum(float(c.get('toxic_score', 0)) for c in comments)
+
+    def flush(self):
+        """Send all accumulated deltas as one message to every connection"""
+        if not self.enabled or not self.deltas:
+            return 0
+        message = json.dumps({
+            'type': 'post_deltas',
+            'timestamp': datetime.now().isoformat(),
+            'deltas': list(self.deltas.values())
+        }).encode('utf-8')
+        self.deltas = {}
 
-    def initialize_post_metrics(self, post_id, comments):
-        """Initialize metrics for a new post"""
+        sent = 0
         try:
-            total_comments = len(comments)
-            sentiment_sum = sum(float(c.get('sentiment_score', 0)) for c in comments)
-            toxic_sum = sum(float(c.get('toxic_score', 0)) for c in comments)
-            
-            # Count languages
-            language_counts = {}
-            for comment in comments:
-                lang = comment.get('language', 'unknown')
-                language_counts[lang] = language_counts.get(lang, 0) + 1
-
-            self.table.put_item(
-                Item={
-                    'post_id': post_id,
-                    'total_comments': total_comments,
-                    'sentiment_sum': Decimal(str(sentiment_sum)),
-                    'toxic_sum': Decimal(str(toxic_sum)),
-                    'average_sentiment': Decimal(str(sentiment_sum / total_comments)),
-                    'average_toxic': Decimal(str(toxic_sum / total_comments)),
-                    'language_distribution': language_counts,
-                    'last_updated': datetime.now().isoformat()
-                }
-            )
-            logger.info(f"Initialized metrics for post {post_id}")
-            return True
+            scan_args = {'ProjectionExpression': 'connection_id'}
+            while True:
+                response = self.connections.scan(**scan_args)
+                for item in response.get('Items', []):
+                    connection_id = item['connection_id']
+                    try:
+                        self.client.post_to_connection(ConnectionId=connection_id, Data=message)
+                        sent += 1
+                    except self.client.exceptions.GoneException:
+                        # Client đã ngắt kết nối mà không qua $disconnect
+                        self.connections.delete_item(Key={'connection_id': connection_id})
+                    except Exception as e:
+                        logger.error(f"Error pushing delta to {connection_id}: {str(e)}")
+                if 'LastEvaluatedKey' not in response:
+                    break
+                scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
         except Exception as e:
-            logger.error(f"Error initializing metrics: {str(e)}")
-            return False
+            # Push chỉ là thông báo, lỗi không làm hỏng batch đã ghi thành công
+            logger.error(f"Error publishing deltas: {str(e)}")
+        return sent
 
-    def store_aggregation(self, post_id, new_comments):
-        """Update aggregated data in DynamoDB using atomic updates"""
+class ShardPlanner:
+    # Giữ qua các lần gọi warm của Lambda, giống cache của processor
+    _rates = {}
+    _counts = {}
+    _contended = set()
+
+    def __init__(self):
+        """Pick how many shard items a post's counters are spread over.
+
+        The write rate of each post is an exponentially decayed count of
+        updates per second seen by this container. Throttled or conflicting
+        writes mean other containers are writing the same item too, so they
+        double the shard count.
+        """
+        self.enabled = os.environ.get('HOT_POST_SHARDING', 'true').lower() == 'true'
+        self.writes_per_shard = float(os.environ.get('HOT_POST_WRITES_PER_SHARD', '5'))
+        self.max_shards = int(os.environ.get('HOT_POST_MAX_SHARDS', '16'))
+        self.window_seconds = float(os.environ.get('HOT_POST_RATE_WINDOW_SECONDS', '10'))
+
+    def shard_count(self, post_id):
+        return self._counts.get(post_id, 1)
+
+    def set_shard_count(self, post_id, count):
+        self._counts[post_id] = count
+
+    def record_write(self, post_id, now=None):
+        now = time.time() if now is None else now
+        rate, last_seen = self._rates.get(post_id, (0.0, now))
+        decay = math.exp(-(now - last_seen) / self.window_seconds)
+        self._rates[post_id] = (rate * decay + 1 / self.window_seconds, now)
+
+    def record_contention(self, post_id):
+        self._contended.add(post_id)
+
+    def write_rate(self, post_id, now=None):
+        now = time.time() if now is None else now
+        rate, last_seen = self._rates.get(post_id, (0.0, now))
+        return rate * math.exp(-(now - last_seen) / self.window_seconds)
+
+    def desired(self, post_id):
+        """Shard count for the observed write rate; shard counts never shrink"""
+        current = self.shard_count(post_id)
+        if not self.enabled:
+            return current
+        desired = max(current, math.ceil(self.write_rate(post_id) / self.writes_per_shard))
+        if post_id in self._contended:
+            self._contended.discard(post_id)
+            desired = max(desired, current * 2)
+        return min(desired, self.max_shards)
+
+def rollup_buckets(comment):
+    """Return the minute, hour and day bucket keys for a comment's timestamp"""
+    ts = datetime.fromtimestamp(int(comment.get('timestamp', 0)), tz=timezone.utc)
+    return [f"{prefix}#{ts.strftime(fmt)}" for prefix, fmt in ROLLUP_GRANULARITIES]
+
+def is_aggregated(record):
+    """True for audit copies of results that were already aggregated upstream"""
+    attribute = record.get('messageAttributes', {}).get(AGGREGATED_ATTRIBUTE, {})
+    return attribute.get('stringValue') == 'true'
+
+class CommentAggregator:
+    def __init__(self, table_name=None):
+        """Initialize aggregator with AWS services"""
+        self.dynamodb = boto3.resource('dynamodb')
+        self.table = self.dynamodb.Table(table_name or os.environ['DYNAMODB_TABLE'])
+        # Bảng idempotency: mỗi comment chỉ được cộng vào aggregate một lần
+        self.idempotency_table = os.environ.get('IDEMPOTENCY_TABLE')
+        self.idempotency_ttl_days = int(os.environ.get('IDEMPOTENCY_TTL_DAYS', '14'))
+        # Bảng rollup theo thời gian (post_id, bucket)
+        self.rollup_table = os.environ.get('ROLLUP_TABLE')
+        self.publisher = DeltaPublisher()
+        self.planner = ShardPlanner()
+        # post_id -> counter mới của item gốc trả về từ ADD, để làm mới trung bình không cần đọc lại
+        self.totals = {}
+
+    def build_update(self, key, new_comments):
+        """Build a single update that ADDs counts, sums, per-language counters and histogram bins.
+
+        Averages are not stored; readers derive them from the sums and
+        total_comments, so concurrent invocations never see them out of sync.
+        """
+        sentiment_sum = sum(float(c.get('sentiment_score', 0)) for c in new_comments)
+        toxic_sum = sum(float(c.get('toxic_score', 0)) for c in new_comments)
+        
+        # Count languages
+        new_lang_counts = {}
+        for comment in new_comments:
+            lang = comment.get('language', 'unknown')
+            new_lang_counts[lang] = new_lang_counts.get(lang, 0) + 1
+
+        add_clauses = ['total_comments :inc', 'sentiment_sum :sent', 'toxic_sum :tox']
+        names = {}
+        values = {
+            ':inc': len(new_comments),
+            ':sent': Decimal(str(sentiment_sum)),
+            ':tox': Decimal(str(toxic_sum)),
+            ':ts': datetime.now().isoformat()
+        }
+        # Mỗi ngôn ngữ là một attribute riêng (lang_vi, lang_en, ...) để ADD được
+        for i, (lang, count) in enumerate(sorted(new_lang_counts.items())):
+            names[f'#lang{i}'] = f'lang_{lang}'
+            values[f':lang{i}'] = count
+            add_clauses.append(f'#lang{i} :lang{i}')
+        # Histogram sentiment/toxic: chỉ ADD các bin có comment
+        for name, count in sorted(bin_counts(new_comments).items()):
+            values[f':{name}'] = count
+            add_clauses.append(f'{name} :{name}')
+
+        update = {
+            'Key': key,
+            'UpdateExpression': 'ADD ' + ', '.join(add_clauses) + ' SET last_updated = :ts',
+            'ExpressionAttributeValues': values
+        }
+        if names:
+            update['ExpressionAttributeNames'] = names
+        return update
+
+    def build_rollup_updates(self, post_id, comments):
+        """Build one ADD update per minute, hour and day bucket touched by the comments.
+
+        ``post_id`` is the rollup partition: the post itself or one of its shards.
+        """
+        if not self.rollup_table:
+            return []
+        buckets = {}
+        for comment in comments:
+            for bucket in rollup_buckets(comment):
+                buckets.setdefault(bucket, []).append(comment)
+
+        updates = []
+        for bucket, bucket_comments in sorted(buckets.items()):
+            update = self.build_update({'post_id': post_id, 'bucket': bucket}, bucket_comments)
+            update['TableName'] = self.rollup_table
+            updates.append(update)
+        return updates
+
+    def build_post_updates(self, post_id, comments, shards=1):
+        """Build the post (or shard) item update followed by its rollup bucket updates"""
+        if shards > 1:
+            # Post nóng: ghi vào một shard ngẫu nhiên, cùng shard cho rollup
+            item_id = shard_key(post_id, random.randrange(shards))
+            update = self.build_update({'post_id': item_id}, comments)
+            update['UpdateExpression'] += f', {SHARD_OF_ATTRIBUTE} = :of'
+            update['ExpressionAttributeValues'][':of'] = post_id
+        else:
+            item_id = post_id
+            update = self.build_update({'post_id': post_id}, comments)
+            page_id = next((c['metadata']['page_id'] for c in comments if c.get('metadata', {}).get('page_id')), None)
+            if page_id:
+                # page_id là partition key của các GSI tóm tắt cho GET /posts
+                update['UpdateExpression'] += ', page_id = if_not_exists(page_id, :page)'
+                update['ExpressionAttributeValues'][':page'] = page_id
+            # Item gốc chỉ còn là bản tóm tắt sau khi post bị chia shard
+            update['ConditionExpression'] = f'attribute_not_exists({SHARD_COUNT_ATTRIBUTE})'
+        update['TableName'] = self.table.name
+        return [update] + self.build_rollup_updates(item_id, comments)
+
+    def load_shard_count(self, post_id):
+        """Read the current shard count of a post from its base item"""
+        item = self.table.get_item(
+            Key={'post_id': post_id},
+            ProjectionExpression=SHARD_COUNT_ATTRIBUTE,
+            ConsistentRead=True
+        ).get('Item')
+        count = shard_count(item)
+        self.planner.set_shard_count(post_id, count)
+        return count
+
+    def reshard(self, post_id, current, desired):
+        """Raise the shard count of a post.
+
+        The first split moves the base item's counters into shard 0 in the
+        same transaction that sets shard_count, conditioned on the counters
+        being unchanged; later splits only add empty shards.
+        """
+        client = self.dynamodb.meta.client
         try:
-            # Calculate metrics for new comments
-            total_new = len(new_comments)
-            sentiment_sum = sum(float(c.get('sentiment_score', 0)) for c in new_comments)
-            toxic_sum = sum(float(c.get('toxic_score', 0)) for c in new_comments)
-            
-            # Count languages
-            new_lang_counts = {}
-            for comment in new_comments:
-                lang = comment.get('language', 'unknown')
-                new_lang_counts[lang] = new_lang_counts.get(lang, 0) + 1
+            if current <= 1:
+                item = self.table.get_item(Key={'post_id': post_id}, ConsistentRead=True).get('Item') or {}
+                if shard_count(item) > 1:
+                    self.planner.set_shard_count(post_id, shard_count(item))
+                    return shard_count(item)
 
-            try:
-                # Try to update existing item
-                response = self.table.update_item(
-                    Key={'post_id': post_id},
-                    UpdateExpression='ADD total_comments :inc, sentiment_sum :sent, toxic_sum :tox',
-                    ExpressionAttributeValues={
-                        ':inc': total_new,
-                        ':sent': Decimal(str(sentiment_sum)),
-                        ':tox': Decimal(str(toxic_sum))
-                    },
-                    ReturnValues='UPDATED_NEW'
-                )
-                
-                # Calculate and update averages
-                updated_total = response['Attributes']['total_comments']
-                updated_sentiment = Decimal(str(response['Attributes']['sentiment_sum'])) / updated_total
-                updated_toxic = Decimal(str(response['Attributes']['toxic_sum'])) / updated_total
+                base = {
+                    'TableName': self.table.name,
+                    'Key': {'post_id': post_id},
+                    'UpdateExpression': f'SET {SHARD_COUNT_ATTRIBUTE} = :shards',
+                    'ExpressionAttributeValues': {':shards': desired}
+                }
+                counters = {name: value for name, value in item.items() if is_counter(name)}
+                if 'total_comments' in item:
+                    base['ConditionExpression'] = (
+                        f'attribute_not_exists({SHARD_COUNT_ATTRIBUTE}) AND total_comments = :total'
+                    )
+                    base['ExpressionAttributeValues'][':total'] = item['total_comments']
+                else:
+                    base['ConditionExpression'] = (
+                        f'attribute_not_exists({SHARD_COUNT_ATTRIBUTE}) AND attribute_not_exists(total_comments)'
+                    )
 
+                transact_items = [{'Update': base}]
+                if counters:
+                    names = {f'#c{i}': name for i, name in enumerate(sorted(counters))}
+                    values = {f':c{i}': counters[name] for i, name in enumerate(sorted(counters))}
+                    values[':of'] = post_id
+                    values[':ts'] = item.get('last_updated') or datetime.now().isoformat()
+                    transact_items.append({
+                        'Update': {
+                            'TableName': self.table.name,
+                            'Key': {'post_id': shard_key(post_id, 0)},
+                            'UpdateExpression': 'ADD ' + ', '.join(f'#c{i} :c{i}' for i in range(len(names)))
+                                                + f' SET {SHARD_OF_ATTRIBUTE} = :of, last_updated = :ts',
+                            'ExpressionAttributeNames': names,
+                            'ExpressionAttributeValues': values
+                        }
+                    })
+                client.transact_write_items(TransactItems=transact_items)
+            else:
                 self.table.update_item(
                     Key={'post_id': post_id},
-                    UpdateExpression='SET average_sentiment = :avg_sent, average_toxic = :avg_tox, last_updated = :ts',
-                    ExpressionAttributeValues={
-                        ':avg_sent': updated_sentiment,
-                        ':avg_tox': updated_toxic,
-                        ':ts': datetime.now().isoformat()
-                    }
+                    UpdateExpression=f'SET {SHARD_COUNT_ATTRIBUTE} = :shards',
+                    ConditionExpression=f'{SHARD_COUNT_ATTRIBUTE} = :current',
+                    ExpressionAttributeValues={':shards': desired, ':current': current}
                 )
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('TransactionCanceledException', 'ConditionalCheckFailedException'):
+                raise
+            # Invocation khác vừa ghi vào post hoặc đã chia shard trước
+            logger.info(f"Resharding post {post_id} raced with another writer, reloading shard count")
+            return self.load_shard_count(post_id)
+
+        logger.info(f"Resharded post {post_id} from {current} to {desired} shards")
+        metrics.count('shards.resharded')
+        self.planner.set_shard_count(post_id, desired)
+        return desired
+
+    def plan_shards(self, post_id):
+        """Record a write for the post and return the shard count to write with"""
+        self.planner.record_write(post_id)
+        current = self.planner.shard_count(post_id)
+        desired = self.planner.desired(post_id)
+        if desired > current:
+            return self.reshard(post_id, current, desired)
+        return current
+
+    def apply_direct(self, post_id, comments):
+        """Apply comments with plain ADD updates (no idempotency table).
 
+        Rollup buckets are written before the post item: the post's
+        last_updated is the cache version of the history API, so it only
+        moves once the buckets are in.
+        """
+        client = self.dynamodb.meta.client
+        self.totals.pop(post_id, None)
+        shards = self.plan_shards(post_id)
+        updates = self.build_post_updates(post_id, comments, shards)
+        for update in updates[1:]:
+            client.update_item(**update)
+
+        attempt = 0
+        while True:
+            try:
+                # ADD tạo item nếu chưa tồn tại nên không cần put_item riêng
+                response = client.update_item(**updates[0], ReturnValues='UPDATED_NEW')
+                if shards == 1:
+                    self.totals[post_id] = response.get('Attributes', {})
+                return comments
             except ClientError as e:
-                if e.response['Error']['Code'] == 'ValidationException':
-                    # Item doesn't exist, create new
-                    return self.initialize_post_metrics(post_id, new_comments)
-                else:
+                code = e.response['Error']['Code']
+                if code in CONTENTION_CODES:
+                    self.planner.record_contention(post_id)
+                attempt += 1
+                if code != 'ConditionalCheckFailedException' or attempt > TRANSACT_MAX_RETRIES:
+                    raise
+                # Post vừa được chia shard bởi invocation khác. Bucket rollup đã ghi
+                # vào partition gốc vẫn được gộp khi đọc, chỉ ghi lại item của post
+                self.load_shard_count(post_id)
+                shards = self.plan_shards(post_id)
+                updates[0] = self.build_post_updates(post_id, comments, shards)[0]
+
+    def chunk_for_transactions(self, comments):
+        """Split comments so markers plus post and bucket updates fit in one transaction"""
+        chunk = []
+        buckets = set()
+        for comment in comments:
+            comment_buckets = set(rollup_buckets(comment)) if self.rollup_table else set()
+            merged = buckets | comment_buckets
+            if chunk and len(chunk) + 1 + 1 + len(merged) > TRANSACT_MAX_ITEMS:
+                yield chunk
+                chunk = []
+                merged = comment_buckets
+            chunk.append(comment)
+            buckets = merged
+        if chunk:
+            yield chunk
+
+    def build_markers(self, comments):
+        """Build conditional puts recording that each comment has been aggregated"""
+        expires_at = int((datetime.now() + timedelta(days=self.idempotency_ttl_days)).timestamp())
+        return [
+            {
+                'Put': {
+                    'TableName': self.idempotency_table,
+                    'Item': {
+                        'idempotency_key': f"comment#{comment['comment_id']}",
+                        'post_id': comment['post_id'],
+                        'expires_at': expires_at
+                    },
+                    'ConditionExpression': 'attribute_not_exists(idempotency_key)'
+                }
+            }
+            for comment in comments
+        ]
+
+    def apply_idempotent(self, post_id, comments):
+        """Apply one chunk of comments in a transaction guarded by per-comment markers.
+
+        Returns the comments that were newly applied (duplicates excluded).
+        """
+        attempt = 0
+        while comments:
+            updates = self.build_post_updates(post_id, comments, self.plan_shards(post_id))
+            transact_items = self.build_markers(comments) + [{'Update': update} for update in updates]
+
+            try:
+                self.dynamodb.meta.client.transact_write_items(TransactItems=transact_items)
+                return comments
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                reasons = e.response.get('CancellationReasons', [])
+                duplicates = {
+                    i for i, reason in enumerate(reasons[:len(comments)])
+                    if reason.get('Code') == 'ConditionalCheckFailed'
+                }
+                if duplicates:
+                    # Các comment này đã được cộng trước đó (SQS gửi lại), bỏ qua
+                    logger.info(f"Skipping {len(duplicates)} already aggregated comments for post {post_id}")
+                    metrics.count('comments.duplicates', len(duplicates))
+                    comments = [c for i, c in enumerate(comments) if i not in duplicates]
+                    continue
+
+                attempt += 1
+                if attempt > TRANSACT_MAX_RETRIES:
                     raise
+                metrics.count('transaction.retries')
+                codes = [reason.get('Code') for reason in reasons]
+                if len(codes) > len(comments) and codes[len(comments)] == 'ConditionalCheckFailed':
+                    # Post vừa được chia shard bởi invocation khác
+                    self.load_shard_count(post_id)
+                    continue
+                if CONTENTION_CODES.intersection(codes):
+                    self.planner.record_contention(post_id)
+                logger.warning(f"Transaction for post {post_id} cancelled ({codes}), retrying")
+                time.sleep(0.05 * (2 ** attempt) + random.uniform(0, 0.05))
+
+        return comments
+
+    def store_aggregation(self, post_id, new_comments):
+        """Update aggregated data in DynamoDB with one atomic update"""
+        try:
+            if not self.idempotency_table:
+                self.publisher.record(post_id, self.apply_direct(post_id, new_comments))
+            else:
+                # Bỏ comment trùng trong cùng batch, rồi chia theo giới hạn của transaction
+                unique = list({c['comment_id']: c for c in new_comments}.values())
+                for chunk in self.chunk_for_transactions(unique):
+                    self.publisher.record(post_id, self.apply_idempotent(post_id, chunk))
 
             logger.info(f"Successfully updated aggregation for post {post_id}")
             return True
@@ -103,58 +474,136 @@ class CommentAggregator:
             logger.error(f"Error storing aggregation: {str(e)}")
             return False
 
-    def aggregate_by_post(self, comments):
-        """Aggregate comments by post_id"""
+    def refresh_sharded_summary(self, post_id, shards):
+        """Write the merged counters of a sharded post to its base item.
+
+        The base item is what the summary indexes, history and listings read.
+        Counts only grow, so an older merge never overwrites a newer one.
+        """
+        merged = merge_counters(load_shards(self.dynamodb, self.table.name, post_id, shards))
+        update = summary_update(post_id, merged, shards)
+        if update is None:
+            return False
+
+        self.table.update_item(**update)
+        metrics.count('shards.summaries')
+        return True
+
+    def refresh_summary(self, post_id):
+        """Refresh the stored averages used as sort keys by the summary indexes.
+
+        Reads stay derived from the sums; these attributes only order
+        GET /posts. Unsharded posts written by apply_direct reuse the
+        counters returned by their ADD update instead of reading the item
+        again. Sharded posts get their merged counters on the base item.
+        """
         try:
-            # Group comments by post_id
-            post_groups = {}
-            for comment in comments:
-                post_id = comment['post_id']
-                if post_id not in post_groups:
-                    post_groups[post_id] = []
-                post_groups[post_id].append(comment)
-
-            # Process each post's comments
-            for post_id, post_comments in post_groups.items():
-                success = self.store_aggregation(post_id, post_comments)
-                if not success:
-                    logger.error(f"Failed to store aggregation for post {post_id}")
+            item = self.totals.pop(post_id, None)
+            if item is not None:
+                update = average_update(post_id, item)
+                if update is not None:
+                    self.table.update_item(**update)
+                return update is not None
+
+            item = self.table.get_item(
+                Key={'post_id': post_id},
+                ProjectionExpression=f'total_comments, sentiment_sum, toxic_sum, {SHARD_COUNT_ATTRIBUTE}',
+                ConsistentRead=True
+            ).get('Item')
+            if item:
+                self.planner.set_shard_count(post_id, shard_count(item))
+                if shard_count(item) > 1:
+                    return self.refresh_sharded_summary(post_id, shard_count(item))
+            update = average_update(post_id, item or {})
+            if update is None:
+                return False
 
+            self.table.update_item(**update)
             return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(f"Error refreshing summary for post {post_id}: {str(e)}")
+            return False
         except Exception as e:
-            logger.error(f"Error aggregating comments by post: {str(e)}")
+            logger.error(f"Error refreshing summary for post {post_id}: {str(e)}")
             return False
 
+    def aggregate_by_post(self, comments):
+        """Aggregate comments by post_id, returning the post IDs that failed.
+
+        Every stored post has its summary refreshed once, after all posts of
+        the batch are written, so the last batch before a post goes quiet
+        also reaches the summary indexes.
+        """
+        # Group comments by post_id
+        post_groups = {}
+        for comment in comments:
+            post_id = comment['post_id']
+            if post_id not in post_groups:
+                post_groups[post_id] = []
+            post_groups[post_id].append(comment)
+
+        # Process each post's comments
+        failed_posts = set()
+        for post_id, post_comments in post_groups.items():
+            success = self.store_aggregation(post_id, post_comments)
+            if not success:
+                logger.error(f"Failed to store aggregation for post {post_id}")
+                failed_posts.add(post_id)
+
+        # Làm mới sort key của các GSI tóm tắt cho mọi post đã ghi trong batch
+        with metrics.timer('summaries'):
+            for post_id in post_groups:
+                if post_id not in failed_posts:
+                    self.refresh_summary(post_id)
+
+        return failed_posts
+
     def process_batch(self, records):
         """Process a batch of records from Result Queue"""
         failed_records = []
         processed_comments = []
+        message_ids = []
 
         for record in records:
             try:
+                if is_aggregated(record):
+                    # Bản audit từ fused mode, đã cộng vào aggregate rồi
+                    continue
+
                 # Parse comment data
                 comment_data = record['body']
                 if isinstance(comment_data, str):
                     comment_data = json.loads(comment_data)
                 
-                logger.info(f"Processing comment: {json.dumps(comment_data)}")
+                log_payload('Comment', comment_data)
                 processed_comments.append(comment_data)
+                message_ids.append(record['messageId'])
                 
             except Exception as e:
                 logger.error(f"Error parsing record: {str(e)}")
-                logger.error(f"Record body: {record.get('body')}")
+                log_payload('Record body', record.get('body'))
                 failed_records.append(record['messageId'])
 
         if processed_comments:
-            success = self.aggregate_by_post(processed_comments)
-            if not success:
-                failed_records.extend(record['messageId'] for record in records)
+            # Chỉ trả lại các message thuộc post bị lỗi
+            with metrics.timer('aggregate'):
+                failed_posts = self.aggregate_by_post(processed_comments)
+            metrics.count('posts.failed', len(failed_posts))
+            failed_records.extend(
+                message_id for message_id, comment in zip(message_ids, processed_comments)
+                if comment['post_id'] in failed_posts
+            )
+            # Đẩy delta của các post đã ghi thành công tới dashboard
+            with metrics.timer('websocket.flush'):
+                metrics.count('websocket.pushed', self.publisher.flush())
 
         return failed_records
 
+@instrumented
 def lambda_handler(event, context):
     """Lambda handler for processing results"""
-    logger.info(f"Input event: {json.dumps(event)}")
+    log_payload('Input event', event)
     
     try:
         records = event.get('Records', [])
@@ -166,6 +615,8 @@ def lambda_handler(event, context):
 
         aggregator = CommentAggregator()
         failed_records = aggregator.process_batch(records)
+        metrics.count('records', len(records))
+        metrics.count('records.failed', len(failed_records))
         
         if failed_records:
             return {
@@ -178,5 +629,5 @@ def lambda_handler(event, context):
         
     except Exception as e:
         logger.error(f"Error in lambda_handler: {str(e)}")
-        logger.error(f"Event: {event}")
+        log_payload('Event', event)
         raise
\ No newline at end of file
@@ -1,75 +1,664 @@
 import { DynamoDB } from '@aws-sdk/client-dynamodb';
 import { DynamoDBDocument } from '@aws-sdk/lib-dynamodb';
+import { createHash } from 'crypto';
+import { gzipSync, brotliCompressSync } from 'zlib';
 
 const dynamodb = DynamoDBDocument.from(new DynamoDB({}));
 const TABLE_NAME = 'fb_comments_analysis_table';
 const HISTORY_TABLE = 'post_history';
+const ROLLUP_TABLE = process.env.ROLLUP_TABLE || 'post_rollups';
+const PAGE_ID = process.env.FACEBOOK_PAGE_ID;
 
-export const handler = async (event) => {
-    console.log('Event:', JSON.stringify(event, null, 2));
+// sort -> GSI trên posts table (partition key page_id)
+const POST_INDEXES = {
+    created_time: 'page_id-created_time-index',
+    average_sentiment: 'page_id-average_sentiment-index',
+    total_comments: 'page_id-total_comments-index'
+};
+const DEFAULT_LIMIT = 20;
+const MAX_LIMIT = 100;
+
+const CACHE_TTL_SECONDS = parseInt(process.env.CACHE_TTL_SECONDS || '30', 10);
+const CACHE_MAX_ENTRIES = parseInt(process.env.CACHE_MAX_ENTRIES || '200', 10);
+const METRICS_NAMESPACE = process.env.METRICS_NAMESPACE || 'FacebookAnalytics';
+const METRICS_ENABLED = (process.env.METRICS_ENABLED || 'true') === 'true';
+// Log event chỉ khi bật và theo tỉ lệ lấy mẫu
+const LOG_PAYLOADS = process.env.LOG_PAYLOADS === 'true';
+const LOG_SAMPLE_RATE = parseFloat(process.env.LOG_SAMPLE_RATE || '0.01');
+const LOG_PAYLOAD_MAX_BYTES = parseInt(process.env.LOG_PAYLOAD_MAX_BYTES || '4096', 10);
+// EMF nhận tối đa 100 giá trị cho mỗi metric
+const EMF_MAX_VALUES = 100;
+
+// Trường trả về của GET /posts -> các attribute cần đọc từ DynamoDB
+const POST_FIELDS = {
+    post_id: ['post_id'],
+    content: ['content'],
+    created_time: ['created_time'],
+    last_updated: ['last_updated'],
+    media_url: ['media_url'],
+    post_type: ['post_type'],
+    average_sentiment: ['sentiment_sum', 'total_comments', 'average_sentiment'],
+    average_toxic: ['toxic_sum', 'total_comments', 'average_toxic'],
+    total_comments: ['total_comments'],
+    sentiment_sum: ['sentiment_sum'],
+    toxic_sum: ['toxic_sum']
+};
+
+// Không nén response nhỏ hơn ngưỡng này (bytes)
+const COMPRESSION_THRESHOLD = 1024;
+
+const CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Expose-Headers': 'ETag'
+};
+
+// Trung bình được tính từ tổng và số comment khi đọc (aggregator chỉ ADD các tổng)
+const average = (sum, total, fallback) => (total ? Number(sum || 0) / total : (fallback || 0));
+
+// Cursor phân trang là LastEvaluatedKey mã hoá base64url
+const encodeCursor = (key) => (key ? Buffer.from(JSON.stringify(key)).toString('base64url') : null);
+const decodeCursor = (cursor) => {
+    if (!cursor) return undefined;
+    try {
+        return JSON.parse(Buffer.from(cursor, 'base64url').toString('utf8'));
+    } catch {
+        return undefined;
+    }
+};
+
+// resolution -> prefix của sort key trong bảng rollup
+const ROLLUP_PREFIXES = { minute: 'm', hour: 'h', day: 'd' };
+// Độ dài phần thời gian của bucket: m#YYYY-MM-DDTHH:MM, h#YYYY-MM-DDTHH, d#YYYY-MM-DD
+const ROLLUP_LENGTHS = { m: 16, h: 13, d: 10 };
+// Giới hạn số điểm history trả về cho một request
+const MAX_HISTORY_POINTS = 5000;
+// LTTB cần ít nhất điểm đầu, điểm cuối và một điểm ở giữa
+const MIN_HISTORY_POINTS = 3;
+// BatchGetItem nhận tối đa 100 keys
+const BATCH_GET_MAX_KEYS = 100;
+// Số lần gửi lại UnprocessedKeys (backoff lũy thừa) trước khi báo lỗi
+const BATCH_GET_MAX_RETRIES = 5;
+
+// Histogram bin cố định (xem histograms.py): mỗi bin là một counter sh00..sh19 / th00..th19
+const HISTOGRAM_BINS = 20;
+const SKETCHES = {
+    sentiment: { prefix: 'sh', low: 0, high: 10 },
+    toxic: { prefix: 'th', low: 0, high: 10 }
+};
+const DISTRIBUTION_PERCENTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.99];
+
+// 'h#2024-01-01T10' -> '2024-01-01T10:00:00Z'
+const bucketToIso = (bucket) => {
+    const value = bucket.slice(2);
+    if (value.length === 10) return `${value}T00:00:00Z`;
+    if (value.length === 13) return `${value}:00:00Z`;
+    return `${value}:00Z`;
+};
+
+// Metric của invocation hiện tại, ghi ra dạng CloudWatch Embedded Metric Format
+let metrics = { timings: {}, counts: {} };
+
+const addTiming = (name, ms) => {
+    (metrics.timings[name] = metrics.timings[name] || []).push(ms);
+};
+
+const count = (name, value = 1) => {
+    if (value) metrics.counts[name] = (metrics.counts[name] || 0) + value;
+};
+
+// Đo thời gian một call (<name>.time) và đếm số call (<name>.calls)
+const timed = async (name, call) => {
+    const start = performance.now();
+    try {
+        return await call();
+    } finally {
+        addTiming(`${name}.time`, performance.now() - start);
+        count(`${name}.calls`);
+    }
+};
+
+const flushMetrics = () => {
+    const { timings, counts } = metrics;
+    metrics = { timings: {}, counts: {} };
+    if (!METRICS_ENABLED) return;
+    const functionName = process.env.AWS_LAMBDA_FUNCTION_NAME || 'local';
+    const document = { Function: functionName };
+    const definitions = [];
+    for (const [name, values] of Object.entries(timings)) {
+        document[name] = values.slice(0, EMF_MAX_VALUES);
+        definitions.push({ Name: name, Unit: 'Milliseconds' });
+    }
+    for (const [name, value] of Object.entries(counts)) {
+        document[name] = value;
+        definitions.push({ Name: name, Unit: 'Count' });
+    }
+    document._aws = {
+        Timestamp: Date.now(),
+        CloudWatchMetrics: [{ Namespace: METRICS_NAMESPACE, Dimensions: [['Function']], Metrics: definitions }]
+    };
+    console.log(JSON.stringify(document));
+};
+
+const logPayload = (label, payload) => {
+    if (!LOG_PAYLOADS || Math.random() >= LOG_SAMPLE_RATE) return;
+    let text = JSON.stringify(payload);
+    if (text.length > LOG_PAYLOAD_MAX_BYTES) {
+        text = `${text.slice(0, LOG_PAYLOAD_MAX_BYTES)}... (${text.length} chars)`;
+    }
+    console.log(`${label}: ${text}`);
+};
+
+const queryAll = async (params) => {
+    const items = [];
+    let lastKey;
+    do {
+        const result = await timed('dynamodb.Query', () => dynamodb.query({ ...params, ExclusiveStartKey: lastKey }));
+        items.push(...result.Items);
+        count('dynamodb.items', result.Items.length);
+        lastKey = result.LastEvaluatedKey;
+    } while (lastKey);
+    return items;
+};
+
+// Post nóng: counter được chia ra các item post_id#0 .. post_id#(N-1) (xem post_shards.py).
+// Item gốc giữ shard_count và bản tóm tắt gộp dùng cho các GSI.
+const shardIds = (postId, shardCount) => Array.from({ length: shardCount }, (_, i) => `${postId}#${i}`);
+const shardCountOf = (item) => Number((item && item.shard_count) || 1);
+const isCounter = (name) => ['total_comments', 'sentiment_sum', 'toxic_sum'].includes(name)
+    || name.startsWith('lang_') || /^(sh|th)\d{2}$/.test(name);
+
+// Cộng counter của các shard, last_updated lấy giá trị mới nhất
+const mergeCounters = (items) => {
+    const merged = {};
+    for (const item of items) {
+        for (const [name, value] of Object.entries(item)) {
+            if (isCounter(name)) {
+                merged[name] = (merged[name] || 0) + Number(value);
+            } else if (name === 'last_updated' && value > (merged.last_updated || '')) {
+                merged.last_updated = value;
+            }
+        }
+    }
+    return merged;
+};
+
+const batchGetAll = async (tableName, keys, projection) => {
+    const items = [];
+    for (let i = 0; i < keys.length; i += BATCH_GET_MAX_KEYS) {
+        let request = {
+            [tableName]: { Keys: keys.slice(i, i + BATCH_GET_MAX_KEYS), ...(projection && { ProjectionExpression: projection }) }
+        };
+        let attempt = 0;
+        while (request && Object.keys(request).length) {
+            if (attempt > BATCH_GET_MAX_RETRIES) {
+                throw new Error(`BatchGetItem on ${tableName} still has unprocessed keys after ${BATCH_GET_MAX_RETRIES} retries`);
+            }
+            if (attempt) {
+                await new Promise(resolve => setTimeout(resolve, Math.min(50 * 2 ** attempt, 1000)));
+            }
+            const result = await timed('dynamodb.BatchGetItem', () => dynamodb.batchGet({ RequestItems: request }));
+            items.push(...((result.Responses || {})[tableName] || []));
+            request = result.UnprocessedKeys;
+            attempt += 1;
+        }
+    }
+    count('dynamodb.items', items.length);
+    return items;
+};
+
+// Thay counter của các post đã chia shard bằng tổng của các shard (bản tóm tắt có thể trễ)
+const mergePostShards = async (posts, projection) => {
+    const sharded = posts.filter(post => shardCountOf(post) > 1);
+    if (!sharded.length) return posts;
+    const keys = sharded.flatMap(post => shardIds(post.post_id, shardCountOf(post)).map(id => ({ post_id: id })));
+    // Mặc định đọc cả item: shard chỉ chứa counter (kể cả ngôn ngữ và bin histogram)
+    const shards = await batchGetAll(TABLE_NAME, keys, projection);
+    const byPost = new Map();
+    for (const shard of shards) {
+        if (!byPost.has(shard.shard_of)) byPost.set(shard.shard_of, []);
+        byPost.get(shard.shard_of).push(shard);
+    }
+    return posts.map(post => (byPost.has(post.post_id) ? { ...post, ...mergeCounters(byPost.get(post.post_id)) } : post));
+};
+
+// Gộp các bucket cùng key từ partition gốc và các partition shard của rollup
+const mergeRollups = (partitions) => {
+    if (partitions.length === 1) return partitions[0];
+    const groups = new Map();
+    for (const item of partitions.flat()) {
+        if (!groups.has(item.bucket)) groups.set(item.bucket, []);
+        groups.get(item.bucket).push(item);
+    }
+    return [...groups.keys()].sort().map(bucket => ({ bucket, ...mergeCounters(groups.get(bucket)) }));
+};
+
+const binAttribute = (prefix, i) => `${prefix}${String(i).padStart(2, '0')}`;
+
+// Percentile xấp xỉ: nội suy tuyến tính trong bin (sai số nhỏ hơn độ rộng một bin)
+const percentileOf = (counts, q, low, high) => {
+    const total = counts.reduce((sum, count) => sum + count, 0);
+    if (!total) return null;
+    const target = q * total;
+    const width = (high - low) / HISTOGRAM_BINS;
+    let cumulative = 0;
+    for (let i = 0; i < counts.length; i++) {
+        if (counts[i] && cumulative + counts[i] >= target) {
+            return low + width * (i + (target - cumulative) / counts[i]);
+        }
+        cumulative += counts[i];
+    }
+    return high;
+};
+
+// Histogram và percentile của sentiment/toxic từ các bin counter của một item (post hoặc bucket đã gộp)
+const describeDistribution = (item) => Object.fromEntries(Object.entries(SKETCHES).map(([name, { prefix, low, high }]) => {
+    const counts = Array.from({ length: HISTOGRAM_BINS }, (_, i) => Number(item[binAttribute(prefix, i)] || 0));
+    const width = (high - low) / HISTOGRAM_BINS;
+    return [name, {
+        count: counts.reduce((sum, count) => sum + count, 0),
+        edges: Array.from({ length: HISTOGRAM_BINS + 1 }, (_, i) => low + width * i),
+        counts,
+        percentiles: Object.fromEntries(DISTRIBUTION_PERCENTILES.map(q => [`p${Math.round(q * 100)}`, percentileOf(counts, q, low, high)]))
+    }];
+}));
+
+// Chuyển các bucket rollup thành chuỗi history: trung bình theo bucket và tổng comment cộng dồn
+const rollupsToHistory = (postId, buckets) => {
+    let runningTotal = 0;
+    return buckets.map(bucket => {
+        const count = Number(bucket.total_comments || 0);
+        runningTotal += count;
+        return {
+            post_id: postId,
+            last_updated: bucketToIso(bucket.bucket),
+            comments: count,
+            average_sentiment: average(bucket.sentiment_sum, count, 5.0),
+            average_toxic: average(bucket.toxic_sum, count, 0),
+            total_comments: runningTotal
+        };
+    });
+};
+
+// LRU cache trong container, giữ qua các lần gọi warm của Lambda.
+// Map giữ thứ tự chèn nên key đầu tiên là key ít được dùng gần đây nhất.
+const responseCache = new Map();
+
+const cacheGet = (key) => {
+    const entry = responseCache.get(key);
+    if (!entry) return null;
+    // Đưa entry về cuối Map (mới dùng gần nhất)
+    responseCache.delete(key);
+    responseCache.set(key, entry);
+    return entry;
+};
+
+const cacheSet = (key, body, version) => {
+    // ETag lấy từ version (last_updated): dữ liệu chỉ đổi khi last_updated đổi
+    const etag = `"${createHash('sha1').update(`${key}|${version}`).digest('base64url')}"`;
+    const entry = { body, version, etag, expiresAt: Date.now() + CACHE_TTL_SECONDS * 1000 };
+    responseCache.set(key, entry);
+    while (responseCache.size > CACHE_MAX_ENTRIES) {
+        responseCache.delete(responseCache.keys().next().value);
+    }
+    return entry;
+};
+
+// Query string chuẩn hoá để các URL tương đương dùng chung cache entry
+const cacheKey = (path, query) => {
+    const params = Object.keys(query).sort().map(name => `${name}=${query[name]}`);
+    return `${path}?${params.join('&')}`;
+};
+
+const getHeader = (event, name) => {
+    const headers = event.headers || {};
+    const match = Object.keys(headers).find(key => key.toLowerCase() === name);
+    return match ? headers[match] : undefined;
+};
+
+// Trả response từ cache. Entry hết hạn được xác nhận lại bằng probe (chỉ đọc version,
+// cùng cách tính với loader); chỉ load lại toàn bộ khi version đã đổi
+const cachedResponse = async (event, path, query, loader, probe) => {
+    const key = cacheKey(path, query);
+    let entry = cacheGet(key);
+    if (entry && entry.expiresAt > Date.now()) {
+        count('cache.hits');
+    } else if (entry && await timed('probe', probe) === entry.version) {
+        // Dữ liệu không đổi: giữ body và ETag, chỉ gia hạn entry
+        count('cache.revalidated');
+        entry.expiresAt = Date.now() + CACHE_TTL_SECONDS * 1000;
+    } else {
+        count('cache.misses');
+        const { body, version } = await timed('load', loader);
+        entry = cacheSet(key, body, version);
+    }
+    
+    const headers = {
+        ...CORS_HEADERS,
+        'Content-Type': 'application/json',
+        'ETag': entry.etag,
+        'Cache-Control': `public, max-age=${CACHE_TTL_SECONDS}`,
+        'Vary': 'Accept-Encoding'
+    };
+    
+    const ifNoneMatch = getHeader(event, 'if-none-match');
+    if (ifNoneMatch && ifNoneMatch.split(',').map(tag => tag.trim()).includes(entry.etag)) {
+        count('responses.not_modified');
+        return { statusCode: 304, headers, body: '' };
+    }
+    
+    const encoding = chooseEncoding(getHeader(event, 'accept-encoding'));
+    if (encoding && entry.body.length >= COMPRESSION_THRESHOLD) {
+        count('responses.compressed');
+        return {
+            statusCode: 200,
+            headers: { ...headers, 'Content-Encoding': encoding },
+            body: encodeBody(entry, encoding),
+            isBase64Encoded: true
+        };
+    }
+    
+    return { statusCode: 200, headers, body: entry.body };
+};
+
+// Chọn encoding từ Accept-Encoding, ưu tiên brotli
+const chooseEncoding = (acceptEncoding) => {
+    const accepted = (acceptEncoding || '').split(',')
+        .map(part => part.trim().split(';'))
+        .filter(([, q]) => !q || parseFloat(q.split('=')[1]) > 0)
+        .map(([name]) => name.toLowerCase());
+    if (accepted.includes('br')) return 'br';
+    if (accepted.includes('gzip')) return 'gzip';
+    return null;
+};
+
+// Nén một lần cho mỗi encoding và giữ trong cache entry
+const encodeBody = (entry, encoding) => {
+    entry.encoded = entry.encoded || {};
+    if (!entry.encoded[encoding]) {
+        const compress = encoding === 'br' ? brotliCompressSync : gzipSync;
+        entry.encoded[encoding] = compress(Buffer.from(entry.body)).toString('base64');
+    }
+    return entry.encoded[encoding];
+};
+
+const maxLastUpdated = (items) => items.reduce(
+    (latest, item) => (item.last_updated && item.last_updated > latest ? item.last_updated : latest), ''
+);
+
+// Shard chỉ cần last_updated (và shard_of để gộp) khi tính version
+const SHARD_VERSION_PROJECTION = 'post_id, shard_of, last_updated';
+
+// Item gốc của post (shard_count, last_updated) với last_updated mới nhất của các shard.
+// last_updated này là version cache của các response theo post
+const loadPostVersion = async (postId) => {
+    const result = await timed('dynamodb.GetItem', () => dynamodb.get({
+        TableName: TABLE_NAME,
+        Key: { post_id: postId },
+        ProjectionExpression: 'post_id, last_updated, shard_count'
+    }));
+    return (await mergePostShards([result.Item || {}], SHARD_VERSION_PROJECTION))[0];
+};
+
+const postVersion = async (postId) => (await loadPostVersion(postId)).last_updated || '';
+
+// fields=a,b,c -> danh sách trường hợp lệ (post_id luôn có)
+const parseFields = (fields) => {
+    const requested = (fields || '').split(',').map(field => field.trim()).filter(field => POST_FIELDS[field]);
+    return requested.length ? ['post_id', ...requested.filter(field => field !== 'post_id')] : Object.keys(POST_FIELDS);
+};
+
+// last_updated luôn được đọc vì nó là version của cache
+const buildProjection = (fields) => {
+    const attributes = [...new Set(['last_updated', 'shard_count', ...fields.flatMap(field => POST_FIELDS[field])])];
+    const names = {};
+    attributes.forEach((attribute, i) => { names[`#f${i}`] = attribute; });
+    return {
+        ProjectionExpression: Object.keys(names).join(', '),
+        ExpressionAttributeNames: names
+    };
+};
+
+const formatPost = (post) => ({
+    post_id: post.post_id,
+    content: post.content,
+    created_time: post.created_time,
+    last_updated: post.last_updated,
+    media_url: post.media_url || '',
+    post_type: post.post_type,
+    average_sentiment: average(post.sentiment_sum, post.total_comments, post.average_sentiment),
+    average_toxic: average(post.toxic_sum, post.total_comments, post.average_toxic),
+    total_comments: post.total_comments || 0,
+    sentiment_sum: post.sentiment_sum || 0,
+    toxic_sum: post.toxic_sum || 0
+});
+
+const pick = (object, fields) => Object.fromEntries(fields.map(field => [field, object[field]]));
+
+// Dạng cột: các mảng song song nhỏ hơn nhiều so với mảng object khi history dài
+const toColumnar = (postId, history) => ({
+    post_id: postId,
+    timestamps: history.map(point => point.last_updated),
+    sentiment: history.map(point => Number(point.average_sentiment)),
+    counts: history.map(point => Number(point.total_comments))
+});
+
+// Một trang của GET /posts với projection cho trước (loader và probe đọc cùng một trang)
+const queryPostsPage = (query, projection) => {
+    const limit = Math.min(Math.max(parseInt(query.limit, 10) || DEFAULT_LIMIT, 1), MAX_LIMIT);
+    const pageId = query.page_id || PAGE_ID;
+    const sort = POST_INDEXES[query.sort] ? query.sort : 'created_time';
+    
+    const params = {
+        TableName: TABLE_NAME,
+        ...projection,
+        Limit: limit,
+        ExclusiveStartKey: decodeCursor(query.cursor)
+    };
+    
+    if (pageId) {
+        // Query GSI theo page, sắp xếp bằng sort key của index
+        return timed('dynamodb.Query', () => dynamodb.query({
+            ...params,
+            IndexName: POST_INDEXES[sort],
+            KeyConditionExpression: 'page_id = :page',
+            ExpressionAttributeValues: { ':page': pageId },
+            ScanIndexForward: query.order === 'asc'
+        }));
+    }
+    // Chưa cấu hình page: scan có phân trang, không sắp xếp; bỏ qua các item shard
+    return timed('dynamodb.Scan', () => dynamodb.scan({
+        ...params,
+        FilterExpression: 'attribute_not_exists(shard_of)'
+    }));
+};
+
+// Version của trang mà không đọc các trường hiển thị
+const probePosts = async (query) => {
+    const result = await queryPostsPage(query, buildProjection(['post_id']));
+    return maxLastUpdated(await mergePostShards(result.Items, SHARD_VERSION_PROJECTION));
+};
+
+const loadPosts = async (query) => {
+    const fields = parseFields(query.fields);
+    const result = await queryPostsPage(query, buildProjection(fields));
+    
+    count('dynamodb.items', result.Items.length);
+    const posts = await mergePostShards(result.Items);
+    const formattedPosts = posts.map(post => pick(formatPost(post), fields));
+    
+    return {
+        body: JSON.stringify({
+            posts: formattedPosts,
+            next_cursor: encodeCursor(result.LastEvaluatedKey)
+        }),
+        version: maxLastUpdated(posts)
+    };
+};
+
+// ISO string (không có 'Z') hoặc null nếu tham số không hợp lệ
+const parseTime = (value) => {
+    if (!value) return null;
+    const date = new Date(/^\d+$/.test(value) ? Number(value) * 1000 : value);
+    return isNaN(date) ? null : date.toISOString().slice(0, 23);
+};
+
+// Largest-Triangle-Three-Buckets: giữ hình dạng đường sentiment với `threshold` điểm
+const downsampleLttb = (points, threshold) => {
+    if (threshold >= points.length || threshold < 3) return points;
+    const x = points.map(point => Date.parse(point.last_updated));
+    const y = points.map(point => Number(point.average_sentiment));
+    const sampled = [points[0]];
+    const bucketSize = (points.length - 2) / (threshold - 2);
+    let a = 0;
+    
+    for (let i = 0; i < threshold - 2; i++) {
+        // Trung bình của bucket kế tiếp làm đỉnh thứ ba của tam giác
+        const nextStart = Math.floor((i + 1) * bucketSize) + 1;
+        const nextEnd = Math.min(Math.floor((i + 2) * bucketSize) + 1, points.length);
+        let avgX = 0;
+        let avgY = 0;
+        for (let j = nextStart; j < nextEnd; j++) {
+            avgX += x[j];
+            avgY += y[j];
+        }
+        avgX /= (nextEnd - nextStart);
+        avgY /= (nextEnd - nextStart);
+        
+        const start = Math.floor(i * bucketSize) + 1;
+        const end = Math.floor((i + 1) * bucketSize) + 1;
+        let maxArea = -1;
+        let chosen = start;
+        for (let j = start; j < end; j++) {
+            const area = Math.abs((x[a] - avgX) * (y[j] - y[a]) - (x[a] - x[j]) * (avgY - y[a]));
+            if (area > maxArea) {
+                maxArea = area;
+                chosen = j;
+            }
+        }
+        sampled.push(points[chosen]);
+        a = chosen;
+    }
+    
+    sampled.push(points[points.length - 1]);
+    return sampled;
+};
+
+// Các bucket rollup của post trong khoảng [from, to], đã gộp các partition shard
+const loadRollups = async (post, prefix, from, to) => {
+    // Post đã chia shard có thêm một partition rollup cho mỗi shard
+    const postId = post.post_id;
+    const partitions = [postId, ...(shardCountOf(post) > 1 ? shardIds(postId, shardCountOf(post)) : [])];
+    
+    // Giới hạn khoảng thời gian ngay trong KeyConditionExpression
+    const length = ROLLUP_LENGTHS[prefix];
+    return mergeRollups(await Promise.all(partitions.map(partition => queryAll({
+        TableName: ROLLUP_TABLE,
+        KeyConditionExpression: 'post_id = :pid AND bucket BETWEEN :from AND :to',
+        ExpressionAttributeValues: {
+            ':pid': partition,
+            ':from': `${prefix}#${from ? from.slice(0, length) : ''}`,
+            ':to': `${prefix}#${to ? to.slice(0, length) : '~'}`
+        },
+        ScanIndexForward: true
+    }))));
+};
+
+// Phân phối sentiment/toxic của cả post (một GetItem) hoặc của các bucket trong [from, to]
+const loadDistribution = async (postId, query) => {
+    const from = parseTime(query.from);
+    const to = parseTime(query.to);
+    let item;
+    
+    if (from || to) {
+        const prefix = ROLLUP_PREFIXES[query.resolution] || ROLLUP_PREFIXES.hour;
+        // Đọc version trước dữ liệu: ghi xen giữa chỉ làm version cũ hơn dữ liệu, lần sau sẽ load lại
+        const post = await loadPostVersion(postId);
+        const buckets = await loadRollups({ ...post, post_id: postId }, prefix, from, to);
+        item = { ...mergeCounters(buckets), last_updated: post.last_updated };
+    } else {
+        const result = await timed('dynamodb.GetItem', () => dynamodb.get({ TableName: TABLE_NAME, Key: { post_id: postId } }));
+        item = result.Item || {};
+        if (shardCountOf(item) > 1) {
+            // Bản tóm tắt trên item gốc có thể trễ, gộp trực tiếp các shard
+            item = (await mergePostShards([item]))[0];
+        }
+    }
+    
+    return {
+        body: JSON.stringify({ post_id: postId, total_comments: Number(item.total_comments || 0), ...describeDistribution(item) }),
+        version: item.last_updated || ''
+    };
+};
+
+const loadHistory = async (postId, query) => {
+    const prefix = ROLLUP_PREFIXES[query.resolution] || ROLLUP_PREFIXES.hour;
+    const from = parseTime(query.from);
+    const to = parseTime(query.to);
+    const points = Math.min(Math.max(parseInt(query.points, 10) || MAX_HISTORY_POINTS, MIN_HISTORY_POINTS), MAX_HISTORY_POINTS);
+    
+    // Đọc version trước dữ liệu: ghi xen giữa chỉ làm version cũ hơn dữ liệu, lần sau sẽ load lại
+    const post = await loadPostVersion(postId);
+    const buckets = await loadRollups({ ...post, post_id: postId }, prefix, from, to);
+    
+    let history = rollupsToHistory(postId, buckets);
+    let version = post.last_updated || '';
+    
+    // Post chưa có rollup (được tổng hợp trước khi có bảng rollup) thì đọc snapshot cũ
+    if (!history.length) {
+        const values = { ':pid': postId };
+        let condition = 'post_id = :pid';
+        if (from && to) {
+            condition += ' AND last_updated BETWEEN :from AND :to';
+            Object.assign(values, { ':from': from, ':to': to });
+        } else if (from) {
+            condition += ' AND last_updated >= :from';
+            values[':from'] = from;
+        } else if (to) {
+            condition += ' AND last_updated <= :to';
+            values[':to'] = to;
+        }
+        history = await queryAll({
+            TableName: HISTORY_TABLE,
+            KeyConditionExpression: condition,
+            ExpressionAttributeValues: values,
+            ScanIndexForward: true
+        });
+        // history_saver ghi snapshot mà không đổi last_updated của post: probe không bao giờ khớp, luôn load lại
+        version = `snapshots#${history.length ? history[history.length - 1].last_updated : ''}#${history.length}`;
+    }
+    
+    history = downsampleLttb(history, points);
+    
+    return {
+        body: JSON.stringify(query.format === 'columnar' ? toColumnar(postId, history) : history),
+        version
+    };
+};
+
+const route = async (event) => {
+    logPayload('Event', event);
     
     try {
         const httpMethod = event.httpMethod || event.requestContext.http.method;
         const path = event.path || event.requestContext.http.path;
         
-        console.log('Method:', httpMethod);
-        console.log('Path:', path);
-        
         // GET /posts - Lấy danh sách posts
         if (path.match(/^\/posts$/) && httpMethod === 'GET') {
-            const params = {
-                TableName: TABLE_NAME,
-                ProjectionExpression: "post_id, content, created_time, last_updated, media_url, post_type, average_sentiment, average_toxic, total_comments, sentiment_sum, toxic_sum"
-            };
-            
-            const result = await dynamodb.scan(params);
-            
-            const formattedPosts = result.Items.map(post => ({
-                post_id: post.post_id,
-                content: post.content,
-                created_time: post.created_time,
-                last_updated: post.last_updated,
-                media_url: post.media_url || '',
-                post_type: post.post_type,
-                average_sentiment: post.average_sentiment || 0,
-                average_toxic: post.average_toxic || 0,
-                total_comments: post.total_comments || 0,
-                sentiment_sum: post.sentiment_sum || 0,
-                toxic_sum: post.toxic_sum || 0
-            }));
-
-            return {
-                statusCode: 200,
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                body: JSON.stringify(formattedPosts)
-            };
+            const query = event.queryStringParameters || {};
+            return await cachedResponse(event, path, query, () => loadPosts(query), () => probePosts(query));
+        }
+        
+        // GET /posts/{id}/distribution - Histogram và percentile sentiment/toxic
+        else if (path.match(/^\/posts\/[^/]+\/distribution$/) && httpMethod === 'GET') {
+            const postId = path.split('/')[2];
+            const query = event.queryStringParameters || {};
+            return await cachedResponse(event, path, query, () => loadDistribution(postId, query), () => postVersion(postId));
         }
         
         else if (path.match(/^\/posts\/[^/]+\/history$/) && httpMethod === 'GET') {
             const postId = path.split('/')[2];
-            
-            const params = {
-                TableName: HISTORY_TABLE,
-                KeyConditionExpression: 'post_id = :pid',
-                ExpressionAttributeValues: {
-                    ':pid': postId
-                },
-                ScanIndexForward: true
-            };
-            
-            const result = await dynamodb.query(params);
-            
-            return {
-                statusCode: 200,
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                body: JSON.stringify(result.Items)
-            };
+            const query = event.queryStringParameters || {};
+            return await cachedResponse(event, path, query, () => loadHistory(postId, query), () => postVersion(postId));
         }
         
         // Handle OPTIONS for CORS
@@ -78,7 +667,7 @@ export const handler = async (event) => {
                 statusCode: 200,
                 headers: {
                     'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+                    'Access-Control-Allow-Headers': 'Content-Type,Authorization,If-None-Match',
                     'Access-Control-Allow-Methods': 'GET,OPTIONS'
                 },
                 body: ''
@@ -98,7 +687,7 @@ export const handler = async (event) => {
         console.error('Detailed error:', {
             message: error.message,
             stack: error.stack,
-            event: event
+            path: event.path || event.rawPath
         });
         
         return {
@@ -113,4 +702,16 @@ export const handler = async (event) => {
             })
         };
     }
-};
\ No newline at end of file
+};
+
+export const handler = async (event) => {
+    const start = performance.now();
+    try {
+        const response = await route(event);
+        count(`responses.${response.statusCode}`);
+        return response;
+    } finally {
+        addTiming('handler.time', performance.now() - start);
+        flushMetrics();
+    }
+};
@@ -0,0 +1,340 @@
+"""Re-score persisted comments and rebuild post aggregates.
+
+Run when the scoring logic changes (SENTIMENT_MAP, toxic lexicons, local
+language rules). The corpus is COMMENTS_TABLE, written by the processor.
+
+  1. rescore  parallel scan of the comments table, one process per scan
+              segment. Each page is re-scored with the processor's batched
+              NLP path (or only the toxic lexicon with --mode toxic) and
+              written back stamped with --version.
+  2. rebuild  a second parallel scan builds per-post and per-bucket totals.
+              These are merged and written with SET (absolute values) to
+              the posts and rollup tables.
+
+Progress is checkpointed per segment after every page in
+--checkpoint-dir, so an interrupted run resumes where it stopped.
+Comments already stamped with --version are skipped, so running the same
+version again only re-scores what failed. The rebuild is idempotent and
+simply runs again. Pause the aggregator while rebuilding: SET overwrites
+concurrent ADDs. A post is not rebuilt to fewer comments than it has
+(comments aggregated before they were persisted) unless --force is given.
+
+Usage: python backfill.py --version 2 [--segments 8] [--workers 4]
+       [--mode full|toxic] [--page-size 500] [--skip-rebuild] [--force]
+       [--checkpoint-dir DIR] [--fresh]
+"""
+import argparse
+import json
+import os
+import shutil
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+
+import boto3
+
+import toxicity
+from aggregator import rollup_buckets
+from histograms import bin_counts
+from comment_store import compact, expand
+from post_shards import SHARD_OF_ATTRIBUTE, shard_key, shard_ids, shard_count, is_counter, merge_counters, load_shards
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Số post ghi lại song song ở bước rebuild
+REBUILD_THREADS = 16
+
+class Checkpoint:
+    def __init__(self, directory):
+        """Per-segment progress files; each worker process only writes its own"""
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, f'{name}.json')
+
+    def load(self, name, default=None):
+        try:
+            with open(self.path(name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def save(self, name, state):
+        # Ghi file tạm rồi đổi tên để checkpoint không bao giờ bị ghi dở
+        tmp = self.path(name) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp, self.path(name))
+
+    def start(self, config, fresh=False):
+        """Create the directory, or check a resumed run uses the same settings"""
+        if fresh and os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+        saved = self.load('run')
+        if saved is None:
+            self.save('run', config)
+        elif saved != config:
+            # Ranh giới segment phụ thuộc TotalSegments nên không thể tiếp tục với cấu hình khác
+            raise SystemExit(f"Checkpoint {self.directory} was made with {saved}, not {config}; use --fresh")
+
+def make_processor():
+    """CommentProcessor used only for its batched NLP path"""
+    # Fused mode không cần Result Queue; backfill không gửi gì đi
+    os.environ['PIPELINE_MODE'] = 'fused'
+    from processor import CommentProcessor
+    return CommentProcessor()
+
+def rescore(processor, items, mode):
+    """Re-score compact items; returns (processed comments, failed count)"""
+    comments = [expand(item) for item in items]
+    if mode == 'toxic':
+        # Chỉ lexicon thay đổi: giữ ngôn ngữ và sentiment đã lưu, không gọi Comprehend
+        for comment in comments:
+            language = comment['language'] if comment['language'] != 'unknown' else 'en'
+            comment['toxic_score'] = toxicity.toxic_score(comment['comment_text'], language)
+        return comments, 0
+
+    analyses = processor.analyze_texts([comment['comment_text'] for comment in comments])
+    results = []
+    for comment, analysis in zip(comments, analyses):
+        if analysis is None:
+            continue
+        comment['language'] = analysis['language']
+        comment['sentiment_score'] = analysis['sentiment']
+        comment['toxic_score'] = analysis['toxic']
+        results.append(comment)
+    return results, len(comments) - len(results)
+
+def rescore_segment(segment, args):
+    """Phase 1 for one scan segment, resuming from its checkpoint"""
+    checkpoint = Checkpoint(args.checkpoint_dir)
+    name = f'rescore-{segment}'
+    state = checkpoint.load(name) or {'last_key': None, 'done': False, 'scanned': 0, 'rescored': 0, 'failed': 0}
+    if state['done']:
+        return state
+
+    # Mỗi process dùng session riêng
+    table = boto3.session.Session().resource('dynamodb').Table(args.comments_table)
+    processor = make_processor() if args.mode == 'full' else None
+    scan_args = {'Segment': segment, 'TotalSegments': args.segments, 'Limit': args.page_size}
+    if state['last_key']:
+        scan_args['ExclusiveStartKey'] = state['last_key']
+        logger.info(f"Segment {segment}: resuming after {state['scanned']} comments")
+
+    while True:
+        response = table.scan(**scan_args)
+        items = [item for item in response.get('Items', []) if item.get('v') != args.version]
+        state['scanned'] += len(response.get('Items', []))
+        if items:
+            results, failed = rescore(processor, items, args.mode)
+            with table.batch_writer(overwrite_by_pkeys=['comment_id']) as batch:
+                for result in results:
+                    batch.put_item(Item=compact(result, args.version))
+            state['rescored'] += len(results)
+            state['failed'] += failed
+
+        state['last_key'] = response.get('LastEvaluatedKey')
+        state['done'] = state['last_key'] is None
+        checkpoint.save(name, state)
+        if state['done']:
+            break
+        scan_args['ExclusiveStartKey'] = state['last_key']
+
+    logger.info(f"Segment {segment}: scanned {state['scanned']}, re-scored {state['rescored']}, failed {state['failed']}")
+    return state
+
+def add_comment(totals, item):
+    """Add one compact comment to a counters dict (same names as the aggregator)"""
+    totals['total_comments'] = totals.get('total_comments', 0) + 1
+    totals['sentiment_sum'] = totals.get('sentiment_sum', Decimal(0)) + Decimal(str(item.get('sent', 5)))
+    totals['toxic_sum'] = totals.get('toxic_sum', Decimal(0)) + Decimal(str(item.get('tox', 0)))
+    lang = f"lang_{item.get('lang', 'unknown')}"
+    totals[lang] = totals.get(lang, 0) + 1
+    for name, count in bin_counts([{'sentiment_score': item.get('sent', 5), 'toxic_score': item.get('tox', 0)}]).items():
+        totals[name] = totals.get(name, 0) + count
+
+def merge_into(target, partial):
+    for key, counters in partial.items():
+        totals = target.setdefault(key, {})
+        for name, value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+
+def aggregate_segment(segment, args):
+    """Phase 2 for one scan segment: partial post and rollup bucket totals"""
+    table = boto3.session.Session().resource('dynamodb').Table(args.comments_table)
+    posts = {}
+    buckets = {}
+    scan_args = {
+        'Segment': segment,
+        'TotalSegments': args.segments,
+        'ProjectionExpression': 'post_id, ts, lang, sent, tox'
+    }
+    while True:
+        response = table.scan(**scan_args)
+        for item in response.get('Items', []):
+            add_comment(posts.setdefault(item['post_id'], {}), item)
+            if args.rollup_table:
+                for bucket in rollup_buckets({'timestamp': item['ts']}):
+                    add_comment(buckets.setdefault((item['post_id'], bucket), {}), item)
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return posts, buckets
+
+class Rebuilder:
+    def __init__(self, args):
+        """Write rebuilt totals; boto3 resources are not thread-safe, so one per thread"""
+        self.args = args
+        self.local = threading.local()
+
+    @property
+    def dynamodb(self):
+        if not hasattr(self.local, 'dynamodb'):
+            self.local.dynamodb = boto3.session.Session().resource('dynamodb')
+        return self.local.dynamodb
+
+    def rebuild_post(self, post_id, totals, buckets):
+        """SET the post's counters (and its shards and rollups); returns a status"""
+        posts = self.dynamodb.Table(self.args.posts_table)
+        item = posts.get_item(Key={'post_id': post_id}, ConsistentRead=True).get('Item')
+        if item is None:
+            return 'missing'
+
+        shards = shard_count(item)
+        current = merge_counters(load_shards(self.dynamodb, posts.name, post_id, shards)) if shards > 1 else item
+        if not self.args.force and totals['total_comments'] < int(current.get('total_comments', 0)):
+            # Có comment được cộng trước khi comment được lưu lại, không làm mất chúng
+            return 'skipped'
+
+        now = datetime.now().isoformat()
+        if shards > 1:
+            # Shard 0 nhận toàn bộ tổng, các shard còn lại bị xoá
+            posts.put_item(Item={'post_id': shard_key(post_id, 0), SHARD_OF_ATTRIBUTE: post_id, 'last_updated': now, **totals})
+            for shard in range(1, shards):
+                posts.delete_item(Key={'post_id': shard_key(post_id, shard)})
+
+        names = {}
+        values = {
+            ':avg_sent': totals['sentiment_sum'] / totals['total_comments'],
+            ':avg_tox': totals['toxic_sum'] / totals['total_comments'],
+            ':ts': now
+        }
+        clauses = ['average_sentiment = :avg_sent', 'average_toxic = :avg_tox', 'last_updated = :ts']
+        for i, (name, value) in enumerate(sorted(totals.items())):
+            names[f'#c{i}'] = name
+            values[f':c{i}'] = value
+            clauses.append(f'#c{i} = :c{i}')
+        # Ngôn ngữ không còn xuất hiện sau khi chấm lại
+        stale = sorted(name for name in item if is_counter(name) and name not in totals)
+        for i, name in enumerate(stale):
+            names[f'#r{i}'] = name
+        expression = 'SET ' + ', '.join(clauses)
+        if stale:
+            expression += ' REMOVE ' + ', '.join(f'#r{i}' for i in range(len(stale)))
+        posts.update_item(
+            Key={'post_id': post_id},
+            UpdateExpression=expression,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+
+        if self.args.rollup_table:
+            self.rebuild_rollups(post_id, shards, buckets, now)
+        return 'rebuilt'
+
+    def rebuild_rollups(self, post_id, shards, buckets, now):
+        """Replace every rollup bucket of the post (all shard partitions) with the rebuilt ones"""
+        rollups = self.dynamodb.Table(self.args.rollup_table)
+        partitions = [post_id] + (shard_ids(post_id, shards) if shards > 1 else [])
+        # overwrite_by_pkeys: put sau ghi đè delete cùng key trong buffer
+        with rollups.batch_writer(overwrite_by_pkeys=['post_id', 'bucket']) as batch:
+            for partition in partitions:
+                query_args = {
+                    'KeyConditionExpression': 'post_id = :pid',
+                    'ExpressionAttributeValues': {':pid': partition},
+                    'ProjectionExpression': 'post_id, #bucket',
+                    'ExpressionAttributeNames': {'#bucket': 'bucket'}
+                }
+                while True:
+                    response = rollups.query(**query_args)
+                    for key in response.get('Items', []):
+                        batch.delete_item(Key=key)
+                    if 'LastEvaluatedKey' not in response:
+                        break
+                    query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            for bucket, totals in buckets.items():
+                batch.put_item(Item={'post_id': post_id, 'bucket': bucket, 'last_updated': now, **totals})
+
+def rebuild(args, pool):
+    """Phase 2: merge per-segment totals and write them post by post"""
+    posts = {}
+    buckets = {}
+    for partial_posts, partial_buckets in pool.map(aggregate_segment, range(args.segments), [args] * args.segments):
+        merge_into(posts, partial_posts)
+        merge_into(buckets, partial_buckets)
+
+    by_post = {}
+    for (post_id, bucket), totals in buckets.items():
+        by_post.setdefault(post_id, {})[bucket] = totals
+
+    rebuilder = Rebuilder(args)
+    stats = {'rebuilt': 0, 'skipped': 0, 'missing': 0}
+    with ThreadPoolExecutor(max_workers=REBUILD_THREADS) as executor:
+        futures = {
+            post_id: executor.submit(rebuilder.rebuild_post, post_id, totals, by_post.get(post_id, {}))
+            for post_id, totals in posts.items()
+        }
+        for post_id, future in futures.items():
+            status = future.result()
+            stats[status] += 1
+            if status != 'rebuilt':
+                logger.warning(f"Post {post_id} not rebuilt ({status})")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--version', required=True, help='scoring version; also the NLP cache version')
+    parser.add_argument('--mode', choices=('full', 'toxic'), default='full')
+    parser.add_argument('--segments', type=int, default=8, help='parallel scan segments')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--page-size', type=int, default=500, help='comments per scan page (one checkpoint each)')
+    parser.add_argument('--comments-table', default=os.environ.get('COMMENTS_TABLE'))
+    parser.add_argument('--posts-table', default=os.environ.get('DYNAMODB_TABLE', 'fb_comments_analysis_table'))
+    parser.add_argument('--rollup-table', default=os.environ.get('ROLLUP_TABLE'))
+    parser.add_argument('--checkpoint-dir', help='default .backfill-<version>')
+    parser.add_argument('--fresh', action='store_true', help='discard the checkpoint and start over')
+    parser.add_argument('--skip-rebuild', action='store_true')
+    parser.add_argument('--force', action='store_true', help='rebuild posts even if they would lose comments')
+    args = parser.parse_args()
+    if not args.comments_table:
+        parser.error('--comments-table or COMMENTS_TABLE is required')
+    args.checkpoint_dir = args.checkpoint_dir or f'.backfill-{args.version}'
+
+    logging.basicConfig(format='%(asctime)s %(processName)s %(message)s')
+    # Worker process kế thừa env: processor đọc bảng posts và version cache từ đây
+    os.environ['DYNAMODB_TABLE'] = args.posts_table
+    os.environ['NLP_CACHE_VERSION'] = args.version
+
+    checkpoint = Checkpoint(args.checkpoint_dir)
+    checkpoint.start({'version': args.version, 'mode': args.mode, 'segments': args.segments}, fresh=args.fresh)
+
+    with ProcessPoolExecutor(max_workers=min(args.workers, args.segments)) as pool:
+        states = list(pool.map(rescore_segment, range(args.segments), [args] * args.segments))
+        summary = {
+            key: sum(state[key] for state in states)
+            for key in ('scanned', 'rescored', 'failed')
+        }
+        if summary['failed']:
+            logger.warning(f"{summary['failed']} comments failed; run the same version with --fresh to retry only them")
+
+        if not args.skip_rebuild:
+            summary.update(rebuild(args, pool))
+
+    print(f"Backfill {args.version}: {json.dumps(summary)}")
+
+if __name__ == '__main__':
+    main()
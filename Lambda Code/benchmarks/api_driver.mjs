@@ -0,0 +1,31 @@
+// Chạy analytics handler thật với các event API Gateway và ghi thời gian từng request ra file JSON
+// Usage: node benchmarks/api_driver.mjs <events.json> <results.json>
+// Cần @aws-sdk/client-dynamodb, @aws-sdk/lib-dynamodb và AWS_ENDPOINT_URL trỏ tới moto server
+import fs from 'fs';
+import path from 'path';
+import { fileURLToPath, pathToFileURL } from 'url';
+
+const here = path.dirname(fileURLToPath(import.meta.url));
+const source = path.join(here, '..', 'analytics_handler.py');
+// Node chỉ import ESM từ .mjs, bản copy nằm cạnh file gốc để tìm được node_modules
+const copy = path.join(here, '..', `.analytics_handler.bench.${process.pid}.mjs`);
+const [eventsPath, resultsPath] = process.argv.slice(2);
+
+fs.copyFileSync(source, copy);
+try {
+  const { handler } = await import(pathToFileURL(copy).href);
+  const events = JSON.parse(fs.readFileSync(eventsPath, 'utf8'));
+  const results = [];
+  for (const event of events) {
+    const start = process.hrtime.bigint();
+    const response = await handler(event);
+    results.push({
+      path: event.path,
+      status: response.statusCode,
+      ms: Number(process.hrtime.bigint() - start) / 1e6
+    });
+  }
+  fs.writeFileSync(resultsPath, JSON.stringify(results));
+} finally {
+  fs.unlinkSync(copy);
+}
@@ -0,0 +1,298 @@
+"""End-to-end benchmark of collector -> processor -> aggregator -> history -> API.
+
+Runs the real lambda_handlers against moto (SQS, DynamoDB, DynamoDB
+Streams), a local fake Graph API and a stub Comprehend, over several
+collection rounds, and reports comments/sec, p50/p99 per stage and AWS API
+calls per comment.
+
+The API stage runs analytics_handler in Node against moto in server mode;
+it needs ``pip install moto[server]`` and ``npm install @aws-sdk/client-dynamodb
+@aws-sdk/lib-dynamodb`` and is skipped (with the reason) otherwise.
+
+Usage: python benchmarks/bench_e2e.py [--posts 10] [--comments-per-post 200]
+       [--rounds 3] [--duplicate-rate 0.1] [--language-mix vi=0.5,en=0.3,...]
+       [--batch-size 100] [--mode queue|fused] [--comprehend-ms 20]
+       [--throttle-rate 0.05] [--graph-ms 5] [--graph-error-rate 0] [--api]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import boto3
+from moto import mock_aws
+
+import harness
+
+PAGE_ID = '1000'
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Tên bảng giống analytics_handler
+POSTS_TABLE = 'fb_comments_analysis_table'
+HISTORY_TABLE = 'post_history'
+ROLLUP_TABLE = 'post_rollups'
+PROCESSED_TABLE = 'processed_comments'
+IDEMPOTENCY_TABLE = 'comment_idempotency'
+NLP_CACHE_TABLE = 'nlp_cache'
+
+def create_table(dynamodb, name, keys, attributes, **extra):
+    dynamodb.create_table(
+        TableName=name,
+        KeySchema=[{'AttributeName': key, 'KeyType': key_type} for key, key_type in keys],
+        AttributeDefinitions=[{'AttributeName': key, 'AttributeType': kind} for key, kind in attributes],
+        BillingMode='PAY_PER_REQUEST',
+        **extra
+    )
+    return dynamodb.Table(name)
+
+def create_tables(dynamodb):
+    sort_keys = [('created_time', 'S'), ('average_sentiment', 'N'), ('total_comments', 'N')]
+    posts = create_table(
+        dynamodb, POSTS_TABLE, [('post_id', 'HASH')],
+        [('post_id', 'S'), ('page_id', 'S')] + sort_keys,
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': f'page_id-{name}-index',
+                'KeySchema': [{'AttributeName': 'page_id', 'KeyType': 'HASH'},
+                              {'AttributeName': name, 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            }
+            for name, _ in sort_keys
+        ],
+        StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'NEW_AND_OLD_IMAGES'}
+    )
+    create_table(dynamodb, HISTORY_TABLE, [('post_id', 'HASH'), ('last_updated', 'RANGE')],
+                 [('post_id', 'S'), ('last_updated', 'S')])
+    create_table(dynamodb, ROLLUP_TABLE, [('post_id', 'HASH'), ('bucket', 'RANGE')],
+                 [('post_id', 'S'), ('bucket', 'S')])
+    create_table(dynamodb, PROCESSED_TABLE, [('comment_id', 'HASH')], [('comment_id', 'S')])
+    create_table(dynamodb, IDEMPOTENCY_TABLE, [('idempotency_key', 'HASH')], [('idempotency_key', 'S')])
+    create_table(dynamodb, NLP_CACHE_TABLE, [('text_hash', 'HASH')], [('text_hash', 'S')])
+    return posts
+
+def configure(args, raw_url, result_url, graph_url):
+    os.environ.update({
+        'FACEBOOK_ACCESS_TOKEN': 'bench-token',
+        'FACEBOOK_PAGE_ID': PAGE_ID,
+        'SQS_RAW_QUEUE_URL': raw_url,
+        'PROCESSED_COMMENTS_TABLE': PROCESSED_TABLE,
+        'POSTS_TABLE': POSTS_TABLE,
+        'POSTS_LIMIT': str(args.posts),
+        'GRAPH_PAGE_BUDGET': '100000',
+        'GRAPH_RATE': '1000',
+        'DYNAMODB_TABLE': POSTS_TABLE,
+        'IDEMPOTENCY_TABLE': IDEMPOTENCY_TABLE,
+        'ROLLUP_TABLE': ROLLUP_TABLE,
+        'HISTORY_TABLE': HISTORY_TABLE,
+        'NLP_CACHE_TABLE': NLP_CACHE_TABLE,
+        'PIPELINE_MODE': args.mode
+    })
+    if args.mode == 'queue' or args.audit:
+        os.environ['SQS_RESULT_QUEUE_URL'] = result_url
+    else:
+        os.environ.pop('SQS_RESULT_QUEUE_URL', None)
+
+    import facebook
+    import graph_fetcher
+    # Trỏ cả facebook-sdk và GraphFetcher tới Graph API giả
+    facebook.FACEBOOK_GRAPH_URL = graph_url + '/'
+    graph_fetcher.GRAPH_URL = graph_url
+
+def drain(stats, stage, sqs, queue_url, handler, batch_size):
+    """Feed a queue to a handler in batches until it is empty; returns failures"""
+    failures = 0
+    while True:
+        records = harness.receive_records(sqs, queue_url, batch_size)
+        if not records:
+            return failures
+        response = stats.time(
+            stage, lambda: handler({'Records': records}, harness.FakeContext()), len(records)
+        )
+        _, failed = harness.acknowledge(sqs, queue_url, records, response)
+        failures += failed
+
+def api_unavailable():
+    """Reason the Node API stage cannot run here, or None"""
+    if not shutil.which('node'):
+        return 'node not found'
+    try:
+        from moto.server import ThreadedMotoServer  # noqa: F401
+    except ImportError:
+        return 'moto server mode not installed (pip install moto[server])'
+    check = subprocess.run(
+        ['node', '-e', "require.resolve('@aws-sdk/lib-dynamodb')"],
+        cwd=LAMBDA_DIR, capture_output=True
+    )
+    if check.returncode != 0:
+        return '@aws-sdk/lib-dynamodb not installed for analytics_handler'
+    return None
+
+def run_api_stage(stats, args, post_ids):
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=args.moto_port)
+    server.start()
+    events = []
+    for _ in range(args.api_requests):
+        for sort in ('created_time', 'average_sentiment', 'total_comments'):
+            events.append({'httpMethod': 'GET', 'path': '/posts',
+                           'queryStringParameters': {'sort': sort}, 'headers': {}})
+        for post_id in post_ids:
+            events.append({'httpMethod': 'GET', 'path': f'/posts/{post_id}/history',
+                           'queryStringParameters': {'points': '300'}, 'headers': {}})
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            events_path = os.path.join(tmp, 'events.json')
+            results_path = os.path.join(tmp, 'results.json')
+            with open(events_path, 'w') as f:
+                json.dump(events, f)
+            env = dict(os.environ, AWS_ENDPOINT_URL=f'http://127.0.0.1:{args.moto_port}',
+                       AWS_REGION=os.environ['AWS_DEFAULT_REGION'])
+            subprocess.run(
+                ['node', os.path.join(LAMBDA_DIR, 'benchmarks', 'api_driver.mjs'), events_path, results_path],
+                cwd=LAMBDA_DIR, env=env, check=True, stdout=subprocess.DEVNULL
+            )
+            with open(results_path) as f:
+                results = json.load(f)
+    finally:
+        server.stop()
+
+    errors = 0
+    for result in results:
+        stats.add('api', result['ms'] / 1000, 1)
+        errors += result['status'] >= 400
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=10)
+    parser.add_argument('--comments-per-post', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--language-mix', default=harness.DEFAULT_LANGUAGE_MIX)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--mode', choices=['queue', 'fused'], default='queue')
+    parser.add_argument('--audit', action='store_true', help='fused mode also writes the audit stream')
+    parser.add_argument('--comprehend-ms', type=float, default=20)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--graph-ms', type=float, default=5)
+    parser.add_argument('--graph-error-rate', type=float, default=0.0)
+    parser.add_argument('--api', action='store_true', help='also run the Node analytics API stage')
+    parser.add_argument('--api-requests', type=int, default=3)
+    parser.add_argument('--moto-port', type=int, default=5055)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    generator = harness.CommentGenerator(
+        PAGE_ID, args.posts, args.comments_per_post, args.duplicate_rate,
+        args.language_mix, args.rounds, args.seed
+    )
+    graph = harness.FakeGraphAPI(generator, args.graph_ms / 1000, args.graph_error_rate, args.seed)
+    comprehend = harness.StubComprehend(args.comprehend_ms / 1000, args.throttle_rate, args.seed)
+    counter = harness.ApiCallCounter()
+    stats = harness.StageStats()
+
+    print(f"{generator.total} comments ({generator.unique_texts} distinct texts) on {args.posts} posts, "
+          f"{args.rounds} rounds, mode {args.mode}, batch size {args.batch_size}")
+    print(f"Comprehend {args.comprehend_ms:.0f} ms/call, throttle rate {args.throttle_rate:.0%}; "
+          f"Graph API {args.graph_ms:.0f} ms/call, error rate {args.graph_error_rate:.0%}")
+
+    graph_url = graph.start()
+    try:
+        with mock_aws():
+            boto3.setup_default_session()
+            counter.install(boto3.DEFAULT_SESSION)
+            comprehend.install(boto3.DEFAULT_SESSION)
+
+            sqs = boto3.client('sqs')
+            dynamodb = boto3.resource('dynamodb')
+            raw_url = sqs.create_queue(QueueName='raw-comments')['QueueUrl']
+            result_url = sqs.create_queue(QueueName='processed-results')['QueueUrl']
+            posts_table = create_tables(dynamodb)
+            reader = harness.StreamReader(boto3.client('dynamodbstreams'), posts_table.latest_stream_arn)
+            configure(args, raw_url, result_url, graph_url)
+
+            import collector
+            import processor
+            import aggregator
+            import history_stream
+            if not args.verbose:
+                logging.getLogger().setLevel(logging.WARNING)
+            # Không tính các call tạo bảng/queue ở trên
+            counter.calls.clear()
+            counter.attempts.clear()
+
+            failures = {}
+            started = time.perf_counter()
+            for round_number in range(args.rounds):
+                graph.round = round_number
+                response = stats.time('collector', lambda: collector.lambda_handler({}, harness.FakeContext()))
+                if response['statusCode'] != 200:
+                    print(f"collector failed in round {round_number}: {response['body']}")
+
+                failures['processor'] = failures.get('processor', 0) + drain(
+                    stats, 'processor', sqs, raw_url, processor.lambda_handler, args.batch_size
+                )
+                if args.mode == 'queue':
+                    failures['aggregator'] = failures.get('aggregator', 0) + drain(
+                        stats, 'aggregator', sqs, result_url, aggregator.lambda_handler, args.batch_size
+                    )
+
+                records = reader.poll()
+                for start in range(0, len(records), 100):
+                    chunk = records[start:start + 100]
+                    stats.time('history', lambda: history_stream.lambda_handler({'Records': chunk}, None), len(chunk))
+            elapsed = time.perf_counter() - started
+            pipeline_calls = dict(counter.calls)
+            pipeline_attempts = dict(counter.attempts)
+
+            items = posts_table.scan(ProjectionExpression='post_id, total_comments, shard_count')['Items']
+            # Post nóng: đếm trên các shard, item gốc chỉ là bản tóm tắt
+            aggregated = sum(int(item.get('total_comments', 0)) for item in items if int(item.get('shard_count', 1)) <= 1)
+
+            api_skipped = None
+            api_errors = 0
+            if args.api:
+                api_skipped = api_unavailable()
+                if not api_skipped:
+                    api_errors = run_api_stage(stats, args, [post['id'] for post in generator.posts])
+    finally:
+        graph.stop()
+
+    print()
+    print(stats.report())
+    if api_skipped:
+        print(f"api stage skipped: {api_skipped}")
+    elif args.api:
+        print(f"api errors: {api_errors}")
+
+    pipeline_time = stats.total() - stats.total('api')
+    print()
+    print(f"aggregated {aggregated}/{generator.total} comments, failures {failures}")
+    print(f"wall {elapsed:.2f}s, handler time {pipeline_time:.2f}s, "
+          f"{aggregated / max(pipeline_time, 1e-9):.0f} comments/s")
+    print(f"graph requests {graph.requests} (errors injected {graph.errors}), "
+          f"comprehend HTTP calls {comprehend.calls} (throttled {comprehend.throttled})")
+
+    per_comment = max(aggregated, 1)
+    total_calls = sum(pipeline_calls.values())
+    # ReceiveMessage/DeleteMessageBatch là phần việc của SQS event source mapping
+    print(f"AWS API calls {total_calls} ({total_calls / per_comment:.3f}/comment, SQS receive/delete "
+          f"by the event source mapping included), HTTP attempts {sum(pipeline_attempts.values())}")
+    for key, calls in sorted(pipeline_calls.items(), key=lambda item: -item[1]):
+        retries = pipeline_attempts.get(key, calls) - calls
+        print(f"  {key:<48}{calls:>7}{calls / per_comment:>9.3f}/comment" + (f"  retries {retries}" if retries else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Accuracy and latency of the local language pre-classifier on a labeled sample.
+
+Reports how many comments are answered locally (and how many of those are
+right), how many are skipped as having no text, and how many still need
+Comprehend. With --comprehend the same sample is also sent to
+detect_dominant_language (needs AWS credentials) for a latency comparison.
+
+Usage: python benchmarks/bench_langid.py [--repeat 2000] [--comprehend]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import langid_local
+
+# (text, nhãn đúng); 'unknown' = không có chữ, bỏ qua sentiment
+SAMPLE = [
+    ('Bài viết hay quá, cảm ơn admin nhiều!', 'vi'),
+    ('Mình thấy video này rất bổ ích', 'vi'),
+    ('Đẹp quá đi', 'vi'),
+    ('Chúc mừng năm mới cả nhà', 'vi'),
+    ('Sao giờ mới đăng vậy ad?', 'vi'),
+    ('Hôm nay lớp mình có thi không mọi người', 'vi'),
+    ('Tuyệt vời', 'vi'),
+    ('Nội dung chán, không có gì mới', 'vi'),
+    ('Giá bao nhiêu vậy shop', 'vi'),
+    ('Cho mình xin link với ạ', 'vi'),
+    ('ko biết nữa', 'vi'),
+    ('hay qua ad oi', 'vi'),
+    ('dc ko vay', 'vi'),
+    ('This is a great post, thanks for sharing', 'en'),
+    ('I really love this video', 'en'),
+    ('nice', 'en'),
+    ('Thank you', 'en'),
+    ('What time does the event start?', 'en'),
+    ('Worst service I have ever experienced', 'en'),
+    ('Congratulations to the whole team on the launch', 'en'),
+    ('Can you share the slides from the presentation', 'en'),
+    ('Looking forward to the next one', 'en'),
+    ('awesome', 'en'),
+    ('wow', 'en'),
+    ('Where can I buy this?', 'en'),
+    ('The assignment deadline is tomorrow right', 'en'),
+    ('Not impressed, the quality is terrible', 'en'),
+    ('정말 좋은 영상이네요', 'ko'),
+    ('감사합니다', 'ko'),
+    ('とても良い動画でした', 'ja'),
+    ('ありがとう', 'ja'),
+    ('これは素晴らしい', 'ja'),
+    ('这个视频很好看', 'zh'),
+    ('谢谢分享', 'zh'),
+    ('ขอบคุณมากครับ', 'th'),
+    ('สวยมาก', 'th'),
+    ('Очень интересное видео', 'ru'),
+    ('Спасибо большое', 'ru'),
+    ('شكرا جزيلا', 'ar'),
+    ('Muy buen video, gracias', 'es'),
+    ('C\'est vraiment génial', 'fr'),
+    ('Das ist sehr schön', 'de'),
+    ('Obrigado pelo conteúdo', 'pt'),
+    # fr/pt dùng â, ê, ô như tiếng Việt
+    ('Você é ótimo, adorei o vídeo', 'pt'),
+    ('Está ótimo, parabéns pelo trabalho', 'pt'),
+    ('Hôtel très sympa', 'fr'),
+    ('C\'est très bête, à côté de la plaque', 'fr'),
+    ('Je suis allé à la fête, c\'était génial', 'fr'),
+    ('Tôi rất thích bài này', 'vi'),
+    ('Cô ấy hát hay lắm', 'vi'),
+    ('Hôm nay trời đẹp', 'vi'),
+    ('Tên em là gì', 'vi'),
+    ('😍😍😍', 'unknown'),
+    ('👍', 'unknown'),
+    ('https://example.com/watch?v=123', 'unknown'),
+    ('@Nguyen Van A', 'vi'),
+    ('@john', 'unknown'),
+    ('', 'unknown'),
+    ('   ', 'unknown'),
+    ('100%', 'unknown'),
+    ('!!!', 'unknown'),
+    ('🔥🔥 https://fb.com/x', 'unknown'),
+    ('ok', 'en'),
+    ('haha', 'en'),
+]
+
+def evaluate(threshold):
+    local = correct = skipped = skipped_correct = deferred = 0
+    mistakes = []
+    for text, label in SAMPLE:
+        language, analyzable = langid_local.detect(text, threshold)
+        if not analyzable:
+            skipped += 1
+            skipped_correct += label == 'unknown'
+        elif language is None:
+            deferred += 1
+        else:
+            local += 1
+            if language == label:
+                correct += 1
+            else:
+                mistakes.append((text, label, language))
+    return local, correct, skipped, skipped_correct, deferred, mistakes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--threshold', type=float, default=langid_local.CONFIDENCE_THRESHOLD)
+    parser.add_argument('--comprehend', action='store_true')
+    args = parser.parse_args()
+
+    total = len(SAMPLE)
+    local, correct, skipped, skipped_correct, deferred, mistakes = evaluate(args.threshold)
+    print(f"{total} labeled comments, threshold {args.threshold}")
+    print(f"answered locally  {local:4d} ({local / total:.0%}), accuracy {correct / max(local, 1):.1%}")
+    print(f"skipped (no text) {skipped:4d} ({skipped / total:.0%}), correct {skipped_correct}/{skipped}")
+    print(f"sent to Comprehend{deferred:5d} ({deferred / total:.0%})")
+    for text, label, language in mistakes:
+        print(f"  wrong: {text!r} expected {label}, got {language}")
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for text, _ in SAMPLE:
+            langid_local.detect(text, args.threshold)
+    elapsed = time.perf_counter() - start
+    calls = args.repeat * total
+    print(f"local latency     {elapsed / calls * 1e6:8.1f} us/comment ({calls} calls)")
+
+    if args.comprehend:
+        import boto3
+        comprehend = boto3.client('comprehend')
+        texts = [text for text, _ in SAMPLE if text.strip()]
+        start = time.perf_counter()
+        for text in texts:
+            comprehend.detect_dominant_language(Text=text)
+        elapsed = time.perf_counter() - start
+        print(f"comprehend        {elapsed / len(texts) * 1e6:8.1f} us/comment ({len(texts)} calls)")
+
+if __name__ == '__main__':
+    main()
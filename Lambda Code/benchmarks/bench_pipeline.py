@@ -0,0 +1,126 @@
+"""End-to-end latency of the queue pipeline vs the fused pipeline.
+
+Runs against moto's in-process SQS and DynamoDB stand-ins, with the
+harness's stub Comprehend answering after a fixed latency per call. Each
+raw batch is timed from receive to aggregate written:
+
+  queue  raw queue -> processor -> result queue -> aggregator -> DynamoDB
+  fused  raw queue -> processor (aggregates in-process) -> DynamoDB
+
+Usage: python benchmarks/bench_pipeline.py [--comments 2000] [--batch-size 100]
+       [--posts 20] [--comprehend-ms 30] [--audit]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import boto3
+from moto import mock_aws
+
+from harness import StubComprehend, receive_records, delete_records, percentile
+
+POSTS_TABLE = 'bench-posts'
+TEXTS = ['This is a great post, thanks', 'Bài viết hay quá', 'Muy buen video', '😍😍',
+         'not impressed at all', 'Cảm ơn admin', 'Das ist sehr schön', 'first']
+
+def run(mode, args):
+    with mock_aws():
+        boto3.setup_default_session()
+        comprehend = StubComprehend(args.comprehend_ms / 1000)
+        comprehend.install(boto3.DEFAULT_SESSION)
+
+        sqs = boto3.client('sqs')
+        dynamodb = boto3.resource('dynamodb')
+        raw_url = sqs.create_queue(QueueName='bench-raw')['QueueUrl']
+        result_url = sqs.create_queue(QueueName='bench-result')['QueueUrl']
+        dynamodb.create_table(
+            TableName=POSTS_TABLE,
+            KeySchema=[{'AttributeName': 'post_id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'post_id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+        os.environ['DYNAMODB_TABLE'] = POSTS_TABLE
+        os.environ['PIPELINE_MODE'] = mode
+        os.environ['LOCAL_LANGID'] = 'false'
+        if mode == 'queue' or args.audit:
+            os.environ['SQS_RESULT_QUEUE_URL'] = result_url
+        else:
+            os.environ.pop('SQS_RESULT_QUEUE_URL', None)
+
+        import processor
+        import aggregator
+        processor.NLPCache._memory.clear()
+
+        comment_processor = processor.CommentProcessor()
+        comment_aggregator = aggregator.CommentAggregator() if mode == 'queue' else None
+
+        # Mỗi comment có text riêng để cache không che mất chi phí Comprehend
+        for start in range(0, args.comments, 10):
+            sqs.send_message_batch(QueueUrl=raw_url, Entries=[
+                {'Id': str(i), 'MessageBody': json.dumps({
+                    'comment_id': f'c{i}',
+                    'post_id': f'p{i % args.posts}',
+                    'timestamp': 1700000000 + i,
+                    'comment_text': f'{TEXTS[i % len(TEXTS)]} #{i}'
+                })}
+                for i in range(start, min(start + 10, args.comments))
+            ])
+
+        latencies = []
+        started = time.perf_counter()
+        while True:
+            records = receive_records(sqs, raw_url, args.batch_size)
+            if not records:
+                break
+            batch_start = time.perf_counter()
+            failed = comment_processor.process_batch(records)
+            delete_records(sqs, raw_url, records)
+            if mode == 'queue':
+                # Aggregator nhận kết quả của batch vừa xử lý qua Result Queue
+                results = receive_records(sqs, result_url, len(records) - len(failed))
+                comment_aggregator.process_batch(results)
+                delete_records(sqs, result_url, results)
+            latencies.append(time.perf_counter() - batch_start)
+        elapsed = time.perf_counter() - started
+
+        # Post nóng: đếm trên các shard, item gốc chỉ là bản tóm tắt
+        total = sum(
+            int(item.get('total_comments', 0))
+            for item in dynamodb.Table(POSTS_TABLE).scan()['Items']
+            if int(item.get('shard_count', 1)) <= 1
+        )
+        return elapsed, latencies, total, comprehend.calls
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--comments', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=20)
+    parser.add_argument('--comprehend-ms', type=float, default=30)
+    parser.add_argument('--audit', action='store_true', help='fused mode also writes the audit stream')
+    args = parser.parse_args()
+
+    print(f"{args.comments} comments, batch size {args.batch_size}, {args.posts} posts, "
+          f"Comprehend {args.comprehend_ms:.0f} ms/call")
+    summary = {}
+    for mode in ('queue', 'fused'):
+        elapsed, latencies, total, calls = run(mode, args)
+        summary[mode] = elapsed
+        print(f"{mode:<6} total {elapsed:7.2f}s  {args.comments / elapsed:8.0f} comments/s  "
+              f"batch p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+              f"aggregated {total}  comprehend calls {calls}")
+    print(f"speedup {summary['queue'] / summary['fused']:.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Micro-benchmark: legacy substring toxic check vs the compiled lexicon engine.
+
+Usage: python benchmarks/bench_toxicity.py [--comments 50000] [--terms 5000]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import toxicity
+
+WORDS = ['good', 'post', 'nice', 'video', 'thanks', 'bài', 'viết', 'hay', 'quá', 'cảm', 'ơn',
+         'class', 'assignment', 'admin', 'page', 'love', 'this', 'wow', 'first', 'great']
+
+def random_word(rng, length):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+def build_lexicon(rng, size):
+    terms = toxicity.load_lexicon('en') + toxicity.load_lexicon('vi')
+    while len(terms) < size:
+        terms.append(random_word(rng, rng.randint(4, 10)))
+    return terms
+
+def build_corpus(rng, size, terms):
+    corpus = []
+    for _ in range(size):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 40))]
+        # Khoảng 20% comment có từ độc hại
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(terms))
+        corpus.append(' '.join(words))
+    return corpus
+
+def legacy_score(text, terms):
+    """The original detect_toxic: substring test per term"""
+    text = text.lower()
+    word_count = len(text.split())
+    if word_count == 0:
+        return 0.0
+    toxic_count = sum(1 for word in terms if word in text)
+    return min(10.0, (toxic_count / word_count) * 10)
+
+def timed(label, func, corpus):
+    start = time.perf_counter()
+    total = sum(func(text) for text in corpus)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed:8.3f}s  {len(corpus) / elapsed:12.0f} comments/s  score sum {total:.1f}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--comments', type=int, default=50000)
+    parser.add_argument('--terms', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    terms = build_lexicon(rng, args.terms)
+    corpus = build_corpus(rng, args.comments, terms)
+    print(f"{len(corpus)} comments, {len(terms)} lexicon terms")
+
+    start = time.perf_counter()
+    lexicon = toxicity.Lexicon(terms)
+    print(f"build        {time.perf_counter() - start:8.3f}s")
+
+    def engine_score(text):
+        word_count = len(text.split())
+        if word_count == 0:
+            return 0.0
+        return min(10.0, (lexicon.count(toxicity.tokenize(text)) / word_count) * 10)
+
+    legacy = timed('legacy', lambda text: legacy_score(text, terms), corpus)
+    engine = timed('trie', engine_score, corpus)
+    print(f"speedup      {legacy / engine:8.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+"""Building blocks for pipeline benchmarks against local AWS stand-ins.
+
+- CommentGenerator: synthetic page posts and comments with a configurable
+  duplicate rate and language mix, revealed over several collection rounds
+- FakeGraphAPI: local HTTP server for the part of the Graph API the
+  collector uses (page posts, paged comments), with latency and rate-limit
+  error injection
+- StubComprehend: Comprehend behind a real botocore client (retries and
+  adaptive rate limiting still apply), with latency and throttling injection
+- ApiCallCounter: AWS API calls and HTTP attempts per service operation
+- StageStats: per-stage invocation timings (p50/p99)
+- SQS and DynamoDB Streams helpers that build Lambda event records
+
+AWS itself is provided by moto (``mock_aws``); the benchmarks install the
+stubs on the boto3 default session so the real lambda_handlers use them.
+"""
+import base64
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from botocore.awsrequest import AWSResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import langid_local
+
+FACEBOOK_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S+0000'
+
+LANGUAGE_WORDS = {
+    'vi': ['bài', 'viết', 'hay', 'quá', 'cảm', 'ơn', 'admin', 'đẹp', 'thật', 'tuyệt', 'vời', 'mình',
+           'thích', 'video', 'này', 'không', 'được', 'chúc', 'mừng', 'nhé'],
+    'en': ['this', 'is', 'a', 'great', 'post', 'thanks', 'for', 'sharing', 'love', 'the', 'video',
+           'really', 'nice', 'what', 'time', 'not', 'bad', 'awesome', 'stupid', 'idea'],
+    'es': ['muy', 'buen', 'video', 'gracias', 'por', 'compartir', 'me', 'encanta', 'esto', 'bonito'],
+    'ko': ['정말', '좋은', '영상', '감사합니다', '최고', '예뻐요', '사랑해요'],
+    'ja': ['とても', '良い', '動画', 'ありがとう', 'すごい', 'かわいい', 'です'],
+    'emoji': ['😍', '👍', '🔥', '😂', '❤️', '👏']
+}
+DEFAULT_LANGUAGE_MIX = 'vi=0.5,en=0.3,es=0.05,ko=0.05,ja=0.05,emoji=0.05'
+
+def parse_mix(spec):
+    """Parse 'vi=0.5,en=0.3' into normalized (language, weight) pairs"""
+    pairs = []
+    for part in spec.split(','):
+        language, _, weight = part.partition('=')
+        language = language.strip()
+        if language not in LANGUAGE_WORDS:
+            raise ValueError(f"Unknown language '{language}' in mix, expected one of {sorted(LANGUAGE_WORDS)}")
+        pairs.append((language, float(weight or 1)))
+    total = sum(weight for _, weight in pairs)
+    return [(language, weight / total) for language, weight in pairs]
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class CommentGenerator:
+    def __init__(self, page_id, posts, comments_per_post, duplicate_rate=0.1,
+                 language_mix=DEFAULT_LANGUAGE_MIX, rounds=1, seed=7, start=1700000000):
+        """Synthetic posts and comments.
+
+        Comments get increasing created_time across all posts and are split
+        into ``rounds`` in time order, so each collection round sees only
+        newer comments (as the watermarks expect). ``duplicate_rate`` is
+        the share of comments repeating an earlier text verbatim.
+        """
+        rng = random.Random(seed)
+        mix = parse_mix(language_mix)
+        languages = [language for language, _ in mix]
+        weights = [weight for _, weight in mix]
+
+        self.posts = [
+            {
+                'id': f'{page_id}_{i}',
+                'message': f'Post {i}',
+                'created_time': self.format_time(start - 3600 * i),
+                'attachments': {'data': [{'type': 'photo', 'media': {'image': {'src': f'https://img/{i}.jpg'}}}]}
+            }
+            for i in range(posts)
+        ]
+
+        slots = [(post['id'], j) for post in self.posts for j in range(comments_per_post)]
+        rng.shuffle(slots)
+        self.comments = {post['id']: [] for post in self.posts}
+        texts = []
+        for k, (post_id, j) in enumerate(slots):
+            if texts and rng.random() < duplicate_rate:
+                text = rng.choice(texts)
+            else:
+                language = rng.choices(languages, weights)[0]
+                text = self.make_text(rng, language, k)
+                texts.append(text)
+            comment_id = f'{post_id}_{j}'
+            self.comments[post_id].append({
+                'id': comment_id,
+                'message': text,
+                'created_time': self.format_time(start + k),
+                'round': k * rounds // len(slots)
+            })
+        self.total = len(slots)
+        self.unique_texts = len(texts)
+
+    @staticmethod
+    def format_time(ts):
+        return datetime.fromtimestamp(ts, tz=timezone.utc).strftime(FACEBOOK_TIME_FORMAT)
+
+    @staticmethod
+    def make_text(rng, language, k):
+        words = LANGUAGE_WORDS[language]
+        if language == 'emoji':
+            return ''.join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+        # Thêm số thứ tự để text không trùng ngoài ý muốn
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(3, 12))) + f' {k}'
+
+class FakeGraphAPI:
+    def __init__(self, generator, latency=0.0, error_rate=0.0, seed=7):
+        """Local Graph API stand-in serving the generator's posts and comments"""
+        self.generator = generator
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.round = 0
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @staticmethod
+    def encode_cursor(offset):
+        return base64.urlsafe_b64encode(str(offset).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+    def posts(self, params):
+        limit = int(params.get('limit', 25))
+        data = []
+        for post in self.generator.posts[:limit]:
+            post = dict(post)
+            if 'comments' in params.get('fields', ''):
+                post['comments'] = {'data': self.visible(post['id'])[:50]}
+            data.append(post)
+        return {'data': data}
+
+    def visible(self, post_id):
+        return [
+            {key: value for key, value in comment.items() if key != 'round'}
+            for comment in self.generator.comments.get(post_id, [])
+            if comment['round'] <= self.round
+        ]
+
+    def comments(self, post_id, params):
+        """Chronological comments; cursors are positions in the visible list"""
+        items = self.visible(post_id)
+        if 'after' in params:
+            offset = self.decode_cursor(params['after'])
+        elif 'since' in params:
+            since = int(params['since'])
+            offset = next(
+                (i for i, c in enumerate(items)
+                 if datetime.strptime(c['created_time'], FACEBOOK_TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp() >= since),
+                len(items)
+            )
+        else:
+            offset = 0
+        limit = int(params.get('limit', 25))
+        page = items[offset:offset + limit]
+        body = {'data': page, 'paging': {}}
+        if page:
+            body['paging']['cursors'] = {
+                'before': self.encode_cursor(offset),
+                'after': self.encode_cursor(offset + len(page))
+            }
+        if offset + len(page) < len(items):
+            body['paging']['next'] = f'{self.url}/{post_id}/comments?after={self.encode_cursor(offset + len(page))}'
+        return body
+
+    def respond(self, path, params):
+        """Return (status, body) for a GET request"""
+        with self.lock:
+            self.requests += 1
+            if self.error_rate and self.rng.random() < self.error_rate:
+                self.errors += 1
+                return 400, {'error': {'code': 4, 'message': 'Application request limit reached'}}
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = [part for part in path.split('/') if part]
+        # /v3.1/{id}/{edge}
+        if len(parts) == 3 and parts[2] == 'posts':
+            return 200, self.posts(params)
+        if len(parts) == 3 and parts[2] == 'comments':
+            return 200, self.comments(parts[1], params)
+        return 404, {'error': {'code': 803, 'message': f'Unknown path {path}'}}
+
+    def start(self):
+        """Start serving on a free local port and return the base URL"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                status, body = fake.respond(url.path, params)
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        return self.url
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+class _RawBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+class StubComprehend:
+    # Endpoint moto không nhận ra, để request đi tới handler của stub
+    ENDPOINT = 'https://comprehend.stub.local'
+    SENTIMENTS = ['POSITIVE', 'NEGATIVE', 'NEUTRAL', 'MIXED']
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, seed=7):
+        """Comprehend stand-in answering at the HTTP layer of a real botocore client"""
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def install(self, session):
+        """Route every Comprehend client created from ``session`` to this stub"""
+        os.environ['AWS_ENDPOINT_URL_COMPREHEND'] = self.ENDPOINT
+        session.events.register('before-send.comprehend', self.handle)
+
+    def language(self, text):
+        language, _, _ = langid_local.classify(text)
+        return language if language and language != 'unknown' else 'en'
+
+    def sentiment(self, text):
+        return self.SENTIMENTS[zlib.crc32(text.encode('utf-8')) % len(self.SENTIMENTS)]
+
+    def handle(self, request, **kwargs):
+        target = request.headers.get('X-Amz-Target', b'')
+        operation = (target.decode() if isinstance(target, bytes) else target).rsplit('.', 1)[-1]
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            throttled = self.throttle_rate and self.rng.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+        if throttled:
+            return self.response(400, {'__type': 'ThrottlingException', 'message': 'Rate exceeded'}, request)
+
+        body = json.loads(request.body)
+        if operation == 'BatchDetectDominantLanguage':
+            result = {'ResultList': [
+                {'Index': i, 'Languages': [{'LanguageCode': self.language(text), 'Score': 0.99}]}
+                for i, text in enumerate(body['TextList'])
+            ], 'ErrorList': []}
+        elif operation == 'DetectDominantLanguage':
+            result = {'Languages': [{'LanguageCode': self.language(body['Text']), 'Score': 0.99}]}
+        elif operation == 'BatchDetectSentiment':
+            result = {'ResultList': [
+                {'Index': i, 'Sentiment': self.sentiment(text)} for i, text in enumerate(body['TextList'])
+            ], 'ErrorList': []}
+        elif operation == 'DetectSentiment':
+            result = {'Sentiment': self.sentiment(body['Text'])}
+        else:
+            return self.response(400, {'__type': 'InvalidRequestException', 'message': operation}, request)
+        return self.response(200, result, request)
+
+    @staticmethod
+    def response(status, body, request):
+        return AWSResponse(
+            request.url, status,
+            {'Content-Type': 'application/x-amz-json-1.1'},
+            _RawBody(json.dumps(body).encode('utf-8'))
+        )
+
+class ApiCallCounter:
+    def __init__(self):
+        """Count AWS API calls and HTTP attempts (retries included) per operation"""
+        self.calls = {}
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def install(self, session):
+        session.events.register('before-call', self.on_call)
+        session.events.register('before-send', self.on_send)
+
+    def on_call(self, model, **kwargs):
+        key = f'{model.service_model.service_name}.{model.name}'
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def on_send(self, event_name, **kwargs):
+        # before-send.<service>.<Operation>
+        key = '.'.join(event_name.split('.')[1:3])
+        with self.lock:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+
+    def total(self):
+        return sum(self.calls.values())
+
+class StageStats:
+    def __init__(self):
+        """Invocation timings and item counts per pipeline stage"""
+        self.timings = {}
+        self.items = {}
+
+    def add(self, stage, seconds, items=0):
+        self.timings.setdefault(stage, []).append(seconds)
+        self.items[stage] = self.items.get(stage, 0) + items
+
+    def time(self, stage, func, items=0):
+        start = time.perf_counter()
+        result = func()
+        self.add(stage, time.perf_counter() - start, items)
+        return result
+
+    def total(self, stage=None):
+        if stage:
+            return sum(self.timings.get(stage, []))
+        return sum(sum(values) for values in self.timings.values())
+
+    def report(self):
+        lines = [f"{'stage':<12}{'calls':>7}{'items':>9}{'total s':>10}{'p50 ms':>10}{'p99 ms':>10}"]
+        for stage, values in self.timings.items():
+            lines.append(
+                f"{stage:<12}{len(values):>7}{self.items.get(stage, 0):>9}{sum(values):>10.2f}"
+                f"{statistics.median(values) * 1000:>10.1f}{percentile(values, 0.99) * 1000:>10.1f}"
+            )
+        return '\n'.join(lines)
+
+class FakeContext:
+    def __init__(self, timeout_seconds=900):
+        """Lambda context with a remaining-time clock"""
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int(max(0.0, self.deadline - time.monotonic()) * 1000)
+
+def receive_records(sqs, queue_url, limit):
+    """Receive up to ``limit`` messages as Lambda SQS event records"""
+    records = []
+    while len(records) < limit:
+        response = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(10, limit - len(records)),
+            MessageAttributeNames=['All']
+        )
+        messages = response.get('Messages', [])
+        if not messages:
+            break
+        for message in messages:
+            records.append({
+                'messageId': message['MessageId'],
+                'receiptHandle': message['ReceiptHandle'],
+                'body': message['Body'],
+                'messageAttributes': {
+                    name: {'stringValue': attribute.get('StringValue'), 'dataType': attribute['DataType']}
+                    for name, attribute in message.get('MessageAttributes', {}).items()
+                }
+            })
+    return records
+
+def delete_records(sqs, queue_url, records):
+    for start in range(0, len(records), 10):
+        sqs.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': str(i), 'ReceiptHandle': record['receiptHandle']}
+                     for i, record in enumerate(records[start:start + 10])]
+        )
+
+def acknowledge(sqs, queue_url, records, response):
+    """Delete the records a handler did not report as batch item failures"""
+    failed = {item['itemIdentifier'] for item in (response or {}).get('batchItemFailures', [])}
+    done = [record for record in records if record['messageId'] not in failed]
+    delete_records(sqs, queue_url, done)
+    return len(done), len(failed)
+
+class StreamReader:
+    def __init__(self, streams_client, stream_arn):
+        """Poll a DynamoDB stream and return Lambda-shaped records"""
+        self.client = streams_client
+        self.stream_arn = stream_arn
+        self.iterators = {}
+
+    def poll(self):
+        shards = self.client.describe_stream(StreamArn=self.stream_arn)['StreamDescription']['Shards']
+        records = []
+        for shard in shards:
+            shard_id = shard['ShardId']
+            if shard_id not in self.iterators:
+                self.iterators[shard_id] = self.client.get_shard_iterator(
+                    StreamArn=self.stream_arn, ShardId=shard_id, ShardIteratorType='TRIM_HORIZON'
+                )['ShardIterator']
+            iterator = self.iterators[shard_id]
+            while iterator:
+                response = self.client.get_records(ShardIterator=iterator)
+                iterator = response.get('NextShardIterator')
+                if not response['Records']:
+                    break
+                for record in response['Records']:
+                    stream = dict(record['dynamodb'])
+                    created = stream.get('ApproximateCreationDateTime')
+                    if isinstance(created, datetime):
+                        # Lambda nhận epoch seconds, boto3 trả về datetime
+                        stream['ApproximateCreationDateTime'] = created.timestamp()
+                    records.append({**record, 'dynamodb': stream, 'eventSourceARN': self.stream_arn})
+            self.iterators[shard_id] = iterator
+        return records
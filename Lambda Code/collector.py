@@ -7,11 +7,22 @@ import boto3
 from botocore.exceptions import ClientError
 from decimal import Decimal
 import time
+from sqs_batch import SQSBatchSender
+from graph_fetcher import GraphFetcher, PageBudget
+from instrumentation import metrics, instrumented
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# BatchGetItem nhận tối đa 100 keys mỗi lần gọi
+DYNAMODB_BATCH_GET_SIZE = 100
+DYNAMODB_MAX_RETRIES = 5
+
+FACEBOOK_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S+0000'
+POST_FIELDS = 'id,message,created_time,attachments{type,media,url}'
+COMMENT_FIELDS = 'id,message,created_time'
+
 class FacebookCollector:
     def __init__(self):
         """Initialize with AWS services and credentials"""
@@ -20,40 +31,133 @@ class FacebookCollector:
         self.queue_url = os.environ['SQS_RAW_QUEUE_URL']
         
         # Initialize AWS clients
-        self.graph = facebook.GraphAPI(access_token=self.access_token, version='3.1')
+        self.fetcher = GraphFetcher(self.access_token, version='3.1')
+        self.graph = facebook.GraphAPI(access_token=self.access_token, version='3.1', session=self.fetcher.session)
         self.sqs_client = boto3.client('sqs')
+        self.sqs_sender = SQSBatchSender(self.sqs_client, self.queue_url)
         self.dynamodb = boto3.resource('dynamodb')
         self.processed_table = self.dynamodb.Table(os.environ['PROCESSED_COMMENTS_TABLE'])
         self.posts_table = self.dynamodb.Table(os.environ['POSTS_TABLE'])
-        
-    def is_comment_processed(self, comment_id):
-        """Check if comment has been processed before"""
-        try:
-            response = self.processed_table.get_item(
-                Key={
-                    'comment_id': comment_id
+        self.processed_ttl_days = int(os.environ.get('PROCESSED_TTL_DAYS', '30'))
+
+        # Incremental collection settings
+        self.incremental = os.environ.get('INCREMENTAL_COLLECTION', 'true').lower() == 'true'
+        self.posts_limit = int(os.environ.get('POSTS_LIMIT', '5'))
+        self.comments_page_size = int(os.environ.get('COMMENTS_PAGE_SIZE', '100'))
+        self.page_budget = int(os.environ.get('GRAPH_PAGE_BUDGET', '50'))
+        # post_id -> (since, cursor) mới, chỉ lưu sau khi comment của post đã tới SQS
+        self.watermarks = {}
+
+    def batch_get(self, table, keys, projection):
+        """Fetch items with batch_get_item in chunks of 100, retrying unprocessed keys"""
+        items = []
+        table_name = table.name
+        keys = list(keys)
+
+        for start in range(0, len(keys), DYNAMODB_BATCH_GET_SIZE):
+            request = {
+                table_name: {
+                    'Keys': keys[start:start + DYNAMODB_BATCH_GET_SIZE],
+                    'ProjectionExpression': projection
                 }
-            )
-            return 'Item' in response
-        except Exception as e:
-            logger.error(f"Error checking comment status: {str(e)}")
-            return False
+            }
+            attempt = 0
+            while request:
+                try:
+                    response = self.dynamodb.batch_get_item(RequestItems=request)
+                except Exception as e:
+                    logger.error(f"Error reading from {table_name}: {str(e)}")
+                    break
+
+                items.extend(response.get('Responses', {}).get(table_name, []))
+
+                request = response.get('UnprocessedKeys') or {}
+                if request:
+                    attempt += 1
+                    if attempt > DYNAMODB_MAX_RETRIES:
+                        logger.error(f"Giving up on {len(request[table_name]['Keys'])} unprocessed keys")
+                        break
+                    time.sleep(0.05 * (2 ** attempt))
 
-    def mark_comment_processed(self, comment_id):
-        """Mark comment as processed in DynamoDB"""
+        return items
+
+    def get_processed_ids(self, comment_ids):
+        """Return the subset of comment IDs already marked as processed"""
+        # Không đọc được thì coi như chưa xử lý, giống get_item trước đây
+        items = self.batch_get(
+            self.processed_table,
+            [{'comment_id': cid} for cid in comment_ids],
+            'comment_id'
+        )
+        return {item['comment_id'] for item in items}
+
+    def load_watermarks(self, post_ids):
+        """Load the per-post comment high-water marks"""
+        items = self.batch_get(
+            self.posts_table,
+            [{'post_id': pid} for pid in post_ids],
+            'post_id, comments_since, comments_cursor'
+        )
+        return {item['post_id']: item for item in items}
+
+    def save_watermark(self, post_id, since, cursor):
+        """Store the newest comment time and paging cursor seen for a post"""
         try:
-            self.processed_table.put_item(
-                Item={
-                    'comment_id': comment_id,
-                    'processed_at': datetime.now().isoformat(),
-                }
+            expression = 'SET comments_since = :since'
+            values = {':since': since}
+            if cursor:
+                expression += ', comments_cursor = :cursor'
+                values[':cursor'] = cursor
+            self.posts_table.update_item(
+                Key={'post_id': post_id},
+                UpdateExpression=expression,
+                ExpressionAttributeValues=values
             )
-            logger.info(f"Marked comment {comment_id} as processed")
             return True
         except Exception as e:
-            logger.error(f"Error marking comment as processed: {str(e)}")
+            logger.error(f"Error saving watermark for post {post_id}: {str(e)}")
             return False
 
+    def save_watermarks(self, comments, sent):
+        """Advance the watermark of each fetched post whose new comments all reached SQS.
+
+        A post with an unsent comment keeps its old watermark, so the next
+        run fetches that comment again.
+        """
+        sent_ids = {comment['comment_id'] for comment in sent}
+        unsent_posts = {comment['post_id'] for comment in comments if comment['comment_id'] not in sent_ids}
+        saved = 0
+        for post_id, (since, cursor) in self.watermarks.items():
+            if post_id in unsent_posts:
+                logger.warning(f"Keeping the old watermark of post {post_id}, some comments were not sent")
+                continue
+            if self.save_watermark(post_id, since, cursor):
+                saved += 1
+        return saved
+
+    def mark_comments_processed(self, comment_ids):
+        """Mark comments as processed in DynamoDB with a TTL"""
+        if not comment_ids:
+            return 0
+        now = datetime.now()
+        expires_at = int((now + timedelta(days=self.processed_ttl_days)).timestamp())
+        try:
+            # batch_writer tự gom 25 items/request và gửi lại UnprocessedItems
+            with self.processed_table.batch_writer(overwrite_by_pkeys=['comment_id']) as batch:
+                for comment_id in comment_ids:
+                    batch.put_item(
+                        Item={
+                            'comment_id': comment_id,
+                            'processed_at': now.isoformat(),
+                            'expires_at': expires_at
+                        }
+                    )
+            logger.info(f"Marked {len(comment_ids)} comments as processed")
+            return len(comment_ids)
+        except Exception as e:
+            logger.error(f"Error marking comments as processed: {str(e)}")
+            return 0
+
     def save_post_data(self, post, post_type='status', media_url=''):
         """Save or update post data in DynamoDB"""
         try:
@@ -66,6 +170,7 @@ class FacebookCollector:
                 # Nếu là post mới thì tạo mới
                 post_data = {
                     'post_id': post['id'],
+                    'page_id': self.page_id,
                     'content': post.get('message', ''),
                     'post_type': post_type,
                     'created_time': post['created_time'],
@@ -83,8 +188,9 @@ class FacebookCollector:
                 # Nếu post đã tồn tại thì chỉ update các thông tin cơ bản
                 self.posts_table.update_item(
                     Key={'post_id': post['id']},
-                    UpdateExpression='SET content = :content, post_type = :type, media_url = :media, last_updated = :ts',
+                    UpdateExpression='SET page_id = :page, content = :content, post_type = :type, media_url = :media, last_updated = :ts',
                     ExpressionAttributeValues={
+                        ':page': self.page_id,
                         ':content': post.get('message', ''),
                         ':type': post_type,
                         ':media': media_url,
@@ -97,15 +203,114 @@ class FacebookCollector:
             logger.error(f"Error saving post data: {str(e)}")
             return False
 
-    def get_page_posts(self, limit=5):
+    def fetch_post_comments(self, post_id, watermark, budget):
+        """Fetch comments newer than the post's watermark, following paging cursors.
+
+        ``budget`` is a PageBudget shared by all posts fetched in this run.
+        Returns (comments, since, cursor).
+        """
+        since = int(watermark.get('comments_since', 0))
+        cursor = watermark.get('comments_cursor')
+        args = {
+            'fields': COMMENT_FIELDS,
+            'limit': self.comments_page_size,
+            'order': 'chronological'
+        }
+        # Ưu tiên cursor (tiếp tục đúng vị trí lần trước), không có thì dùng since
+        if cursor:
+            args['after'] = cursor
+        elif since:
+            args['since'] = since
+
+        comments = []
+        pages = 0
+        while budget.take():
+            try:
+                response = self.fetcher.get_connections(id=post_id, connection_name='comments', **args)
+            except facebook.GraphAPIError as e:
+                if 'after' in args and pages == 0:
+                    # Cursor cũ có thể hết hạn, thử lại bằng since
+                    logger.warning(f"Cursor rejected for post {post_id}, falling back to since: {str(e)}")
+                    args.pop('after')
+                    if since:
+                        args['since'] = since
+                    cursor = None
+                    continue
+                raise
+            pages += 1
+
+            data = response.get('data', [])
+            comments.extend(data)
+            paging = response.get('paging', {})
+            after = paging.get('cursors', {}).get('after')
+            if after:
+                cursor = after
+            if not data or 'next' not in paging:
+                break
+            args.pop('since', None)
+            args['after'] = after
+
+        for comment in comments:
+            created = int(datetime.strptime(comment['created_time'], FACEBOOK_TIME_FORMAT).timestamp())
+            since = max(since, created)
+
+        return comments, since, cursor
+
+    def collect_new_comments(self, posts):
+        """Attach only the comments newer than each post's watermark.
+
+        The new watermarks are kept in ``self.watermarks`` and saved by
+        deliver() once the comments have been sent.
+        """
+        watermarks = self.load_watermarks(post['id'] for post in posts)
+        budget = PageBudget(self.page_budget)
+
+        def fetch(post):
+            """Return (comments, (since, cursor)); the watermark is None when there is nothing to save"""
+            try:
+                comments, since, cursor = self.fetch_post_comments(
+                    post['id'], watermarks.get(post['id'], {}), budget
+                )
+            except Exception as e:
+                # Lỗi một post không làm hỏng cả lần chạy, lần sau lấy tiếp từ watermark cũ
+                logger.error(f"Error fetching comments for post {post['id']}: {str(e)}")
+                return [], None
+            return comments, ((since, cursor) if comments or cursor else None)
+
+        # Lấy comments của nhiều post song song
+        fetched = self.fetcher.map(fetch, posts)
+        results = []
+        for post, (comments, watermark) in zip(posts, fetched):
+            post['comments'] = {'data': comments}
+            if watermark:
+                self.watermarks[post['id']] = watermark
+            results.append(comments)
+
+        if budget.exhausted():
+            # Hết budget, phần còn lại sẽ được lấy ở lần chạy sau
+            logger.warning("Graph API page budget exhausted")
+        total_comments = sum(len(comments) for comments in results)
+        metrics.count('graph.pages', budget.used)
+        logger.info(f"Fetched {total_comments} new comments using {budget.used} Graph API pages")
+        return posts
+
+    def get_page_posts(self, limit=None):
         """Get posts from Facebook page with more details"""
         try:
-            posts = self.graph.get_connections(
-                id=self.page_id,
-                connection_name='posts',
-                fields='id,message,created_time,attachments{type,media,url},comments.limit(50){id,message,created_time}',
-                limit=limit
-            )
+            if limit is None:
+                limit = self.posts_limit
+            if self.incremental:
+                fields = POST_FIELDS
+            else:
+                fields = POST_FIELDS + ',comments.limit(50){' + COMMENT_FIELDS + '}'
+
+            with metrics.timer('graph.request'):
+                posts = self.graph.get_connections(
+                    id=self.page_id,
+                    connection_name='posts',
+                    fields=fields,
+                    limit=limit
+                )
             
             # Lưu thông tin post vào DynamoDB
             for post in posts.get('data', []):
@@ -123,6 +328,9 @@ class FacebookCollector:
                 
                 # Lưu hoặc update post
                 self.save_post_data(post, post_type, media_url)
+
+            if self.incremental:
+                self.collect_new_comments(posts.get('data', []))
                 
             logger.info(f"Retrieved and processed {len(posts.get('data', []))} posts")
             return posts.get('data', [])
@@ -132,9 +340,7 @@ class FacebookCollector:
 
     def extract_comments(self, posts):
         """Extract and filter unprocessed comments from posts"""
-        new_comments = []
-        processed_comments = 0
-        skipped_comments = 0
+        candidates = {}
         
         for post in posts:
             if 'comments' in post and 'data' in post['comments']:
@@ -142,66 +348,76 @@ class FacebookCollector:
                 for comment in post_comments:
                     try:
                         comment_id = comment['id']
-                        
-                        # Skip if already processed
-                        if self.is_comment_processed(comment_id):
-                            skipped_comments += 1
+                        if comment_id in candidates:
                             continue
                             
-                        comment_data = {
+                        candidates[comment_id] = {
                             'comment_id': comment_id,
                             'post_id': post['id'],
                             'comment_text': comment.get('message', ''),
                             'timestamp': int(datetime.strptime(comment['created_time'], 
-                                                            '%Y-%m-%dT%H:%M:%S+0000').timestamp()),
+                                                            FACEBOOK_TIME_FORMAT).timestamp()),
                             'metadata': {
                                 'platform': 'Facebook',
                                 'page_id': self.page_id,
                                 'post_type': post.get('type', 'unknown')
                             }
                         }
-                        
-                        new_comments.append(comment_data)
-                        
-                        # Mark as processed
-                        if self.mark_comment_processed(comment_id):
-                            processed_comments += 1
                             
                     except Exception as e:
                         logger.error(f"Error processing comment: {str(e)}")
                         continue
 
-        logger.info(f"Processed: {processed_comments}, Skipped: {skipped_comments}, New: {len(new_comments)}")
+        # Kiểm tra tất cả comment IDs cùng lúc thay vì từng comment
+        processed_ids = self.get_processed_ids(candidates.keys())
+        new_comments = [data for cid, data in candidates.items() if cid not in processed_ids]
+        skipped_comments = len(candidates) - len(new_comments)
+
+        # Comment chỉ được đánh dấu processed sau khi đã gửi tới SQS (xem deliver)
+        logger.info(f"Skipped: {skipped_comments}, New: {len(new_comments)}")
+        metrics.count('comments.new', len(new_comments))
+        metrics.count('comments.skipped', skipped_comments)
         return new_comments
 
     def send_to_sqs(self, comments):
-        """Send comments to SQS queue"""
+        """Send comments to SQS queue, returning the comments that were sent"""
         if not comments:
             logger.info("No new comments to send")
-            return 0
+            return []
 
-        messages_sent = 0
-        for comment in comments:
-            try:
-                response = self.sqs_client.send_message(
-                    QueueUrl=self.queue_url,
-                    MessageBody=json.dumps(comment, ensure_ascii=False),
-                    MessageAttributes={
-                        'DataType': {
-                            'StringValue': 'FacebookComment',
-                            'DataType': 'String'
-                        }
-                    }
-                )
-                messages_sent += 1
-                logger.debug(f"Sent message {response['MessageId']} to SQS")
-            except Exception as e:
-                logger.error(f"Error sending message to SQS: {str(e)}")
-                continue
+        results = self.sqs_sender.send_json(
+            comments,
+            message_attributes={
+                'DataType': {
+                    'StringValue': 'FacebookComment',
+                    'DataType': 'String'
+                }
+            },
+            ensure_ascii=False
+        )
+        sent = [comment for comment, success in zip(comments, results) if success]
+        metrics.count('messages.sent', len(sent))
+        metrics.count('messages.failed', len(comments) - len(sent))
+        for comment, success in zip(comments, results):
+            if not success:
+                logger.error(f"Failed to send comment {comment['comment_id']} to SQS")
 
-        logger.info(f"Successfully sent {messages_sent} messages to SQS")
-        return messages_sent
+        logger.info(f"Successfully sent {len(sent)}/{len(comments)} messages to SQS")
+        return sent
 
+    def deliver(self, comments):
+        """Send comments, then mark the sent ones processed and advance the watermarks.
+
+        Nothing is recorded before the send, so a timeout, a crash or a
+        rejected entry leaves the comments to be fetched and sent again on
+        the next run; downstream aggregation deduplicates by comment_id.
+        """
+        sent = self.send_to_sqs(comments)
+        self.mark_comments_processed([comment['comment_id'] for comment in sent])
+        self.save_watermarks(comments, sent)
+        return len(sent)
+
+@instrumented
 def lambda_handler(event, context):
     """Main Lambda handler"""
     try:
@@ -217,27 +433,16 @@ def lambda_handler(event, context):
         
         # Extract new comments
         comments = collector.extract_comments(posts)
+        
+        # Send to SQS (watermark của post chỉ được lưu khi mọi comment mới đã gửi xong)
+        messages_sent = collector.deliver(comments)
         if not comments:
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message': 'No new comments found'})
             }
         
-        # Send to SQS
-        messages_sent = collector.send_to_sqs(comments)
-
-        time.sleep(10)
-        eventbridge = boto3.client('events')
-        eventbridge.put_events(
-            Entries=[{
-                'Source': 'facebook.collector',
-                'DetailType': 'SaveHistory',
-                'Detail': json.dumps({
-                    'timestamp': datetime.now().isoformat()
-                }),
-                'Time': datetime.now()
-            }]
-        )
+        # History được ghi bởi history_stream.py từ DynamoDB Stream của posts table
         
         return {
             'statusCode': 200,
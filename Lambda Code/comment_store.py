@@ -0,0 +1,72 @@
+import os
+import logging
+from decimal import Decimal
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Độ chính xác lưu cho điểm sentiment / toxic
+SCORE_DIGITS = 4
+
+def compact(result, version=None):
+    """Processed comment -> compact item (short attribute names, no metadata).
+
+    ``version`` is the scoring version (the NLP cache version) so a
+    backfill can tell which comments are already re-scored.
+    """
+    item = {
+        'comment_id': result['comment_id'],
+        'post_id': result['post_id'],
+        'ts': int(result['timestamp']),
+        'text': result.get('comment_text', ''),
+        'lang': result['language'],
+        'sent': Decimal(str(round(float(result['sentiment_score']), SCORE_DIGITS))),
+        'tox': Decimal(str(round(float(result['toxic_score']), SCORE_DIGITS)))
+    }
+    page_id = (result.get('metadata') or {}).get('page_id')
+    if page_id:
+        item['page'] = page_id
+    if version:
+        item['v'] = version
+    return item
+
+def expand(item):
+    """Compact item -> processed comment in the shape the aggregator reads"""
+    comment = {
+        'comment_id': item['comment_id'],
+        'post_id': item['post_id'],
+        'timestamp': int(item['ts']),
+        'comment_text': item.get('text', ''),
+        'language': item.get('lang', 'unknown'),
+        'sentiment_score': float(item.get('sent', 5.0)),
+        'toxic_score': float(item.get('tox', 0.0)),
+        'metadata': {}
+    }
+    if item.get('page'):
+        comment['metadata']['page_id'] = item['page']
+    return comment
+
+class CommentStore:
+    def __init__(self, dynamodb, table_name=None, version=None):
+        """Processed comments keyed by comment_id, the corpus replayed by backfill.py"""
+        table_name = table_name or os.environ.get('COMMENTS_TABLE')
+        self.table = dynamodb.Table(table_name) if table_name else None
+        self.version = version
+
+    @property
+    def enabled(self):
+        return self.table is not None
+
+    def save_many(self, results):
+        """Write processed comments with batch writes; True when all were stored"""
+        if self.table is None or not results:
+            return True
+        try:
+            # batch_writer gom 25 items/request và tự gửi lại UnprocessedItems
+            with self.table.batch_writer(overwrite_by_pkeys=['comment_id']) as batch:
+                for result in results:
+                    batch.put_item(Item=compact(result, self.version))
+            return True
+        except Exception as e:
+            logger.error(f"Error storing {len(results)} processed comments: {str(e)}")
+            return False
@@ -0,0 +1,163 @@
+import json
+import os
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import facebook
+import requests
+from requests.adapters import HTTPAdapter
+from instrumentation import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+GRAPH_URL = 'https://graph.facebook.com'
+# Mã lỗi rate limit của Graph API
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613, 80001, 80004}
+# Bắt đầu giảm tốc khi usage vượt ngưỡng này (%)
+USAGE_SLOWDOWN = 75
+USAGE_PAUSE = 95
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """Thread-safe token bucket; ``rate`` tokens per second"""
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate_fraction(self, fraction):
+        """Scale the refill rate to a fraction of the configured maximum"""
+        with self.lock:
+            self.rate = max(self.max_rate * fraction, 0.1)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+def parse_usage(headers):
+    """Return (highest usage percentage, seconds until access is regained) from rate-limit headers"""
+    usage = 0.0
+    regain = 0.0
+    try:
+        app_usage = headers.get('x-app-usage')
+        if app_usage:
+            values = json.loads(app_usage)
+            usage = max([usage] + [float(values.get(k, 0)) for k in ('call_count', 'total_cputime', 'total_time')])
+
+        buc_usage = headers.get('x-business-use-case-usage')
+        if buc_usage:
+            for entries in json.loads(buc_usage).values():
+                for entry in entries:
+                    usage = max([usage] + [float(entry.get(k, 0)) for k in ('call_count', 'total_cputime', 'total_time')])
+                    regain = max(regain, float(entry.get('estimated_time_to_regain_access', 0)) * 60)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"Could not parse Graph API usage headers: {str(e)}")
+    return usage, regain
+
+class PageBudget:
+    def __init__(self, total):
+        """Shared, thread-safe count of Graph API pages a run may fetch"""
+        self.total = total
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if self.used >= self.total:
+                return False
+            self.used += 1
+            return True
+
+    def exhausted(self):
+        with self.lock:
+            return self.used >= self.total
+
+class GraphFetcher:
+    def __init__(self, access_token, version='3.1', max_workers=None, rate=None, max_retries=3):
+        """Bounded-concurrency Graph API client sharing one pooled HTTP session"""
+        self.access_token = access_token
+        self.version = version
+        self.max_workers = max_workers or int(os.environ.get('GRAPH_CONCURRENCY', '8'))
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate or float(os.environ.get('GRAPH_RATE', '20')))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+
+    def adapt(self, headers):
+        """Adjust pacing from the app and business use case usage headers"""
+        usage, regain = parse_usage(headers)
+        if usage >= USAGE_PAUSE:
+            logger.warning(f"Graph API usage at {usage}%, pausing requests")
+            self.bucket.set_rate_fraction(0.05)
+            self.bucket.pause(regain or 60)
+        elif usage >= USAGE_SLOWDOWN:
+            # Giảm tuyến tính từ 100% tốc độ ở 75% usage xuống 5% ở 95% usage
+            fraction = 1 - (usage - USAGE_SLOWDOWN) / (USAGE_PAUSE - USAGE_SLOWDOWN)
+            self.bucket.set_rate_fraction(max(fraction, 0.05))
+        else:
+            self.bucket.set_rate_fraction(1.0)
+
+    def get(self, path, params=None):
+        """GET a Graph API path, paced and retried on rate-limit errors"""
+        params = dict(params or {})
+        params['access_token'] = self.access_token
+        url = f"{GRAPH_URL}/v{self.version}/{path}"
+
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            with metrics.timer('graph.request'):
+                response = self.session.get(url, params=params, timeout=30)
+            self.adapt(response.headers)
+
+            try:
+                body = response.json()
+            except ValueError:
+                response.raise_for_status()
+                raise
+
+            error = body.get('error') if isinstance(body, dict) else None
+            if not error:
+                return body
+
+            metrics.count('graph.errors')
+            if error.get('code') in RATE_LIMIT_ERROR_CODES and attempt < self.max_retries:
+                metrics.count('graph.retries')
+                delay = 2 ** attempt
+                logger.warning(f"Graph API rate limited ({error.get('code')}), retrying in {delay}s")
+                self.bucket.pause(delay)
+                continue
+            raise facebook.GraphAPIError(body)
+
+    def get_connections(self, id, connection_name, **args):
+        """Same call shape as ``facebook.GraphAPI.get_connections``"""
+        return self.get(f"{id}/{connection_name}", args)
+
+    def map(self, func, items):
+        """Run ``func`` over ``items`` on the worker pool, results in input order"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
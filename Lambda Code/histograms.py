@@ -0,0 +1,33 @@
+import re
+
+# Histogram bin cố định cho mỗi post và mỗi bucket rollup. Mỗi bin là một
+# attribute số riêng (sh00..sh19, th00..th19) nên aggregator ADD được như
+# các counter khác, và gộp giữa shard, bucket chỉ là cộng từng bin.
+BINS = 20
+# name -> (prefix của attribute, key của điểm trong comment đã xử lý, min, max)
+SKETCHES = {
+    'sentiment': ('sh', 'sentiment_score', 0.0, 10.0),
+    'toxic': ('th', 'toxic_score', 0.0, 10.0)
+}
+
+BIN_ATTRIBUTE_RE = re.compile(r'^(sh|th)\d{2}$')
+
+def bin_attribute(prefix, index):
+    return f'{prefix}{index:02d}'
+
+def is_bin(name):
+    return bool(BIN_ATTRIBUTE_RE.match(name))
+
+def bin_index(value, low, high):
+    """Bin of a score; values outside the range go to the first or last bin"""
+    index = int((float(value) - low) / (high - low) * BINS)
+    return min(max(index, 0), BINS - 1)
+
+def bin_counts(comments):
+    """Per-bin counts for a group of processed comments: {attribute: count}"""
+    counts = {}
+    for comment in comments:
+        for prefix, key, low, high in SKETCHES.values():
+            name = bin_attribute(prefix, bin_index(comment.get(key, 0), low, high))
+            counts[name] = counts.get(name, 0) + 1
+    return counts
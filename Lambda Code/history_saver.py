@@ -1,31 +1,154 @@
 import json
+import os
 import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
+import instrumentation
+from post_shards import (
+    shard_count, is_shard, merge_counters, load_shards, summary_update, average_update, average_sentiment
+)
 
-def lambda_handler(event, context):
-    dynamodb = boto3.resource('dynamodb')
-    posts_table = dynamodb.Table('fb_comments_analysis_table')
-    history_table = dynamodb.Table('post_history')
-    
+POSTS_TABLE = os.environ.get('POSTS_TABLE', 'fb_comments_analysis_table')
+HISTORY_TABLE = os.environ.get('HISTORY_TABLE', 'post_history')
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', '4'))
+
+# Chỉ đọc các attribute cần cho một điểm history
+PROJECTION = (
+    'post_id, last_updated, total_comments, sentiment_sum, toxic_sum, '
+    'average_sentiment, average_toxic, shard_count, shard_of'
+)
+
+def last_history_point(history_table, post_id):
+    response = history_table.query(
+        KeyConditionExpression='post_id = :pid',
+        ExpressionAttributeValues={':pid': post_id},
+        ProjectionExpression='total_comments, average_sentiment',
+        ScanIndexForward=False,
+        Limit=1
+    )
+    items = response.get('Items', [])
+    return items[0] if items else None
+
+def is_unchanged(point, item):
+    return (
+        point is not None
+        and int(point['total_comments']) == int(item['total_comments'])
+        and Decimal(str(point['average_sentiment'])) == item['average_sentiment']
+    )
+
+def refresh_summary(posts_table, post, merged=None):
+    """Bring the stored summary of a post up to date with its counters.
+
+    The aggregator refreshes it after every batch; this repairs posts whose
+    refresh failed there: sharded posts get their ``merged`` counters,
+    other posts their averages.
+    """
+    if merged is not None:
+        if int(post.get('total_comments', 0)) >= int(merged.get('total_comments', 0)):
+            return False
+        update = summary_update(post['post_id'], merged, shard_count(post))
+    else:
+        update = average_update(post['post_id'], post)
+        if update is None or (
+            post.get('average_sentiment') == update['ExpressionAttributeValues'][':avg_sent']
+            and post.get('average_toxic') == update['ExpressionAttributeValues'][':avg_tox']
+        ):
+            return False
+    if update is None:
+        return False
     try:
-        response = posts_table.scan()
-        
-        for post in response['Items']:
-            history_table.put_item(
-                Item={
+        posts_table.update_item(**update)
+        return True
+    except ClientError as e:
+        # Aggregator vừa ghi bản mới hơn, hoặc post vừa được chia thêm shard
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            print(f"Error refreshing summary for post {post['post_id']}: {str(e)}")
+        return False
+
+def save_segment(segment, total_segments):
+    """Scan one segment, following LastEvaluatedKey, and write changed posts"""
+    # Resource boto3 không thread-safe nên mỗi segment dùng session riêng
+    dynamodb = instrumentation.instrument_session(boto3.session.Session()).resource('dynamodb')
+    posts_table = dynamodb.Table(POSTS_TABLE)
+    history_table = dynamodb.Table(HISTORY_TABLE)
+    stats = {'scanned': 0, 'written': 0, 'skipped': 0, 'refreshed': 0}
+
+    scan_args = {
+        'ProjectionExpression': PROJECTION,
+        'Segment': segment,
+        'TotalSegments': total_segments
+    }
+    with history_table.batch_writer(overwrite_by_pkeys=['post_id', 'last_updated']) as batch:
+        while True:
+            response = posts_table.scan(**scan_args)
+            for post in response.get('Items', []):
+                stats['scanned'] += 1
+                if is_shard(post):
+                    # Shard được gộp khi đọc item gốc của post
+                    continue
+                if shard_count(post) > 1:
+                    # Post nóng: bản tóm tắt trên item gốc có thể trễ, gộp trực tiếp các shard
+                    try:
+                        merged = merge_counters(load_shards(dynamodb, POSTS_TABLE, post['post_id'], shard_count(post)))
+                    except Exception as e:
+                        # Không ghi điểm history từ một phần các shard, lần chạy sau sẽ thử lại
+                        print(f"Error loading shards of post {post['post_id']}: {str(e)}")
+                        stats['skipped'] += 1
+                        continue
+                    if refresh_summary(posts_table, post, merged):
+                        stats['refreshed'] += 1
+                    post = {**post, **merged}
+                elif refresh_summary(posts_table, post):
+                    stats['refreshed'] += 1
+                if 'total_comments' not in post or 'last_updated' not in post:
+                    stats['skipped'] += 1
+                    continue
+
+                item = {
                     'post_id': post['post_id'],
                     'last_updated': post['last_updated'],
-                    'average_sentiment': Decimal(post['average_sentiment']),
+                    'average_sentiment': average_sentiment(post),
                     'total_comments': int(post['total_comments'])
                 }
-            )
-            
+                # Bỏ qua post không thay đổi so với điểm history gần nhất
+                if is_unchanged(last_history_point(history_table, post['post_id']), item):
+                    stats['skipped'] += 1
+                    continue
+
+                batch.put_item(Item=item)
+                stats['written'] += 1
+
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return stats
+
+@instrumentation.instrumented
+def lambda_handler(event, context):
+    try:
+        with ThreadPoolExecutor(max_workers=SCAN_SEGMENTS) as executor:
+            results = list(executor.map(
+                lambda segment: save_segment(segment, SCAN_SEGMENTS),
+                range(SCAN_SEGMENTS)
+            ))
+
+        metrics = {
+            key: sum(result[key] for result in results)
+            for key in ('scanned', 'written', 'skipped', 'refreshed')
+        }
+        print(f"History snapshot: {json.dumps(metrics)}")
+        for key, value in metrics.items():
+            instrumentation.metrics.count(f'history.{key}', value)
+
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'History saved successfully',
-                'timestamp': datetime.now().isoformat()
+                'timestamp': datetime.now().isoformat(),
+                **metrics
             })
         }
     except Exception as e:
@@ -35,4 +158,4 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'error': str(e)
             })
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,95 @@
+import os
+import boto3
+import logging
+from boto3.dynamodb.types import TypeDeserializer
+from instrumentation import metrics, instrumented
+from post_shards import is_shard, average_sentiment
+
+# Setup logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Các attribute quyết định một điểm history có thay đổi hay không
+METRIC_ATTRIBUTES = ('total_comments', 'sentiment_sum', 'toxic_sum')
+
+deserializer = TypeDeserializer()
+
+def from_image(image):
+    """Convert a stream image (DynamoDB JSON) to plain Python values"""
+    return {key: deserializer.deserialize(value) for key, value in (image or {}).items()}
+
+class HistoryRecorder:
+    def __init__(self):
+        """Initialize recorder with AWS services"""
+        self.dynamodb = boto3.resource('dynamodb')
+        self.history_table = self.dynamodb.Table(os.environ.get('HISTORY_TABLE', 'post_history'))
+        self.window_seconds = int(os.environ.get('HISTORY_WINDOW_SECONDS', '60'))
+
+    def metrics_changed(self, old, new):
+        """True when any aggregated metric differs between the two images"""
+        return any(old.get(attr) != new.get(attr) for attr in METRIC_ATTRIBUTES)
+
+    def collect_changes(self, records):
+        """Keep the latest changed image per post and time window"""
+        latest = {}
+        skipped = 0
+        for record in records:
+            if record.get('eventName') not in ('INSERT', 'MODIFY'):
+                continue
+            stream = record['dynamodb']
+            old = from_image(stream.get('OldImage'))
+            new = from_image(stream.get('NewImage'))
+            if not new or 'total_comments' not in new or not self.metrics_changed(old, new):
+                # Ví dụ: collector chỉ cập nhật content hoặc watermark
+                skipped += 1
+                continue
+            if is_shard(new):
+                # Shard của post nóng: history lấy từ bản tóm tắt gộp trên item gốc
+                skipped += 1
+                continue
+
+            window = int(stream.get('ApproximateCreationDateTime', 0)) // self.window_seconds
+            # Records của cùng một item đến theo thứ tự, bản sau ghi đè bản trước
+            latest[(new['post_id'], window)] = new
+
+        return list(latest.values()), skipped
+
+    def save_history(self, posts):
+        """Write one history point per changed post with batch writes"""
+        with self.history_table.batch_writer(overwrite_by_pkeys=['post_id', 'last_updated']) as batch:
+            for post in posts:
+                batch.put_item(
+                    Item={
+                        'post_id': post['post_id'],
+                        'last_updated': post['last_updated'],
+                        'average_sentiment': average_sentiment(post),
+                        'total_comments': int(post['total_comments'])
+                    }
+                )
+        return len(posts)
+
+@instrumented
+def lambda_handler(event, context):
+    """Lambda handler for posts table stream records"""
+    records = event.get('Records', [])
+    if not records:
+        return {'batchItemFailures': []}
+
+    try:
+        recorder = HistoryRecorder()
+        posts, skipped = recorder.collect_changes(records)
+        written = recorder.save_history(posts) if posts else 0
+        logger.info(f"Stream records: {len(records)}, history points written: {written}, unchanged: {skipped}")
+        metrics.count('records', len(records))
+        metrics.count('history.written', written)
+        metrics.count('history.unchanged', skipped)
+        return {'batchItemFailures': []}
+
+    except Exception as e:
+        logger.error(f"Error saving history from stream: {str(e)}")
+        # Ghi lại từ đầu batch; các điểm history ghi đè theo key nên retry an toàn
+        return {
+            'batchItemFailures': [
+                {'itemIdentifier': records[0]['dynamodb']['SequenceNumber']}
+            ]
+        }
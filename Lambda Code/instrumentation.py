@@ -0,0 +1,159 @@
+import json
+import os
+import time
+import random
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+import boto3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'FacebookAnalytics')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+# Log payload (event, record) chỉ khi bật và theo tỉ lệ lấy mẫu
+LOG_PAYLOADS = os.environ.get('LOG_PAYLOADS', 'false').lower() == 'true'
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+LOG_PAYLOAD_MAX_BYTES = int(os.environ.get('LOG_PAYLOAD_MAX_BYTES', '4096'))
+
+# EMF nhận tối đa 100 giá trị cho mỗi metric trong một document
+EMF_MAX_VALUES = 100
+
+class Metrics:
+    def __init__(self):
+        """Per-invocation timers and counters, flushed as CloudWatch EMF records"""
+        self.function = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counts = {}
+
+    def add_timing(self, name, milliseconds):
+        with self.lock:
+            self.timings.setdefault(name, []).append(milliseconds)
+
+    def count(self, name, value=1):
+        if not value:
+            return
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name):
+        """Time a block as ``<name>.time`` and count it as ``<name>.calls``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(f'{name}.time', (time.perf_counter() - start) * 1000)
+            self.count(f'{name}.calls')
+
+    def documents(self):
+        """Build EMF documents, splitting timers with more than 100 samples"""
+        with self.lock:
+            timings = {name: list(values) for name, values in self.timings.items()}
+            counts = dict(self.counts)
+
+        documents = []
+        first = True
+        while first or any(timings.values()):
+            document = {}
+            definitions = []
+            for name, values in timings.items():
+                if values:
+                    document[name] = values[:EMF_MAX_VALUES]
+                    del values[:EMF_MAX_VALUES]
+                    definitions.append({'Name': name, 'Unit': 'Milliseconds'})
+            if first:
+                # Counter chỉ ghi một lần
+                for name, value in counts.items():
+                    document[name] = value
+                    definitions.append({'Name': name, 'Unit': 'Count'})
+                first = False
+            if not definitions:
+                break
+            document['Function'] = self.function
+            document['_aws'] = {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['Function']],
+                    'Metrics': definitions
+                }]
+            }
+            documents.append(document)
+        return documents
+
+    def flush(self):
+        """Print the EMF records (CloudWatch Logs extracts the metrics) and reset"""
+        if METRICS_ENABLED:
+            for document in self.documents():
+                print(json.dumps(document))
+        self.reset()
+
+metrics = Metrics()
+
+def _before_call(model, context, **kwargs):
+    context['metrics_call'] = (f'{model.service_model.service_name}.{model.name}', time.perf_counter())
+
+def _after_call(context, http_response=None, parsed=None, exception=None, **kwargs):
+    call = context.pop('metrics_call', None)
+    if call is None:
+        return
+    name, start = call
+    metrics.add_timing(f'{name}.time', (time.perf_counter() - start) * 1000)
+    metrics.count(f'{name}.calls')
+    if exception is not None or (http_response is not None and http_response.status_code >= 300):
+        metrics.count(f'{name}.errors')
+    if parsed:
+        # Số lần botocore tự gửi lại (throttling, lỗi 5xx)
+        metrics.count(f'{name}.retries', parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+def instrument_session(session=None):
+    """Time every AWS API call made by clients created from ``session``.
+
+    Defaults to the boto3 default session used by ``boto3.client`` and
+    ``boto3.resource``; call it before the clients are created.
+    """
+    if session is None:
+        session = boto3._get_default_session()
+    events = session.events
+    events.register('before-call', _before_call, unique_id='metrics-before-call')
+    events.register('after-call', _after_call, unique_id='metrics-after-call')
+    events.register('after-call-error', _after_call, unique_id='metrics-after-call-error')
+    return session
+
+def log_payload(label, payload):
+    """Log a payload only when LOG_PAYLOADS is on, sampled and truncated"""
+    if not LOG_PAYLOADS or random.random() >= LOG_SAMPLE_RATE:
+        return
+    try:
+        text = json.dumps(payload, default=str, ensure_ascii=False)
+    except (TypeError, ValueError):
+        text = str(payload)
+    if len(text) > LOG_PAYLOAD_MAX_BYTES:
+        text = text[:LOG_PAYLOAD_MAX_BYTES] + f'... ({len(text)} chars)'
+    logger.info(f"{label}: {text}")
+
+def instrumented(func):
+    """Wrap a lambda_handler: instrument boto3, time the invocation, flush EMF"""
+    @functools.wraps(func)
+    def wrapper(event, context):
+        instrument_session()
+        metrics.reset()
+        start = time.perf_counter()
+        try:
+            return func(event, context)
+        except Exception:
+            metrics.count('handler.errors')
+            raise
+        finally:
+            metrics.add_timing('handler.time', (time.perf_counter() - start) * 1000)
+            metrics.flush()
+    return wrapper
@@ -0,0 +1,138 @@
+import os
+import re
+import unicodedata
+
+# Dưới ngưỡng này thì hỏi Comprehend
+CONFIDENCE_THRESHOLD = float(os.environ.get('LOCAL_LANGID_THRESHOLD', '0.85'))
+
+URL_RE = re.compile(r'(?:https?://|www\.)\S+', re.IGNORECASE)
+MENTION_RE = re.compile(r'@\w+')
+WORD_RE = re.compile(r'[^\W\d_]+')
+
+# Chữ cái chỉ có trong tiếng Việt. Không gồm â, ê, ô (cũng có trong tiếng Pháp,
+# Bồ Đào Nha) hay các dấu sắc/huyền/ngã đơn (à, é, õ... dùng chung nhiều ngôn ngữ)
+VIETNAMESE_CHARS = set(
+    'ăđơư'
+    'ạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ'
+)
+
+# (tên script trong unicodedata.name, language, confidence)
+SCRIPTS = [
+    ('HANGUL', 'ko', 0.97),
+    ('HIRAGANA', 'ja', 0.97),
+    ('KATAKANA', 'ja', 0.95),
+    ('THAI', 'th', 0.97),
+    ('HEBREW', 'he', 0.95),
+    ('GREEK', 'el', 0.95),
+    ('DEVANAGARI', 'hi', 0.9),
+    # Arabic script cũng dùng cho fa/ur, Cyrillic cho uk/bg, Han cho zh/zh-TW/ja
+    ('ARABIC', 'ar', 0.75),
+    ('CYRILLIC', 'ru', 0.75),
+    ('CJK', 'zh', 0.75),
+]
+
+ENGLISH_WORDS = {
+    'the', 'a', 'an', 'and', 'or', 'but', 'is', 'are', 'was', 'were', 'be', 'been', 'i', 'you', 'he',
+    'she', 'it', 'we', 'they', 'this', 'that', 'these', 'those', 'of', 'to', 'in', 'on', 'for', 'with',
+    'at', 'by', 'from', 'my', 'your', 'so', 'not', 'no', 'yes', 'do', 'does', 'did', 'have', 'has',
+    'what', 'how', 'why', 'who', 'when', 'where', 'can', 'will', 'just', 'very', 'really', 'all',
+    'love', 'like', 'nice', 'good', 'great', 'awesome', 'amazing', 'thanks', 'thank', 'wow', 'cool',
+    'lol', 'omg', 'beautiful', 'best', 'bad', 'first', 'congrats', 'please', 'more', 'hello', 'hi'
+}
+
+# Trigram ký tự phổ biến trong tiếng Anh
+ENGLISH_TRIGRAMS = {
+    'the', 'ing', 'and', 'ion', 'tio', 'ent', 'ati', 'for', 'her', 'ter', 'hat', 'tha', 'ere', 'ate',
+    'his', 'con', 'res', 'ver', 'all', 'ons', 'nce', 'men', 'ith', 'ted', 'ers', 'pro', 'thi', 'wit',
+    'are', 'ess', 'not', 'ive', 'was', 'ect', 'rea', 'com', 'eve', 'per', 'int', 'est', 'sta', 'cti',
+    'ica', 'ist', 'ear', 'ain', 'one', 'our', 'iti', 'rat', 'ove', 'ell', 'you', 'ght', 'oul', 'ome'
+}
+
+# Từ tiếng Việt không dấu / teencode hay gặp
+VIETNAMESE_ASCII_WORDS = {
+    'ko', 'k', 'khong', 'dc', 'duoc', 'j', 'gi', 'vay', 'the', 'nha', 'nhe', 'ak', 'a', 'e', 'anh',
+    'em', 'chi', 'ban', 'minh', 'qua', 'hay', 'roi', 'di', 'ne', 'oi', 'cam', 'on', 'la', 'cua',
+    'va', 'co', 'nay', 'lam', 'ah', 'ạ', 'thi', 'mn', 'ad', 'bai', 'viet'
+}
+
+def strip_noise(text):
+    """Remove URLs and @mentions, which carry no language signal"""
+    return MENTION_RE.sub(' ', URL_RE.sub(' ', text))
+
+def trigram_score(words):
+    trigrams = [word[i:i + 3] for word in words for i in range(len(word) - 2)]
+    if not trigrams:
+        return 0.0
+    return sum(1 for trigram in trigrams if trigram in ENGLISH_TRIGRAMS) / len(trigrams)
+
+def classify_latin(words):
+    """Vietnamese by its own letters, English by function words and trigrams"""
+    letters = ''.join(words)
+    if any(ch in VIETNAMESE_CHARS for ch in letters):
+        # Khi đã có chữ riêng của tiếng Việt, mọi từ có dấu đều tính là tiếng Việt
+        marked = sum(1 for word in words if not word.isascii())
+        return 'vi', min(0.99, 0.85 + 0.3 * marked / len(words))
+
+    if not all(ch.isascii() for ch in letters):
+        # Latin có dấu khác (fr, es, de, ...): để Comprehend quyết định
+        return None, 0.0
+
+    english = sum(1 for word in words if word in ENGLISH_WORDS) / len(words)
+    vietnamese = sum(1 for word in words if word in VIETNAMESE_ASCII_WORDS) / len(words)
+    if vietnamese > english:
+        return None, 0.0
+
+    trigrams = trigram_score(words)
+    if len(words) <= 2:
+        # Comment rất ngắn: chỉ tin khi là từ tiếng Anh quen thuộc
+        return ('en', 0.9) if english == 1.0 else (None, 0.0)
+    confidence = min(0.99, 0.55 + english + trigrams)
+    return 'en', confidence if english >= 0.2 else min(confidence, 0.8)
+
+def classify(text):
+    """Classify a comment locally.
+
+    Returns (language, confidence, analyzable). ``analyzable`` is False for
+    text with no letters at all (empty, emoji, URLs, numbers), for which
+    sentiment is skipped. ``language`` is None when the local classifier
+    has no opinion.
+    """
+    words = WORD_RE.findall(strip_noise(text).casefold())
+    if not words:
+        return 'unknown', 1.0, False
+
+    scripts = {}
+    for ch in ''.join(words):
+        name = unicodedata.name(ch, '')
+        script = 'LATIN' if name.startswith('LATIN') else next(
+            (prefix for prefix, _, _ in SCRIPTS if name.startswith(prefix)), 'OTHER'
+        )
+        scripts[script] = scripts.get(script, 0) + 1
+
+    total = sum(scripts.values())
+    dominant, count = max(scripts.items(), key=lambda item: item[1])
+    if count / total < 0.8:
+        # Trộn nhiều script
+        return None, 0.0, True
+
+    if dominant == 'LATIN':
+        language, confidence = classify_latin(words)
+        return language, confidence, True
+
+    # Kana xuất hiện cùng Kanji là tiếng Nhật
+    if dominant == 'CJK' and (scripts.get('HIRAGANA') or scripts.get('KATAKANA')):
+        return 'ja', 0.95, True
+
+    for prefix, language, confidence in SCRIPTS:
+        if dominant == prefix:
+            return language, confidence, True
+    return None, 0.0, True
+
+def detect(text, threshold=CONFIDENCE_THRESHOLD):
+    """Return (language, analyzable) when confident, else (None, True)"""
+    language, confidence, analyzable = classify(text)
+    if not analyzable:
+        return 'unknown', False
+    if language and confidence >= threshold:
+        return language, True
+    return None, True
@@ -0,0 +1,150 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DYNAMODB_BATCH_GET_SIZE = 100
+DYNAMODB_MAX_RETRIES = 5
+
+def normalize(text):
+    """Normalize text so trivially different copies share one cache entry"""
+    return ' '.join(unicodedata.normalize('NFC', text).casefold().split())
+
+class NLPCache:
+    # Tier 1 dùng chung giữa các lần gọi warm của cùng container
+    _memory = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, dynamodb=None):
+        """Two-tier memo cache (in-container LRU, shared DynamoDB table) for NLP results"""
+        self.max_entries = int(os.environ.get('NLP_CACHE_SIZE', '10000'))
+        # Đổi version khi logic chấm điểm thay đổi để bỏ qua kết quả cũ
+        self.version = os.environ.get('NLP_CACHE_VERSION', '1')
+        self.ttl_days = int(os.environ.get('NLP_CACHE_TTL_DAYS', '30'))
+        table_name = os.environ.get('NLP_CACHE_TABLE')
+        self.dynamodb = dynamodb
+        self.table = dynamodb.Table(table_name) if dynamodb is not None and table_name else None
+        self.stats = {'memory_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.version}:{normalize(text)}".encode('utf-8')).hexdigest()
+
+    def remember(self, key, result):
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def recall(self, key):
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+            return result
+
+    def get_shared(self, keys):
+        """Look keys up in the shared table with batch_get_item.
+
+        Expired items are skipped: DynamoDB TTL can delete them up to days late.
+        """
+        found = {}
+        if self.table is None or not keys:
+            return found
+        table_name = self.table.name
+        now = int(time.time())
+        for start in range(0, len(keys), DYNAMODB_BATCH_GET_SIZE):
+            request = {
+                table_name: {
+                    'Keys': [{'text_hash': key} for key in keys[start:start + DYNAMODB_BATCH_GET_SIZE]],
+                    'ProjectionExpression': 'text_hash, #lang, sentiment, toxic, expires_at',
+                    'ExpressionAttributeNames': {'#lang': 'language'}
+                }
+            }
+            attempt = 0
+            while request:
+                try:
+                    response = self.dynamodb.batch_get_item(RequestItems=request)
+                except Exception as e:
+                    logger.error(f"Error reading NLP cache: {str(e)}")
+                    break
+                for item in response.get('Responses', {}).get(table_name, []):
+                    if 'expires_at' in item and int(item['expires_at']) <= now:
+                        continue
+                    found[item['text_hash']] = {
+                        'language': item['language'],
+                        'sentiment': float(item['sentiment']),
+                        'toxic': float(item['toxic'])
+                    }
+                request = response.get('UnprocessedKeys') or {}
+                if request:
+                    attempt += 1
+                    if attempt > DYNAMODB_MAX_RETRIES:
+                        break
+                    time.sleep(0.05 * (2 ** attempt))
+        return found
+
+    def get_many(self, texts):
+        """Return cached results aligned with ``texts`` (None on miss)"""
+        keys = [self.key(text) for text in texts]
+        results = [None] * len(texts)
+        shared_lookup = []
+        for i, key in enumerate(keys):
+            results[i] = self.recall(key)
+            if results[i] is not None:
+                self.stats['memory_hits'] += 1
+            else:
+                shared_lookup.append(key)
+
+        shared = self.get_shared(list(dict.fromkeys(shared_lookup)))
+        for i, key in enumerate(keys):
+            if results[i] is not None:
+                continue
+            if key in shared:
+                results[i] = shared[key]
+                self.remember(key, shared[key])
+                self.stats['shared_hits'] += 1
+            else:
+                self.stats['misses'] += 1
+        return results
+
+    def put_many(self, entries):
+        """Store (text, result) pairs in both tiers"""
+        items = {}
+        for text, result in entries:
+            key = self.key(text)
+            self.remember(key, result)
+            items[key] = result
+
+        if self.table is None or not items:
+            return
+        expires_at = int((datetime.now() + timedelta(days=self.ttl_days)).timestamp())
+        try:
+            with self.table.batch_writer(overwrite_by_pkeys=['text_hash']) as batch:
+                for key, result in items.items():
+                    batch.put_item(
+                        Item={
+                            'text_hash': key,
+                            'language': result['language'],
+                            'sentiment': Decimal(str(result['sentiment'])),
+                            'toxic': Decimal(str(result['toxic'])),
+                            'expires_at': expires_at
+                        }
+                    )
+        except Exception as e:
+            # Cache lỗi không ảnh hưởng kết quả xử lý
+            logger.error(f"Error writing NLP cache: {str(e)}")
+
+    def hit_rate(self):
+        total = sum(self.stats.values())
+        if not total:
+            return 0.0
+        return (self.stats['memory_hits'] + self.stats['shared_hits']) / total
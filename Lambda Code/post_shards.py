@@ -0,0 +1,133 @@
+import time
+from decimal import Decimal
+
+from histograms import is_bin
+
+# Post nóng được chia counter ra các item post_id#0 .. post_id#(N-1).
+# Item gốc post_id giữ shard_count và bản tóm tắt đã gộp (aggregator làm mới định kỳ).
+SHARD_SEPARATOR = '#'
+SHARD_COUNT_ATTRIBUTE = 'shard_count'
+# Đánh dấu item shard để scan và stream bỏ qua
+SHARD_OF_ATTRIBUTE = 'shard_of'
+
+COUNTER_ATTRIBUTES = ('total_comments', 'sentiment_sum', 'toxic_sum')
+
+# Số lần gửi lại UnprocessedKeys (backoff lũy thừa) trước khi báo lỗi
+BATCH_GET_MAX_RETRIES = 5
+
+def shard_key(post_id, shard):
+    return f'{post_id}{SHARD_SEPARATOR}{shard}'
+
+def shard_ids(post_id, count):
+    return [shard_key(post_id, shard) for shard in range(count)]
+
+def shard_count(item):
+    """Number of counter shards of a post item (1 when it is not sharded)"""
+    return int((item or {}).get(SHARD_COUNT_ATTRIBUTE) or 1)
+
+def is_shard(item):
+    return SHARD_OF_ATTRIBUTE in (item or {})
+
+def is_counter(name):
+    """Counters are ADDed by the aggregator and summed across shards"""
+    return name in COUNTER_ATTRIBUTES or name.startswith('lang_') or is_bin(name)
+
+def merge_counters(items):
+    """Sum the counters of shard items and keep the latest last_updated"""
+    merged = {}
+    for item in items:
+        for name, value in item.items():
+            if is_counter(name):
+                merged[name] = merged.get(name, 0) + value
+            elif name == 'last_updated' and value > merged.get(name, ''):
+                merged[name] = value
+    return merged
+
+def average_sentiment(post):
+    """Average sentiment of a post (or merged shards) derived from its sums, used by history points"""
+    total = int(post.get('total_comments', 0))
+    if total:
+        return Decimal(str(post['sentiment_sum'])) / total
+    return Decimal(str(post.get('average_sentiment', '5.0')))
+
+def summary_update(post_id, merged, shards):
+    """update_item arguments that write a sharded post's merged counters to its base item.
+
+    Counts only grow, so an older merge never overwrites a newer one, and a
+    merge that missed a newly added shard fails the shard_count condition.
+    Returns None when there is nothing to write yet.
+    """
+    total = merged.get('total_comments', 0)
+    if not total:
+        return None
+
+    names = {}
+    values = {
+        ':avg_sent': Decimal(str(merged.get('sentiment_sum', 0))) / total,
+        ':avg_tox': Decimal(str(merged.get('toxic_sum', 0))) / total,
+        ':shards': shards,
+        ':total': total
+    }
+    clauses = ['average_sentiment = :avg_sent', 'average_toxic = :avg_tox']
+    for i, (name, value) in enumerate(sorted(merged.items())):
+        names[f'#m{i}'] = name
+        values[f':m{i}'] = value
+        clauses.append(f'#m{i} = :m{i}')
+
+    return {
+        'Key': {'post_id': post_id},
+        'UpdateExpression': 'SET ' + ', '.join(clauses),
+        'ConditionExpression': (
+            f'{SHARD_COUNT_ATTRIBUTE} = :shards AND '
+            '(attribute_not_exists(total_comments) OR total_comments <= :total)'
+        ),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values
+    }
+
+def average_update(post_id, item):
+    """update_item arguments that store the averages of an unsharded post as summary index sort keys.
+
+    The condition skips the write if the counts changed since ``item`` was
+    read; whoever changed them refreshes the averages too.
+    """
+    total = item.get('total_comments')
+    if not total:
+        return None
+    return {
+        'Key': {'post_id': post_id},
+        'UpdateExpression': 'SET average_sentiment = :avg_sent, average_toxic = :avg_tox',
+        'ConditionExpression': 'total_comments = :total',
+        'ExpressionAttributeValues': {
+            ':avg_sent': Decimal(str(item.get('sentiment_sum', 0))) / total,
+            ':avg_tox': Decimal(str(item.get('toxic_sum', 0))) / total,
+            ':total': total
+        }
+    }
+
+def load_shards(dynamodb, table_name, post_id, count):
+    """Read every shard item of a post with consistent BatchGetItem reads.
+
+    Raises when DynamoDB keeps returning unprocessed keys, so callers fail
+    instead of working with a partial merge.
+    """
+    request = {
+        table_name: {
+            'Keys': [{'post_id': key} for key in shard_ids(post_id, count)],
+            'ConsistentRead': True
+        }
+    }
+    items = []
+    attempt = 0
+    while request:
+        response = dynamodb.batch_get_item(RequestItems=request)
+        items.extend(response.get('Responses', {}).get(table_name, []))
+        request = response.get('UnprocessedKeys')
+        if request:
+            attempt += 1
+            if attempt > BATCH_GET_MAX_RETRIES:
+                raise RuntimeError(
+                    f"Unprocessed shard keys for post {post_id} after {BATCH_GET_MAX_RETRIES} retries"
+                )
+            time.sleep(min(0.05 * (2 ** attempt), 1))
+    return items
@@ -1,26 +1,101 @@
 import json
 import os
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import logging
 from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from sqs_batch import SQSBatchSender
+from aggregator import CommentAggregator, AGGREGATED_ATTRIBUTE
+import toxicity
+import langid_local
+from nlp_cache import NLPCache, normalize
+from comment_store import CommentStore
+from instrumentation import metrics, instrumented, log_payload
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Comprehend giới hạn 25 documents cho mỗi batch call
+COMPREHEND_BATCH_SIZE = 25
+# Giới hạn 5000 bytes (UTF-8) cho mỗi document
+COMPREHEND_MAX_BYTES = 5000
+# Số lần thử tối đa của botocore (adaptive retry tự giảm tốc khi bị throttle)
+COMPREHEND_MAX_ATTEMPTS = 8
+# Các ngôn ngữ DetectSentiment hỗ trợ
+SENTIMENT_LANGUAGES = {'en', 'es', 'fr', 'de', 'it', 'pt', 'ar', 'hi', 'ja', 'ko', 'zh', 'zh-TW'}
+
+# Chuyển đổi sentiment sang thang 0 đến 10
+SENTIMENT_MAP = {
+    'POSITIVE': 8.5,    # Tích cực
+    'NEGATIVE': 1.5,    # Tiêu cực
+    'NEUTRAL': 5.0,     # Trung tính
+    'MIXED': 5.0        # Hỗn hợp
+}
+
+def chunks(items, size):
+    """Yield successive chunks of a list"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def truncate_utf8(text, max_bytes=COMPREHEND_MAX_BYTES):
+    """Trim text so its UTF-8 encoding fits Comprehend's document limit"""
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode('utf-8', errors='ignore')
+
 class CommentProcessor:
     def __init__(self):
         """Initialize processor with AWS services"""
-        self.sqs_client = boto3.client('sqs')
+        # Số request Comprehend/SQS chạy song song trong một batch
+        self.concurrency = int(os.environ.get('PROCESSOR_CONCURRENCY', '8'))
+        # Chia batch lớn thành từng phần để kiểm tra thời gian còn lại của Lambda
+        self.slice_size = int(os.environ.get('PROCESSOR_SLICE_SIZE', '500'))
+        self.time_reserve_ms = int(os.environ.get('PROCESSOR_TIME_RESERVE_MS', '10000'))
+        self.sqs_client = boto3.client('sqs', config=Config(max_pool_connections=self.concurrency))
         self.dynamodb = boto3.resource('dynamodb')
-        self.comprehend = boto3.client('comprehend')
-        self.result_queue_url = os.environ['SQS_RESULT_QUEUE_URL']
+        # Adaptive retry: botocore giới hạn tốc độ phía client khi Comprehend trả ThrottlingException
+        self.comprehend = boto3.client('comprehend', config=Config(
+            retries={'mode': 'adaptive', 'max_attempts': COMPREHEND_MAX_ATTEMPTS},
+            max_pool_connections=self.concurrency
+        ))
         self.table = self.dynamodb.Table(os.environ['DYNAMODB_TABLE'])
+        self.batch_mode = os.environ.get('NLP_BATCH_MODE', 'true').lower() == 'true'
+        # queue: gửi kết quả sang Result Queue cho aggregator
+        # fused: cộng aggregate ngay trong processor, Result Queue chỉ còn là audit stream (tuỳ chọn)
+        self.fused = os.environ.get('PIPELINE_MODE', 'queue').lower() == 'fused'
+        if self.fused:
+            self.result_queue_url = os.environ.get('SQS_RESULT_QUEUE_URL')
+            self.aggregator = CommentAggregator(os.environ.get('AGGREGATE_TABLE', os.environ['DYNAMODB_TABLE']))
+        else:
+            self.result_queue_url = os.environ['SQS_RESULT_QUEUE_URL']
+            self.aggregator = None
+        self.result_sender = SQSBatchSender(self.sqs_client, self.result_queue_url, max_workers=self.concurrency)
+        self.cache = NLPCache(self.dynamodb)
+        # Lưu comment đã xử lý (COMMENTS_TABLE, tuỳ chọn) để backfill.py chấm lại khi logic đổi
+        self.store = CommentStore(self.dynamodb, version=self.cache.version)
+        self.local_langid = os.environ.get('LOCAL_LANGID', 'true').lower() == 'true'
+        # Thống kê nguồn xác định ngôn ngữ: local, comprehend, skipped (không có chữ)
+        self.langid_stats = {'local': 0, 'comprehend': 0, 'skipped': 0}
+
+    def classify_locally(self, text):
+        """Local pre-classification: (language or None, analyzable)"""
+        if not self.local_langid:
+            return None, True
+        language, analyzable = langid_local.detect(text)
+        if not analyzable:
+            self.langid_stats['skipped'] += 1
+        elif language:
+            self.langid_stats['local'] += 1
+        return language, analyzable
 
     def detect_language(self, text):
-        """Detect language using Amazon Comprehend"""
+        """Detect language using Amazon Comprehend; None when the call failed"""
         try:
+            self.langid_stats['comprehend'] += 1
             response = self.comprehend.detect_dominant_language(Text=text)
             languages = response['Languages']
             if languages:
@@ -29,103 +104,359 @@ class CommentProcessor:
             return 'unknown'
         except Exception as e:
             logger.error(f"Error detecting language: {str(e)}")
-            return 'unknown'
+            return None
 
     def analyze_sentiment(self, text, language_code):
-        """Analyze sentiment using Amazon Comprehend"""
+        """Analyze sentiment using Amazon Comprehend; None when the call failed"""
         try:
             response = self.comprehend.detect_sentiment(
                 Text=text,
                 LanguageCode=language_code
             )
-            # Chuyển đổi sentiment score sang thang -1 đến 1
-            sentiment_map = {
-            'POSITIVE': 8.5,    # Tích cực
-            'NEGATIVE': 1.5,    # Tiêu cực
-            'NEUTRAL': 5.0,     # Trung tính
-            'MIXED': 5.0        # Hỗn hợp
-            }
-            return sentiment_map.get(response['Sentiment'], 0.0)
+            return SENTIMENT_MAP.get(response['Sentiment'], 0.0)
         except Exception as e:
             logger.error(f"Error analyzing sentiment: {str(e)}")
-            return 5.0
+            return None
 
     def detect_toxic(self, text, language_code):
-        """Basic toxic detection using keyword matching"""
+        """Toxic detection with the compiled per-language lexicon"""
         try:
-            # Danh sách từ độc hại cơ bản
-            toxic_words = ['fuck', 'shit', 'damn', 'hate', 'stupid', 'idiot']
-            text = text.lower()
-            word_count = len(text.split())
-            if word_count == 0:
-                return 0.0
-            
-            toxic_count = sum(1 for word in toxic_words if word in text)
-            toxic_score = (toxic_count / word_count) * 10
-            return min(10.0, toxic_score)
+            return toxicity.toxic_score(text, language_code)
         except Exception as e:
             logger.error(f"Error detecting toxic content: {str(e)}")
             return 0.0
 
+    def run_concurrently(self, func, items):
+        """Map func over items with at most ``concurrency`` calls in flight"""
+        items = list(items)
+        if self.concurrency <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(items))) as executor:
+            return list(executor.map(func, items))
+
+    def detect_language_chunk(self, texts):
+        """One BatchDetectDominantLanguage call; None marks failed documents"""
+        languages = ['unknown'] * len(texts)
+        try:
+            response = self.comprehend.batch_detect_dominant_language(
+                TextList=[truncate_utf8(text) for text in texts]
+            )
+        except Exception as e:
+            logger.error(f"Error batch detecting language: {str(e)}")
+            return [None] * len(texts)
+
+        for result in response.get('ResultList', []):
+            detected = result.get('Languages', [])
+            if detected:
+                # Lấy ngôn ngữ có score cao nhất
+                best = max(detected, key=lambda lang: lang.get('Score', 0))
+                languages[result['Index']] = best['LanguageCode']
+        for error in response.get('ErrorList', []):
+            logger.error(f"Error detecting language: {error.get('ErrorCode')} {error.get('ErrorMessage')}")
+            languages[error['Index']] = None
+        return languages
+
+    def batch_detect_language(self, texts):
+        """Detect language for many texts, 25 documents per Comprehend call.
+
+        Chunks are sent concurrently. Returns a list aligned with ``texts``:
+        a language code, 'unknown' when Comprehend has no answer, or None
+        when the document failed.
+        """
+        languages = ['unknown'] * len(texts)
+        # Comprehend không nhận document rỗng
+        indexes = [i for i, text in enumerate(texts) if text.strip()]
+        batches = list(chunks(indexes, COMPREHEND_BATCH_SIZE))
+
+        detected = self.run_concurrently(
+            lambda chunk: self.detect_language_chunk([texts[i] for i in chunk]), batches
+        )
+        for chunk, chunk_languages in zip(batches, detected):
+            for i, language in zip(chunk, chunk_languages):
+                languages[i] = language
+        return languages
+
+    def sentiment_chunk(self, texts, language):
+        """One BatchDetectSentiment call; None marks failed documents"""
+        scores = [5.0] * len(texts)
+        try:
+            response = self.comprehend.batch_detect_sentiment(
+                TextList=[truncate_utf8(text) for text in texts],
+                LanguageCode=language
+            )
+        except Exception as e:
+            logger.error(f"Error batch analyzing sentiment ({language}): {str(e)}")
+            return [None] * len(texts)
+
+        for result in response.get('ResultList', []):
+            scores[result['Index']] = SENTIMENT_MAP.get(result['Sentiment'], 0.0)
+        for error in response.get('ErrorList', []):
+            logger.error(f"Error analyzing sentiment: {error.get('ErrorCode')} {error.get('ErrorMessage')}")
+            scores[error['Index']] = None
+        return scores
+
+    def batch_analyze_sentiment(self, texts, languages):
+        """Analyze sentiment for many texts, grouped by language code.
+
+        Chunks of all languages are sent concurrently. Returns a list
+        aligned with ``texts``: a score, or None when the document failed.
+        """
+        scores = [5.0] * len(texts)
+        groups = {}
+        for i, (text, language) in enumerate(zip(texts, languages)):
+            if language is None:
+                scores[i] = None
+                continue
+            language = language if language != 'unknown' else 'en'
+            # Ngôn ngữ không được hỗ trợ giữ điểm trung tính như khi gọi đơn lẻ
+            if not text.strip() or language not in SENTIMENT_LANGUAGES:
+                continue
+            groups.setdefault(language, []).append(i)
+
+        batches = [
+            (language, chunk)
+            for language, indexes in groups.items()
+            for chunk in chunks(indexes, COMPREHEND_BATCH_SIZE)
+        ]
+        analyzed = self.run_concurrently(
+            lambda batch: self.sentiment_chunk([texts[i] for i in batch[1]], batch[0]), batches
+        )
+        for (_, chunk), chunk_scores in zip(batches, analyzed):
+            for i, score in zip(chunk, chunk_scores):
+                scores[i] = score
+        return scores
+
+    def build_result(self, comment, language, sentiment_score, toxic_score):
+        """Build the processed comment payload sent to the result queue"""
+        return {
+            'comment_id': comment['comment_id'],
+            'post_id': comment['post_id'],
+            'comment_text': comment.get('comment_text', ''),
+            'timestamp': comment['timestamp'],
+            'language': language,
+            'sentiment_score': float(sentiment_score),
+            'toxic_score': float(toxic_score),
+            'processed_status': 'COMPLETED',
+            'metadata': comment.get('metadata', {})
+        }
+
+    def send_result(self, processed_data):
+        """Send a processed comment to the result queue"""
+        try:
+            self.sqs_client.send_message(
+                QueueUrl=self.result_queue_url,
+                MessageBody=json.dumps(processed_data)
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error sending result for comment {processed_data.get('comment_id')}: {str(e)}")
+            return False
+
+    def analyze_texts(self, texts):
+        """Language, sentiment and toxicity for many texts.
+
+        Cached results are reused; identical texts among the misses are
+        analyzed once with the batched Comprehend calls. Returns a list
+        aligned with ``texts`` of dicts, or None where analysis failed.
+        """
+        results = self.cache.get_many(texts)
+
+        # Gom các text trùng nhau (sau khi chuẩn hoá) để chỉ gọi Comprehend một lần
+        pending = {}
+        for i, result in enumerate(results):
+            if result is None:
+                pending.setdefault(normalize(texts[i]), []).append(i)
+        if not pending:
+            return results
+
+        unique_texts = [texts[indexes[0]] for indexes in pending.values()]
+
+        # Chỉ gửi Comprehend những text mà bộ phân loại local không chắc chắn
+        languages = [None] * len(unique_texts)
+        analyzable = [True] * len(unique_texts)
+        uncertain = []
+        for i, text in enumerate(unique_texts):
+            languages[i], analyzable[i] = self.classify_locally(text)
+            if languages[i] is None:
+                uncertain.append(i)
+        if uncertain:
+            self.langid_stats['comprehend'] += len(uncertain)
+            detected = self.batch_detect_language([unique_texts[i] for i in uncertain])
+            for i, language in zip(uncertain, detected):
+                languages[i] = language
+
+        # Text không có chữ (emoji, URL, rỗng) giữ điểm trung tính, không gọi DetectSentiment
+        sentiments = [5.0] * len(unique_texts)
+        scored = [i for i in range(len(unique_texts)) if analyzable[i]]
+        for i, score in zip(scored, self.batch_analyze_sentiment(
+            [unique_texts[i] for i in scored], [languages[i] for i in scored]
+        )):
+            sentiments[i] = score
+
+        fresh = []
+        for text, indexes, language, sentiment_score in zip(unique_texts, pending.values(), languages, sentiments):
+            if language is None or sentiment_score is None:
+                continue
+            default_lang = language if language != 'unknown' else 'en'
+            result = {
+                'language': language,
+                'sentiment': sentiment_score,
+                'toxic': self.detect_toxic(text, default_lang)
+            }
+            fresh.append((text, result))
+            for i in indexes:
+                results[i] = result
+
+        self.cache.put_many(fresh)
+        return results
+
     def process_comment(self, comment):
         """Process a single comment"""
         try:
             text = comment.get('comment_text', '')
+
+            cached = self.cache.get_many([text])[0]
+            if cached:
+                processed_data = self.build_result(comment, cached['language'], cached['sentiment'], cached['toxic'])
+                return self.store.save_many([processed_data]) and self.send_result(processed_data)
             
             # Detect language first
-            language = self.detect_language(text)
+            language, analyzable = self.classify_locally(text)
+            if language is None:
+                language = self.detect_language(text)
+            if language is None:
+                # Lỗi tạm thời (throttle...): không cache, để SQS gửi lại record
+                return False
             default_lang = language if language != 'unknown' else 'en'
             
             # Calculate scores (gọi trực tiếp detect_toxic thay vì qua API)
-            sentiment_score = self.analyze_sentiment(text, default_lang) 
+            # Ngôn ngữ DetectSentiment không hỗ trợ giữ điểm trung tính như đường batch
+            supported = analyzable and text.strip() and default_lang in SENTIMENT_LANGUAGES
+            sentiment_score = self.analyze_sentiment(text, default_lang) if supported else 5.0
+            if sentiment_score is None:
+                return False
             toxic_score = self.detect_toxic(text, default_lang)  # Thay đổi ở đây
+            self.cache.put_many([(text, {'language': language, 'sentiment': sentiment_score, 'toxic': toxic_score})])
             
-            processed_data = {
-                'comment_id': comment['comment_id'],
-                'post_id': comment['post_id'],
-                'comment_text': text,
-                'timestamp': comment['timestamp'],
-                'language': language,
-                'sentiment_score': float(sentiment_score),
-                'toxic_score': float(toxic_score),
-                'processed_status': 'COMPLETED',
-                'metadata': comment.get('metadata', {})
-            }
+            processed_data = self.build_result(comment, language, sentiment_score, toxic_score)
             
-            # Save to DynamoDB
-            #self.table.put_item(Item=processed_data)
+            # Save to DynamoDB (dạng gọn, bỏ metadata)
+            if not self.store.save_many([processed_data]):
+                return False
             
             # Send to result queue
-            self.sqs_client.send_message(
-                QueueUrl=self.result_queue_url,
-                MessageBody=json.dumps(processed_data)
-            )
-            
-            return True
+            return self.send_result(processed_data)
         
         except Exception as e:
             logger.error(f"Error processing comment {comment.get('comment_id')}: {str(e)}")
             return False
 
-    def process_batch(self, records):
-        """Process a batch of records"""
+    def process_comments_batch(self, comments):
+        """Process many comments with batched Comprehend calls.
+
+        Returns a list of booleans aligned with ``comments``.
+        """
+        texts = [comment.get('comment_text', '') for comment in comments]
+        with metrics.timer('nlp.analyze'):
+            analyses = self.analyze_texts(texts)
+
+        results = [False] * len(comments)
+        outgoing = []
+        for i, (comment, analysis) in enumerate(zip(comments, analyses)):
+            try:
+                if analysis is None:
+                    continue
+                outgoing.append((i, self.build_result(
+                    comment, analysis['language'], analysis['sentiment'], analysis['toxic']
+                )))
+            except Exception as e:
+                logger.error(f"Error processing comment {comment.get('comment_id')}: {str(e)}")
+
+        if self.store.enabled:
+            # Lưu trước khi gửi đi: batch không lưu được thì SQS gửi lại, không cộng aggregate hai lần
+            with metrics.timer('store'):
+                if not self.store.save_many([processed_data for _, processed_data in outgoing]):
+                    outgoing = []
+
+        if self.fused:
+            with metrics.timer('aggregate'):
+                delivered = self.aggregate_results([processed_data for _, processed_data in outgoing])
+        else:
+            # Gửi kết quả theo batch (SendMessageBatch)
+            with metrics.timer('deliver'):
+                delivered = self.result_sender.send_json([processed_data for _, processed_data in outgoing])
+        for (i, _), success in zip(outgoing, delivered):
+            results[i] = success
+
+        return results
+
+    def aggregate_results(self, processed):
+        """Fused mode: apply per-post deltas in-process instead of via the Result Queue.
+
+        Returns a list of booleans aligned with ``processed``. Results of
+        posts that were stored are also sent to the Result Queue, when one
+        is configured, marked so the aggregator does not count them again.
+        """
+        failed_posts = self.aggregator.aggregate_by_post(processed) if processed else set()
+        self.aggregator.publisher.flush()
+        results = [data['post_id'] not in failed_posts for data in processed]
+
+        if self.result_queue_url:
+            audit = [data for data, success in zip(processed, results) if success]
+            sent = self.result_sender.send_json(
+                audit,
+                message_attributes={AGGREGATED_ATTRIBUTE: {'DataType': 'String', 'StringValue': 'true'}}
+            )
+            if not all(sent):
+                # Aggregate đã ghi xong, mất bản audit không làm hỏng record
+                logger.error(f"Failed to send {sent.count(False)} audit results")
+        return results
+
+    def process_batch(self, records, remaining_ms=None):
+        """Process a batch of records.
+
+        Comments are handled in slices; within a slice Comprehend and SQS
+        calls run concurrently. ``remaining_ms`` (the Lambda context's
+        get_remaining_time_in_millis) lets a large batch stop before the
+        timeout: records not started are reported as failed so SQS
+        redelivers them. Returns the messageIds that failed.
+        """
         failed_records = []
+        message_ids = []
+        comments = []
         
         for record in records:
             try:
-                comment = json.loads(record['body'])
-                success = self.process_comment(comment)
-                if not success:
-                    failed_records.append(record['messageId'])
+                comments.append(json.loads(record['body']))
+                message_ids.append(record['messageId'])
             except Exception as e:
                 logger.error(f"Error processing record: {str(e)}")
                 failed_records.append(record['messageId'])
+
+        for start in range(0, len(comments), self.slice_size):
+            if remaining_ms is not None and remaining_ms() < self.time_reserve_ms:
+                logger.warning(f"Running out of time, returning {len(comments) - start} records to the queue")
+                failed_records.extend(message_ids[start:])
+                break
+
+            batch = comments[start:start + self.slice_size]
+            # Fused mode luôn đi theo đường batch để cộng aggregate theo post một lần
+            if self.batch_mode or self.fused:
+                results = self.process_comments_batch(batch)
+            else:
+                results = self.run_concurrently(self.process_comment, batch)
+            failed_records.extend(
+                message_id
+                for message_id, success in zip(message_ids[start:start + self.slice_size], results)
+                if not success
+            )
                 
         return failed_records
 
+@instrumented
 def lambda_handler(event, context):
     """Lambda handler for processing comments"""
-    logger.info(f"Input event: {json.dumps(event)}")
+    log_payload('Input event', event)
     
     try:
         # Kiểm tra và chuẩn bị event data
@@ -140,7 +471,14 @@ def lambda_handler(event, context):
         logger.info(f"Processing {len(records)} records")
         
         processor = CommentProcessor()
-        failed_records = processor.process_batch(records)
+        remaining_ms = getattr(context, 'get_remaining_time_in_millis', None)
+        failed_records = processor.process_batch(records, remaining_ms)
+        metrics.count('records', len(records))
+        metrics.count('records.failed', len(failed_records))
+        for name, value in processor.cache.stats.items():
+            metrics.count(f'nlp_cache.{name}', value)
+        for name, value in processor.langid_stats.items():
+            metrics.count(f'langid.{name}', value)
         
         if failed_records:
             return {
@@ -153,5 +491,5 @@ def lambda_handler(event, context):
         
     except Exception as e:
         logger.error(f"Error in lambda_handler: {str(e)}")
-        logger.error(f"Event: {event}")
+        log_payload('Event', event)
         raise
\ No newline at end of file
@@ -0,0 +1,136 @@
+import json
+import os
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Giới hạn của SendMessageBatch
+SQS_MAX_BATCH_ENTRIES = 10
+SQS_MAX_BATCH_BYTES = 256 * 1024
+
+def message_size(message):
+    """Size of a message as SQS counts it (body plus attribute names, types and values)"""
+    size = len(message['MessageBody'].encode('utf-8'))
+    for name, attribute in message.get('MessageAttributes', {}).items():
+        size += len(name.encode('utf-8')) + len(attribute['DataType'].encode('utf-8'))
+        if 'StringValue' in attribute:
+            size += len(attribute['StringValue'].encode('utf-8'))
+        elif 'BinaryValue' in attribute:
+            size += len(attribute['BinaryValue'])
+    return size
+
+class SQSBatchSender:
+    def __init__(self, sqs_client, queue_url, max_retries=None, base_delay=0.1, max_workers=1):
+        """Send messages with SendMessageBatch, retrying only failed entries.
+
+        With ``max_workers`` > 1 the batches of one round are sent concurrently.
+        """
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.max_workers = max_workers
+        if max_retries is None:
+            max_retries = int(os.environ.get('SQS_SEND_MAX_RETRIES', '3'))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+    def pack(self, indexes, messages):
+        """Group message indexes into batches of at most 10 entries and 256 KB"""
+        batches = []
+        current = []
+        current_size = 0
+        for i in indexes:
+            size = message_size(messages[i])
+            if current and (len(current) == SQS_MAX_BATCH_ENTRIES or current_size + size > SQS_MAX_BATCH_BYTES):
+                batches.append(current)
+                current = []
+                current_size = 0
+            current.append(i)
+            current_size += size
+        if current:
+            batches.append(current)
+        return batches
+
+    def send_batch(self, indexes, messages):
+        """Send one batch and return the indexes that can be retried"""
+        entries = []
+        for i in indexes:
+            entry = {'Id': str(i), 'MessageBody': messages[i]['MessageBody']}
+            if messages[i].get('MessageAttributes'):
+                entry['MessageAttributes'] = messages[i]['MessageAttributes']
+            entries.append(entry)
+
+        try:
+            response = self.sqs_client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=entries
+            )
+        except Exception as e:
+            logger.error(f"Error sending batch to SQS: {str(e)}")
+            return [], list(indexes)
+
+        sent = [int(entry['Id']) for entry in response.get('Successful', [])]
+        retry = []
+        for entry in response.get('Failed', []):
+            logger.error(f"SQS rejected entry {entry['Id']}: {entry.get('Code')} {entry.get('Message')}")
+            # Lỗi phía sender (message không hợp lệ) thì gửi lại cũng không thành công
+            if not entry.get('SenderFault'):
+                retry.append(int(entry['Id']))
+        return sent, retry
+
+    def send(self, messages):
+        """Send messages and return a list of booleans aligned with ``messages``.
+
+        Each message is a dict with ``MessageBody`` and optional
+        ``MessageAttributes``, as accepted by ``send_message``.
+        """
+        results = [False] * len(messages)
+        pending = []
+        for i, message in enumerate(messages):
+            if message_size(message) > SQS_MAX_BATCH_BYTES:
+                logger.error(f"Message {i} exceeds the SQS size limit, skipping")
+                continue
+            pending.append(i)
+
+        attempt = 0
+        while pending:
+            retry = []
+            batches = self.pack(pending, messages)
+            if self.max_workers > 1 and len(batches) > 1:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                    outcomes = list(executor.map(lambda batch: self.send_batch(batch, messages), batches))
+            else:
+                outcomes = [self.send_batch(batch, messages) for batch in batches]
+
+            for sent, failed in outcomes:
+                for i in sent:
+                    results[i] = True
+                retry.extend(failed)
+
+            if not retry or attempt >= self.max_retries:
+                if retry:
+                    logger.error(f"Giving up on {len(retry)} messages after {attempt} retries")
+                    metrics.count('sqs.dropped', len(retry))
+                break
+
+            attempt += 1
+            metrics.count('sqs.resent', len(retry))
+            delay = self.base_delay * (2 ** (attempt - 1))
+            time.sleep(delay + random.uniform(0, delay))
+            pending = sorted(retry)
+
+        return results
+
+    def send_json(self, payloads, message_attributes=None, ensure_ascii=True):
+        """Serialize payloads to JSON and send them, see ``send``"""
+        messages = []
+        for payload in payloads:
+            message = {'MessageBody': json.dumps(payload, ensure_ascii=ensure_ascii)}
+            if message_attributes:
+                message['MessageAttributes'] = message_attributes
+            messages.append(message)
+        return self.send(messages)
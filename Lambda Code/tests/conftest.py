@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Các Lambda là module đơn lẻ trong thư mục cha, import trực tiếp như trên Lambda
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# moto thay cho AWS; không gửi metric EMF trong test
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('METRICS_ENABLED', 'false')
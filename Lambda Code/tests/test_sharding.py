@@ -0,0 +1,161 @@
+"""Hot-post counter sharding in aggregator.py against moto DynamoDB.
+
+Checks the invariants the sharding relies on: the base item's counters
+are folded into shard 0 exactly once, redelivered comments are not
+counted again after a reshard, a writer with a stale shard count is
+redirected by the shard_count condition, and the merged summary on the
+base item, the shards and the rollup buckets agree.
+"""
+import pytest
+from moto import mock_aws
+
+import aggregator
+from post_shards import SHARD_COUNT_ATTRIBUTE, merge_counters, shard_count, is_shard
+
+POSTS_TABLE = 'posts'
+ROLLUP_TABLE = 'rollups'
+IDEMPOTENCY_TABLE = 'idempotency'
+POST_ID = 'hot'
+BATCH_SIZE = 20
+
+def create_table(dynamodb, name, keys):
+    dynamodb.create_table(
+        TableName=name,
+        KeySchema=[{'AttributeName': key, 'KeyType': key_type} for key, key_type in keys],
+        AttributeDefinitions=[{'AttributeName': key, 'AttributeType': 'S'} for key, _ in keys],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    monkeypatch.setenv('DYNAMODB_TABLE', POSTS_TABLE)
+    monkeypatch.setenv('ROLLUP_TABLE', ROLLUP_TABLE)
+    monkeypatch.delenv('IDEMPOTENCY_TABLE', raising=False)
+    monkeypatch.setenv('HOT_POST_MAX_SHARDS', '12')
+    # Trạng thái của planner là class-level (giữ qua các lần gọi warm)
+    for state in (aggregator.ShardPlanner._rates, aggregator.ShardPlanner._counts, aggregator.ShardPlanner._contended):
+        state.clear()
+    with mock_aws():
+        import boto3
+        resource = boto3.resource('dynamodb')
+        create_table(resource, POSTS_TABLE, [('post_id', 'HASH')])
+        create_table(resource, ROLLUP_TABLE, [('post_id', 'HASH'), ('bucket', 'RANGE')])
+        create_table(resource, IDEMPOTENCY_TABLE, [('idempotency_key', 'HASH')])
+        yield resource
+
+def make_comments(start, count):
+    return [
+        {
+            'comment_id': f'c{i}',
+            'post_id': POST_ID,
+            'timestamp': 1700000000 + i * 45,
+            'language': 'vi' if i % 3 else 'en',
+            'sentiment_score': (i % 11) * 0.9,
+            'toxic_score': (i % 5) * 0.5,
+            'metadata': {'page_id': 'page'}
+        }
+        for i in range(start, start + count)
+    ]
+
+def load_post(dynamodb):
+    """(base item, merged counters of its shards)"""
+    items = {item['post_id']: item for item in dynamodb.Table(POSTS_TABLE).scan()['Items']}
+    base = items[POST_ID]
+    shards = [item for item in items.values() if is_shard(item)]
+    return base, merge_counters(shards)
+
+def rollup_total(dynamodb, prefix='d#'):
+    items = dynamodb.Table(ROLLUP_TABLE).scan()['Items']
+    return sum(int(item['total_comments']) for item in items if item['bucket'].startswith(prefix))
+
+def bin_total(counters, prefix):
+    return sum(int(value) for name, value in counters.items() if name[:2] == prefix and name[2:].isdigit())
+
+def test_redelivered_batches_across_reshards(dynamodb, monkeypatch):
+    monkeypatch.setenv('IDEMPOTENCY_TABLE', IDEMPOTENCY_TABLE)
+    # Batch đầu chưa chia shard: counter nằm trên item gốc
+    monkeypatch.setenv('HOT_POST_WRITES_PER_SHARD', '0.1')
+    agg = aggregator.CommentAggregator()
+
+    batches = [make_comments(i * BATCH_SIZE, BATCH_SIZE) for i in range(6)]
+    assert not agg.aggregate_by_post(batches[0])
+    base, _ = load_post(dynamodb)
+    assert SHARD_COUNT_ATTRIBUTE not in base
+    assert int(base['total_comments']) == BATCH_SIZE
+
+    # Từ batch 2 post nóng lên: 1 -> 10 -> 12 shard; mỗi batch gửi lại cả batch trước
+    agg.planner.writes_per_shard = 0.02
+    for previous, batch in zip(batches, batches[1:]):
+        assert not agg.aggregate_by_post(previous + batch)
+
+    # Gửi lại toàn bộ sau khi đã chia shard: không comment nào được cộng lại
+    assert not agg.aggregate_by_post([comment for batch in batches for comment in batch])
+
+    total = BATCH_SIZE * len(batches)
+    base, merged = load_post(dynamodb)
+    assert shard_count(base) == 12
+    assert int(merged['total_comments']) == total
+    assert int(base['total_comments']) == total
+    assert rollup_total(dynamodb) == total
+    assert bin_total(merged, 'sh') == bin_total(merged, 'th') == total
+    assert int(merged['lang_vi']) + int(merged['lang_en']) == total
+
+    comments = [comment for batch in batches for comment in batch]
+    sentiment_sum = sum(comment['sentiment_score'] for comment in comments)
+    toxic_sum = sum(comment['toxic_score'] for comment in comments)
+    assert float(merged['sentiment_sum']) == pytest.approx(sentiment_sum)
+    assert float(base['average_sentiment']) == pytest.approx(sentiment_sum / total)
+    assert float(base['average_toxic']) == pytest.approx(toxic_sum / total)
+
+@pytest.mark.parametrize('idempotent', [False, True])
+def test_stale_writer_is_redirected_to_shards(dynamodb, monkeypatch, idempotent):
+    if idempotent:
+        monkeypatch.setenv('IDEMPOTENCY_TABLE', IDEMPOTENCY_TABLE)
+    monkeypatch.setenv('HOT_POST_WRITES_PER_SHARD', '0.02')
+    agg = aggregator.CommentAggregator()
+    for i in range(3):
+        assert not agg.aggregate_by_post(make_comments(i * BATCH_SIZE, BATCH_SIZE))
+    base, merged = load_post(dynamodb)
+    shards = shard_count(base)
+    assert shards > 1
+
+    # Container khác chưa biết post đã chia shard: điều kiện shard_count trên item gốc phải chặn nó
+    aggregator.ShardPlanner._counts.clear()
+    aggregator.ShardPlanner._rates.clear()
+    stale = aggregator.CommentAggregator()
+    stale.planner.enabled = False
+    assert stale.planner.shard_count(POST_ID) == 1
+    assert not stale.aggregate_by_post(make_comments(3 * BATCH_SIZE, BATCH_SIZE))
+    assert stale.planner.shard_count(POST_ID) == shards
+
+    total = 4 * BATCH_SIZE
+    base, merged = load_post(dynamodb)
+    assert shard_count(base) == shards
+    assert int(merged['total_comments']) == total
+    assert int(base['total_comments']) == total
+    assert rollup_total(dynamodb) == total
+
+def test_split_aborts_when_base_changed(dynamodb, monkeypatch):
+    agg = aggregator.CommentAggregator()
+    agg.planner.enabled = False
+    assert not agg.aggregate_by_post(make_comments(0, BATCH_SIZE))
+
+    # Lần đọc trước khi chia shard thấy counter cũ, trong khi item gốc đã nhận thêm comment
+    table = agg.table
+    stale_item = table.get_item(Key={'post_id': POST_ID}, ConsistentRead=True)['Item']
+    assert not agg.aggregate_by_post(make_comments(BATCH_SIZE, BATCH_SIZE))
+    real_get_item = table.get_item
+
+    def get_item(**kwargs):
+        if 'ProjectionExpression' not in kwargs:
+            return {'Item': stale_item}
+        return real_get_item(**kwargs)
+
+    monkeypatch.setattr(table, 'get_item', get_item)
+    assert agg.reshard(POST_ID, 1, 4) == 1
+
+    # Transaction bị huỷ: không có shard nào, counter vẫn ở item gốc
+    items = dynamodb.Table(POSTS_TABLE).scan()['Items']
+    assert [item['post_id'] for item in items] == [POST_ID]
+    assert SHARD_COUNT_ATTRIBUTE not in items[0]
+    assert int(items[0]['total_comments']) == 2 * BATCH_SIZE
@@ -0,0 +1,96 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+LEXICON_DIR = os.environ.get(
+    'TOXIC_LEXICON_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lexicons')
+)
+# Lexicon tiếng Anh luôn được dùng kèm (comment thường trộn tiếng Anh)
+BASE_LANGUAGE = 'en'
+
+TOKEN_RE = re.compile(r'\w+')
+# Đánh dấu node kết thúc một term trong trie
+_END = ''
+
+# Cache theo container: language -> compiled lexicon
+_lexicons = {}
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold())
+
+class Lexicon:
+    def __init__(self, terms):
+        """Token-level trie over the lexicon terms.
+
+        Matching walks the comment's word tokens once, so cost grows with
+        the comment length rather than with the lexicon size, and a term
+        only matches whole words ("class" never matches "ass").
+        """
+        self.size = 0
+        self.root = {}
+        for term in terms:
+            tokens = tokenize(term)
+            if not tokens:
+                continue
+            node = self.root
+            for token in tokens:
+                node = node.setdefault(token, {})
+            if _END not in node:
+                node[_END] = True
+                self.size += 1
+
+    def count(self, tokens):
+        """Count every non-overlapping occurrence, preferring the longest term"""
+        count = 0
+        i = 0
+        while i < len(tokens):
+            node = self.root.get(tokens[i])
+            longest = 0
+            j = i
+            while node is not None:
+                j += 1
+                if _END in node:
+                    longest = j - i
+                node = node.get(tokens[j]) if j < len(tokens) else None
+            if longest:
+                count += 1
+                i += longest
+            else:
+                i += 1
+        return count
+
+def load_lexicon(language):
+    """Read the term list for a language, or an empty list if none ships"""
+    path = os.path.join(LEXICON_DIR, f'toxic_{language}.txt')
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [
+            line.strip() for line in f
+            if line.strip() and not line.lstrip().startswith('#')
+        ]
+
+def get_lexicon(language):
+    """Return the lexicon for a language, building it once per container"""
+    if language not in _lexicons:
+        terms = load_lexicon(language)
+        if language != BASE_LANGUAGE:
+            terms += load_lexicon(BASE_LANGUAGE)
+        _lexicons[language] = Lexicon(terms)
+        logger.info(f"Loaded {_lexicons[language].size} toxic terms for '{language}'")
+    return _lexicons[language]
+
+def count_toxic(text, language):
+    """Count every occurrence of a lexicon term in the text"""
+    return get_lexicon(language).count(tokenize(text))
+
+def toxic_score(text, language):
+    """Toxic occurrences per word, scaled to 0-10"""
+    word_count = len(text.split())
+    if word_count == 0:
+        return 0.0
+    return min(10.0, (count_toxic(text, language) / word_count) * 10)
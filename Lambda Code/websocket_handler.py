@@ -0,0 +1,58 @@
+import json
+import os
+import boto3
+import logging
+from datetime import datetime, timedelta
+from instrumentation import instrumented
+
+# Setup logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+class ConnectionRegistry:
+    def __init__(self):
+        """Track dashboard WebSocket connections in DynamoDB"""
+        self.dynamodb = boto3.resource('dynamodb')
+        self.table = self.dynamodb.Table(os.environ['CONNECTIONS_TABLE'])
+        self.ttl_hours = int(os.environ.get('CONNECTION_TTL_HOURS', '2'))
+
+    def connect(self, connection_id):
+        # API Gateway đóng kết nối sau tối đa 2 giờ, TTL dọn các bản ghi sót lại
+        expires_at = int((datetime.now() + timedelta(hours=self.ttl_hours)).timestamp())
+        self.table.put_item(
+            Item={
+                'connection_id': connection_id,
+                'connected_at': datetime.now().isoformat(),
+                'expires_at': expires_at
+            }
+        )
+        logger.info(f"Connected {connection_id}")
+
+    def disconnect(self, connection_id):
+        self.table.delete_item(Key={'connection_id': connection_id})
+        logger.info(f"Disconnected {connection_id}")
+
+@instrumented
+def lambda_handler(event, context):
+    """Lambda handler for API Gateway WebSocket $connect/$disconnect routes"""
+    try:
+        route = event['requestContext']['routeKey']
+        connection_id = event['requestContext']['connectionId']
+        registry = ConnectionRegistry()
+
+        if route == '$connect':
+            registry.connect(connection_id)
+        elif route == '$disconnect':
+            registry.disconnect(connection_id)
+        # $default: client không gửi gì lên, chỉ nhận delta
+
+        return {'statusCode': 200, 'body': ''}
+
+    except Exception as e:
+        logger.error(f"Error in lambda_handler: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'error': str(e)
+            })
+        }
@@ -1,7 +1,12 @@
 import React, { useState, useEffect } from 'react';
+import { usePostUpdates, applyDeltas } from '../../hooks/usePostUpdates';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 
 const API_URL = 'https://jktob6rblf.execute-api.ap-southeast-1.amazonaws.com/';
+// Chỉ lấy các trường dashboard hiển thị
+const POST_FIELDS = 'post_id,content,created_time,total_comments,average_sentiment,sentiment_sum';
+// Biểu đồ chỉ rộng vài trăm pixel, server giảm số điểm trước khi trả về
+const HISTORY_POINTS = 300;
 
 const SimpleDashboard = () => {
   const [posts, setPosts] = useState([]);
@@ -9,16 +14,20 @@ const SimpleDashboard = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [selectedPost, setSelectedPost] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
 
-  const fetchPosts = async () => {
+  const fetchPosts = async (cursor = null) => {
     try {
-      setLoading(true);
-      const response = await fetch(`${API_URL}/posts`);
+      if (!cursor) setLoading(true);
+      const params = new URLSearchParams({ limit: '20', sort: 'created_time', fields: POST_FIELDS });
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`${API_URL}/posts?${params}`);
       if (!response.ok) {
         throw new Error('Failed to fetch posts');
       }
       const data = await response.json();
-      setPosts(data);
+      setPosts(prev => (cursor ? [...prev, ...data.posts] : data.posts));
+      setNextCursor(data.next_cursor);
     } catch (err) {
       setError(err.message);
     } finally {
@@ -28,12 +37,17 @@ const SimpleDashboard = () => {
 
   const fetchPostHistory = async (postId) => {
     try {
-      const response = await fetch(`${API_URL}/posts/${postId}/history`);
+      const response = await fetch(`${API_URL}/posts/${postId}/history?format=columnar&points=${HISTORY_POINTS}`);
       if (!response.ok) {
         throw new Error('Failed to fetch post history');
       }
+      // Dạng cột: timestamps, sentiment, counts là các mảng song song
       const data = await response.json();
-      setPostHistory(data);
+      setPostHistory(data.timestamps.map((timestamp, i) => ({
+        last_updated: timestamp,
+        average_sentiment: data.sentiment[i],
+        total_comments: data.counts[i]
+      })));
     } catch (err) {
       console.error('Error fetching history:', err);
       setPostHistory([]);
@@ -49,6 +63,12 @@ const SimpleDashboard = () => {
     fetchPosts();
   }, []);
 
+  // Cập nhật số liệu theo delta được đẩy từ aggregator thay vì tải lại toàn bộ
+  usePostUpdates((deltas) => {
+    setPosts(prev => applyDeltas(prev, deltas));
+    setSelectedPost(prev => (prev ? applyDeltas([prev], deltas)[0] : prev));
+  });
+
   if (loading) {
     return (
       <div className="flex bg-gray-100 min-h-screen items-center justify-center">
@@ -66,7 +86,7 @@ const SimpleDashboard = () => {
         <div className="bg-white p-6 rounded-lg shadow-lg">
           <p className="text-red-500 mb-4">Lỗi: {error}</p>
           <button
-            onClick={fetchPosts}
+            onClick={() => fetchPosts()}
             className="px-4 py-2 bg-blue-500 text-white rounded hover:bg-blue-600"
           >
             Thử lại
@@ -82,7 +102,7 @@ const SimpleDashboard = () => {
         <div className="flex justify-between items-center mb-6">
           <h1 className="text-2xl font-bold">Facebook Analytics</h1>
           <button
-            onClick={fetchPosts}
+            onClick={() => fetchPosts()}
             className="px-4 py-2 border rounded-lg hover:bg-gray-50 flex items-center gap-2"
           >
             <svg className="w-4 h-4" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -120,6 +140,14 @@ const SimpleDashboard = () => {
                   </div>
                 ))}
               </div>
+              {nextCursor && (
+                <button
+                  onClick={() => fetchPosts(nextCursor)}
+                  className="mt-4 w-full px-4 py-2 border rounded-lg hover:bg-gray-50 text-sm"
+                >
+                  Tải thêm
+                </button>
+              )}
             </div>
           </div>
 
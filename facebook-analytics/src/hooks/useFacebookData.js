@@ -1,5 +1,6 @@
 // hooks/useFacebookData.js
 import { useState, useEffect } from 'react';
+import { usePostUpdates, applyDeltas } from './usePostUpdates';
 
 const API_URL = 'https://jktob6rblf.execute-api.ap-southeast-1.amazonaws.com/';
 
@@ -7,16 +8,20 @@ export const useFacebookData = () => {
   const [posts, setPosts] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
 
-  const fetchPosts = async () => {
+  const fetchPosts = async (cursor = null) => {
     try {
-      setLoading(true);
-      const response = await fetch(`${API_URL}/posts`);
+      if (!cursor) setLoading(true);
+      const params = new URLSearchParams({ limit: '20', sort: 'created_time' });
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`${API_URL}/posts?${params}`);
       if (!response.ok) {
         throw new Error('Failed to fetch posts');
       }
       const data = await response.json();
-      setPosts(data);
+      setPosts(prev => (cursor ? [...prev, ...data.posts] : data.posts));
+      setNextCursor(data.next_cursor);
     } catch (err) {
       setError(err.message);
     } finally {
@@ -28,9 +33,15 @@ export const useFacebookData = () => {
     fetchPosts();
   }, []);
 
+  usePostUpdates((deltas) => setPosts(prev => applyDeltas(prev, deltas)));
+
   const refreshData = () => {
     fetchPosts();
   };
 
-  return { posts, loading, error, refreshData };
+  const loadMore = () => {
+    if (nextCursor) fetchPosts(nextCursor);
+  };
+
+  return { posts, loading, error, refreshData, loadMore, hasMore: Boolean(nextCursor) };
 };
\ No newline at end of file
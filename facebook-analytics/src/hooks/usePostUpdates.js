@@ -0,0 +1,65 @@
+// hooks/usePostUpdates.js
+import { useEffect, useRef } from 'react';
+
+const WS_URL = import.meta.env.VITE_WS_URL;
+const RECONNECT_DELAY = 5000;
+
+// Cộng delta vào post tương ứng và tính lại trung bình
+export const applyDeltas = (posts, deltas) => {
+  const byPost = new Map(deltas.map(delta => [delta.post_id, delta]));
+  return posts.map(post => {
+    const delta = byPost.get(post.post_id);
+    if (!delta) return post;
+    const totalComments = Number(post.total_comments || 0) + delta.total_comments;
+    const sentimentSum = Number(post.sentiment_sum || 0) + delta.sentiment_sum;
+    const updated = {
+      ...post,
+      total_comments: totalComments,
+      sentiment_sum: sentimentSum,
+      average_sentiment: totalComments ? sentimentSum / totalComments : post.average_sentiment
+    };
+    // Chỉ cập nhật toxic khi post có trường này (fields= có thể bỏ qua)
+    if (post.toxic_sum !== undefined) {
+      updated.toxic_sum = Number(post.toxic_sum) + delta.toxic_sum;
+      updated.average_toxic = totalComments ? updated.toxic_sum / totalComments : post.average_toxic;
+    }
+    return updated;
+  });
+};
+
+// Nhận delta metric theo thời gian thực qua WebSocket, tự kết nối lại khi mất kết nối
+export const usePostUpdates = (onDeltas) => {
+  const handlerRef = useRef(onDeltas);
+  handlerRef.current = onDeltas;
+
+  useEffect(() => {
+    if (!WS_URL) return undefined;
+    let socket;
+    let timer;
+    let closed = false;
+
+    const connect = () => {
+      socket = new WebSocket(WS_URL);
+      socket.onmessage = (event) => {
+        try {
+          const message = JSON.parse(event.data);
+          if (message.type === 'post_deltas') {
+            handlerRef.current(message.deltas);
+          }
+        } catch (err) {
+          console.error('Error applying update:', err);
+        }
+      };
+      socket.onclose = () => {
+        if (!closed) timer = setTimeout(connect, RECONNECT_DELAY);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(timer);
+      socket.close();
+    };
+  }, []);
+};